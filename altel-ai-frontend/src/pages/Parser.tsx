@@ -15,20 +15,25 @@ export default function ParserPage() {
       max_comments: 500,
     });
     setJobId(res.data.job_id);
-    pollStatus(res.data.job_id);
+    watchStatus(res.data.job_id);
   }
 
-  async function pollStatus(jobId: string) {
-    const interval = setInterval(async () => {
-      const res = await axios.get(
-        `http://localhost:8000/api/v1/analytics/job-status?job_id=${jobId}`
-      );
-      if (res.data.status === "done") {
-        clearInterval(interval);
-        setStatus("done");
-        loadComments(res.data.job_id);
+  // Прогресс приходит с сервера (SSE) — без опроса job-status
+  function watchStatus(jobId: string) {
+    const events = new EventSource(
+      `http://localhost:8000/api/v1/parser/jobs/${jobId}/events`
+    );
+    events.addEventListener("status", (e) => {
+      const data = JSON.parse((e as MessageEvent).data);
+      setStatus(data.status);
+      if (data.status === "done") {
+        events.close();
+        loadComments(jobId);
+      } else if (["partial", "error", "cancelled", "timed_out"].includes(data.status)) {
+        events.close();
+        setLoading(false);
       }
-    }, 3000);
+    });
   }
 
   async function loadComments(jobId: string) {
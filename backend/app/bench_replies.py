@@ -0,0 +1,131 @@
+# app/bench_replies.py
+"""
+Бенчмарк параллельной догрузки реплаев (YouTubeParser.iter_comment_pages).
+
+    python -m app.bench_replies --threads 300 --latency 0.05 --concurrency 1 4 8 16
+
+Вместо YouTube Data API — фейковый клиент с фиксированной задержкой на запрос:
+у каждой ветки реплаев больше, чем приходит inline, поэтому каждая ветка стоит
+отдельного comments().list. Для каждого reply_concurrency печатается время,
+число вызовов API по методам и ускорение относительно concurrency=1; порядок
+комментариев сверяется с последовательным проходом.
+"""
+
+import argparse
+import time
+from typing import Dict, List
+
+from .service import youtube_client
+from .service.youtube_parser import YouTubeParser
+
+
+def _snippet(text: str) -> Dict:
+    return {"authorDisplayName": "bench", "textOriginal": text, "likeCount": 0,
+            "publishedAt": "2024-01-01T00:00:00Z"}
+
+
+class _Request:
+    def __init__(self, latency: float, result: Dict):
+        self.latency = latency
+        self.result = result
+
+    def execute(self) -> Dict:
+        time.sleep(self.latency)  # сетевой round trip
+        return self.result
+
+
+class FakeYouTube:
+    """commentThreads().list и comments().list поверх {thread_id: [reply_id, ...]}"""
+
+    def __init__(self, threads: Dict[str, List[str]], latency: float):
+        self.threads = threads
+        self.latency = latency
+
+    def commentThreads(self):
+        return self
+
+    def comments(self):
+        return _Comments(self)
+
+    def list(self, part, videoId, pageToken=None, maxResults=100, **kwargs):
+        ids = list(self.threads)
+        start = int(pageToken or 0)
+        items = []
+        for thread_id in ids[start:start + maxResults]:
+            replies = self.threads[thread_id]
+            item = {"snippet": {"topLevelComment": {"id": thread_id, "snippet": _snippet(thread_id)},
+                                "totalReplyCount": len(replies)}}
+            if "replies" in part and replies:
+                # как API: inline приходят не больше 5 реплаев
+                item["replies"] = {"comments": [{"id": r, "snippet": _snippet(r)} for r in replies[:5]]}
+            items.append(item)
+        result = {"items": items}
+        if start + maxResults < len(ids):
+            result["nextPageToken"] = str(start + maxResults)
+        return _Request(self.latency, result)
+
+
+class _Comments:
+    def __init__(self, api: FakeYouTube):
+        self.api = api
+
+    def list(self, part, parentId, pageToken=None, maxResults=100, **kwargs):
+        replies = self.api.threads[parentId]
+        start = int(pageToken or 0)
+        result = {"items": [{"id": r, "snippet": _snippet(r)} for r in replies[start:start + maxResults]]}
+        if start + maxResults < len(replies):
+            result["nextPageToken"] = str(start + maxResults)
+        return _Request(self.api.latency, result)
+
+
+class FakeClientPool(youtube_client.YouTubeClientPool):
+    def __init__(self, api: FakeYouTube):
+        super().__init__()
+        self.api = api
+
+    def _build(self, api_key: str):
+        self.created += 1
+        return self.api
+
+
+def make_threads(count: int, replies_per_thread: int) -> Dict[str, List[str]]:
+    return {f"t{i}": [f"t{i}.r{j}" for j in range(replies_per_thread)] for i in range(count)}
+
+
+def run(threads: Dict[str, List[str]], latency: float, concurrency: int, max_results: int) -> Dict:
+    youtube_client._pool = FakeClientPool(FakeYouTube(threads, latency))
+    parser = YouTubeParser("bench-key", reply_concurrency=concurrency)
+    started = time.monotonic()
+    comments = parser.parse_comments("bench-video", max_results=max_results)
+    return {
+        "seconds": time.monotonic() - started,
+        "ids": [c["id"] for c in comments],
+        "calls": dict(parser.call_stats),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent YouTube reply fetching")
+    parser.add_argument("--threads", type=int, default=300, help="Веток топ-комментариев")
+    parser.add_argument("--replies", type=int, default=8, help="Реплаев в ветке (больше 5 — нужен comments.list)")
+    parser.add_argument("--latency", type=float, default=0.05, help="Сек на запрос к API")
+    parser.add_argument("--max-results", type=int, default=100000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16])
+    args = parser.parse_args()
+
+    threads = make_threads(args.threads, args.replies)
+    print(f"🚀 {args.threads} threads x {args.replies} replies, {args.latency * 1000:.0f}ms per request, "
+          f"max_results={args.max_results}")
+    baseline = None
+    for concurrency in args.concurrency:
+        result = run(threads, args.latency, concurrency, args.max_results)
+        if baseline is None:
+            baseline = result
+        same_order = result["ids"] == baseline["ids"]
+        print(f"   concurrency={concurrency:<3} {result['seconds']:6.2f}s  "
+              f"x{baseline['seconds'] / result['seconds']:.1f}  comments={len(result['ids'])}  "
+              f"calls={result['calls']}  order={'ok' if same_order else 'MISMATCH'}")
+
+
+if __name__ == "__main__":
+    main()
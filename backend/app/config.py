@@ -6,25 +6,95 @@ load_dotenv()
 
 
 class Settings(BaseSettings):
+    # Хранилище: supabase или встроенный sqlite (app/storage)
+    storage_backend: str = os.getenv("STORAGE_BACKEND", "supabase")
+    storage_sqlite_db: str = os.getenv("STORAGE_SQLITE_DB", "altel.db")
+    storage_retry_attempts: int = int(os.getenv("STORAGE_RETRY_ATTEMPTS", "4"))  # при сбое хранилища в ингесте
+    storage_retry_after: int = int(os.getenv("STORAGE_RETRY_AFTER", "60"))  # сек до повтора job, если не ответило
+    source_id_cache_size: int = int(os.getenv("SOURCE_ID_CACHE_SIZE", "4096"))  # (platform, ext_id) -> source_id
+    source_id_cache_ttl: int = int(os.getenv("SOURCE_ID_CACHE_TTL", "600"))  # сек
+
     # Supabase (используем service key на сервере)
     supabase_url: str = os.getenv("SUPABASE_URL", "")
     supabase_key: str = os.getenv("SUPABASE_KEY", "")  # важное: service key!
+    # async-чтения дашборда (app/database_async.py)
+    supabase_http2: bool = os.getenv("SUPABASE_HTTP2", "True") == "True"
+    supabase_max_connections: int = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "20"))  # keep-alive соединений
+    supabase_max_concurrency: int = int(os.getenv("SUPABASE_MAX_CONCURRENCY", "50"))  # запросов одновременно
+    supabase_timeout: float = float(os.getenv("SUPABASE_TIMEOUT", "10"))  # сек
 
     # YouTube
     youtube_api_key: str = os.getenv("YOUTUBE_API_KEY")
+    youtube_api_keys: str = os.getenv("YOUTUBE_API_KEYS", "")  # несколько ключей через запятую (ротация)
+    youtube_daily_quota: int = int(os.getenv("YOUTUBE_DAILY_QUOTA", "10000"))  # units на ключ в сутки
+    youtube_quota_db: str = os.getenv("YOUTUBE_QUOTA_DB", "youtube_quota.db")
+    youtube_video_cache_ttl: int = int(os.getenv("YOUTUBE_VIDEO_CACHE_TTL", "300"))  # сек
+    youtube_channel_cache_ttl: int = int(os.getenv("YOUTUBE_CHANNEL_CACHE_TTL", "3600"))  # сек
+    youtube_reply_concurrency: int = int(os.getenv("YOUTUBE_REPLY_CONCURRENCY", "8"))  # веток реплаев параллельно
+    youtube_video_concurrency: int = int(os.getenv("YOUTUBE_VIDEO_CONCURRENCY", "3"))  # видео канала параллельно
+    youtube_inline_replies: bool = os.getenv("YOUTUBE_INLINE_REPLIES", "True") == "True"  # реплаи из commentThreads
 
     # Instagram
     instagram_username: str = os.getenv("INSTAGRAM_USERNAME", "")
     instagram_password: str = os.getenv("INSTAGRAM_PASSWORD", "")
     instagram_session_file: str = os.getenv("INSTAGRAM_SESSION_FILE", "")
-    instagram_min_delay: int = 5
-    instagram_max_requests_per_hour: int = 50
+    instagram_sessions_dir: str = os.getenv("INSTAGRAM_SESSIONS_DIR", "./sessions")  # пул сессий
+    instagram_session_refresh_interval: int = int(os.getenv("INSTAGRAM_SESSION_REFRESH_INTERVAL", "1800"))  # сек, 0 — выкл
+    instagram_min_delay: float = float(os.getenv("INSTAGRAM_MIN_DELAY", "1"))  # сек на запрос: предел разгона AIMD
+    instagram_start_delay: float = float(os.getenv("INSTAGRAM_START_DELAY", "5"))  # пока темп не выучен
+    instagram_max_delay: float = float(os.getenv("INSTAGRAM_MAX_DELAY", "300"))  # предел замедления AIMD
+    instagram_max_requests_per_hour: int = int(os.getenv("INSTAGRAM_MAX_REQUESTS_PER_HOUR", "3600"))  # окно на аккаунт: потолок, темп задаёт AIMD
+    instagram_rate_limit_db: str = os.getenv("INSTAGRAM_RATE_LIMIT_DB", "instagram_rate_limit.db")
+    instagram_cursor_dir: str = os.getenv("INSTAGRAM_CURSOR_DIR", "./instagram_cursors")  # чекпоинты комментариев
+    # Ingest pipeline
+    ingest_chunk_size: int = int(os.getenv("INGEST_CHUNK_SIZE", "2000"))  # строк между обновлениями прогресса
+    ingest_upsert_rows: int = int(os.getenv("INGEST_UPSERT_ROWS", "500"))  # строк в одном upsert
+    ingest_upsert_max_bytes: int = int(os.getenv("INGEST_UPSERT_MAX_BYTES", "1000000"))  # JSON одного upsert
+    ingest_upsert_concurrency: int = int(os.getenv("INGEST_UPSERT_CONCURRENCY", "4"))  # upsert'ов на процесс
+    ingest_upsert_attempts: int = int(os.getenv("INGEST_UPSERT_ATTEMPTS", "3"))  # попыток на чанк
+    # Локальный outbox комментариев (app/service/comment_outbox.py)
+    outbox_db: str = os.getenv("OUTBOX_DB", "comment_outbox.db")
+    outbox_batch_size: int = int(os.getenv("OUTBOX_BATCH_SIZE", "2000"))  # строк за один проход flusher'а
+    outbox_flush_interval: float = float(os.getenv("OUTBOX_FLUSH_INTERVAL", "1"))  # сек, если outbox пуст
+    outbox_max_backoff: int = int(os.getenv("OUTBOX_MAX_BACKOFF", "300"))  # сек между повторами строки
+    outbox_max_attempts: int = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "100"))  # затем dead letter, 0 — без предела
+    outbox_drain_timeout: int = int(os.getenv("OUTBOX_DRAIN_TIMEOUT", "30"))  # сек на дозапись при остановке
+    ingest_queue_pages: int = int(os.getenv("INGEST_QUEUE_PAGES", "8"))  # страниц между fetch и записью
+    # Очередь задач (app/worker.py)
+    job_queue_db: str = os.getenv("JOB_QUEUE_DB", "job_queue.db")
+    job_lease_seconds: int = int(os.getenv("JOB_LEASE_SECONDS", "120"))  # без heartbeat задача вернётся в очередь
+    job_max_attempts: int = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+    job_limit_youtube: int = int(os.getenv("JOB_LIMIT_YOUTUBE", "4"))  # одновременных задач на все воркеры
+    job_limit_instagram: int = int(os.getenv("JOB_LIMIT_INSTAGRAM", "2"))
+    job_timeout: int = int(os.getenv("JOB_TIMEOUT", "3600"))  # сек на попытку, 0 — без дедлайна
+    job_cancel_poll_interval: float = float(os.getenv("JOB_CANCEL_POLL_INTERVAL", "1"))  # сек
+    job_coalesce_window: int = int(os.getenv("JOB_COALESCE_WINDOW", "600"))  # сек: повторный /start вернёт готовый job
+    bulk_max_urls: int = int(os.getenv("BULK_MAX_URLS", "1000"))  # ссылок в одном /parser/bulk
+    # Watchlist: автоматический повторный обход
+    watchlist_min_interval: int = int(os.getenv("WATCHLIST_MIN_INTERVAL", "300"))  # сек, вирусный контент
+    watchlist_max_interval: int = int(os.getenv("WATCHLIST_MAX_INTERVAL", "86400"))  # сек, затихший
+    watchlist_initial_interval: int = int(os.getenv("WATCHLIST_INITIAL_INTERVAL", "3600"))  # пока скорость неизвестна
+    watchlist_comments_per_crawl: int = int(os.getenv("WATCHLIST_COMMENTS_PER_CRAWL", "50"))
+    watchlist_youtube_share: float = float(os.getenv("WATCHLIST_YOUTUBE_SHARE", "0.5"))  # доля суточной квоты
+    watchlist_instagram_share: float = float(os.getenv("WATCHLIST_INSTAGRAM_SHARE", "0.5"))  # доля часового лимита
+    watchlist_poll_interval: int = int(os.getenv("WATCHLIST_POLL_INTERVAL", "30"))  # сек между проверками в воркере
+    # События прогресса (SSE /parser/jobs/{id}/events)
+    job_events_db: str = os.getenv("JOB_EVENTS_DB", "job_events.db")
+    job_events_ttl: int = int(os.getenv("JOB_EVENTS_TTL", "86400"))  # сек хранения событий
+    job_events_poll_interval: float = float(os.getenv("JOB_EVENTS_POLL_INTERVAL", "0.5"))  # сек, на процесс API
     # ML Service
     ml_service_url: str = "http://localhost:5000"
 
     # App
     debug: bool = os.getenv("DEBUG", "True") == "True"
 
+    @property
+    def youtube_keys(self) -> list[str]:
+        keys = [k.strip() for k in self.youtube_api_keys.split(",") if k.strip()]
+        if self.youtube_api_key and self.youtube_api_key not in keys:
+            keys.insert(0, self.youtube_api_key)
+        return keys
+
     class Config:
         env_file = ".env"
 
@@ -1,24 +1,62 @@
-from supabase import create_client, Client
+from functools import wraps
 from .config import settings
+from .service.bulk_writer import get_bulk_writer
+from .service.cancellation import interruptible_sleep
+from .service.job_events import publish_event
+from .storage.base import get_storage, source_id_cache
 
-def get_supabase() -> Client:
-    if not settings.supabase_url or not settings.supabase_key:
-        raise RuntimeError("Supabase creds missing. Check SUPABASE_URL and SUPABASE_SERVICE_KEY in .env")
-    return create_client(settings.supabase_url, settings.supabase_key)
+# Функции ингеста поверх хранилища (app/storage: Supabase или встроенный SQLite — STORAGE_BACKEND).
+# Хранилище создаётся при первом вызове, поэтому импорт app не требует доступа к базе.
 
-supabase = get_supabase()
+class StorageUnavailable(Exception):
+    """Хранилище не ответило за все повторы — задачу стоит вернуть в очередь, а не завершать с ошибкой"""
 
+def _retry_transient(fn):
+    """Повторяет вызов при сбое хранилища (сеть, 5xx, таймаут, блокировка), затем StorageUnavailable"""
+    @wraps(fn)
+    def run(*args, **kwargs):
+        attempts = settings.storage_retry_attempts
+        for attempt in range(1, attempts + 1):
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if not get_storage().is_transient(e):
+                    raise
+                if attempt == attempts:
+                    raise StorageUnavailable(f"{fn.__name__}: {e}") from e
+                delay = 2 ** (attempt - 1)
+                print(f"⚠️ Storage {fn.__name__} failed (attempt {attempt}/{attempts}): {e}; retry in {delay}s")
+                interruptible_sleep(delay)
+    return run
+
+@_retry_transient
 def upsert_account(platform: str, handle: str, url: str, title: str | None = None) -> str:
-    data = {"platform": platform, "handle": handle, "url": url, "title": title}
-    res = supabase.table("accounts").upsert(data, on_conflict="platform,handle").execute()
-    # supabase v2 возвращает список строк; берем id из первой
-    return res.data[0]["id"]
+    return get_storage().upsert_account(platform, handle, url, title)
+
+def create_job(source_type: str, input_url: str, status: str = "running") -> str:
+    return create_jobs([{"source_type": source_type, "input_url": input_url}], status=status)[0]
+
+def create_jobs(jobs: list[dict], status: str = "queued") -> list[str]:
+    """Пакетный create_job: [{source_type, input_url}] -> id в том же порядке, одним запросом"""
+    if not jobs:
+        return []
+    job_ids = get_storage().create_jobs(jobs, status=status)
+    for job_id in job_ids:
+        publish_event(job_id, "status", status=status)
+    return job_ids
 
-def create_job(source_type: str, input_url: str) -> str:
-    data = {"source_type": source_type, "input_url": input_url, "status": "running"}
-    res = supabase.table("jobs").insert(data).execute()
-    return res.data[0]["id"]
+def delete_jobs(job_ids: list[str]) -> None:
+    """Удаляет jobs, созданные для задач, которые в очередь так и не попали"""
+    if job_ids:
+        get_storage().delete_jobs(job_ids)
 
+def get_jobs(job_ids: list[str]) -> dict[str, dict]:
+    """id -> {status, stats_total, stats_processed, error} одним запросом"""
+    if not job_ids:
+        return {}
+    return get_storage().get_jobs(job_ids)
+
+@_retry_transient
 def upsert_source(job_id: str, account_id: str, platform: str, ext_id: str,
                   title: str, author: str, published_at: str | None, raw_meta: dict | None = None) -> str:
     data = {
@@ -31,10 +69,34 @@ def upsert_source(job_id: str, account_id: str, platform: str, ext_id: str,
         "published_at": published_at,
         "raw_meta": raw_meta or {}
     }
-    res = supabase.table("sources").upsert(data, on_conflict="platform,ext_id").execute()
-    return res.data[0]["id"]
+    source_id_cache.invalidate((platform, ext_id))
+    source_id = get_storage().upsert_source(data)
+    source_id_cache.set((platform, ext_id), source_id)
+    return source_id
 
-def insert_comments_batch(source_id: str, comments: list[dict]) -> int:
+def get_source(platform: str, ext_id: str) -> dict | None:
+    return get_sources(platform, [ext_id]).get(ext_id)
+
+@_retry_transient
+def get_sources(platform: str, ext_ids: list[str]) -> dict[str, dict]:
+    """Пакетный get_source: ext_id -> {id, ext_id, raw_meta} одним запросом"""
+    if not ext_ids:
+        return {}
+    sources = get_storage().get_sources(platform, ext_ids)
+    for ext_id, row in sources.items():
+        source_id_cache.set((platform, ext_id), row["id"])
+    return sources
+
+@_retry_transient
+def update_source_meta(source_id: str, raw_meta: dict) -> None:
+    get_storage().update_source_meta(source_id, raw_meta)
+
+def upsert_comment_rows(rows: list[dict]) -> int:
+    """Один upsert готовых строк comments (идемпотентно по source_id, ext_comment_id)"""
+    return get_storage().upsert_comments(rows)
+
+def comment_rows(source_id: str, comments: list[dict]) -> list[dict]:
+    """Комментарии парсера -> строки таблицы comments"""
     rows = []
     for c in comments:
         rows.append({
@@ -49,16 +111,28 @@ def insert_comments_batch(source_id: str, comments: list[dict]) -> int:
             "status": "queued",
             "meta": {"likes": c.get("likes", 0), "updated_at": c.get("updated_at")}
         })
+    return rows
+
+def upsert_comments(source_id: str, comments: list[dict]) -> dict:
+    """
+    Пакетный upsert комментариев source: чанками, параллельно, с повтором упавших чанков.
+    Returns: {"written", "seconds", "chunks": [{"rows", "written", "attempts", "seconds"}]}
+    """
+    rows = comment_rows(source_id, comments)
     if not rows:
-        return 0
-    res = supabase.table("comments").upsert(rows, on_conflict="source_id,ext_comment_id").execute()
-    # res.data может быть None, если представление не возвращено — но по умолчанию вернётся список
-    return len(res.data or rows)
+        return {"written": 0, "seconds": 0.0, "chunks": []}
+    return get_bulk_writer().write(upsert_comment_rows, rows)
+
+def insert_comments_batch(source_id: str, comments: list[dict]) -> int:
+    return upsert_comments(source_id, comments)["written"]
 
+@_retry_transient
 def mark_job(job_id: str, status: str, stats_total: int | None = None,
              stats_processed: int | None = None, error: str | None = None) -> None:
     payload = {"status": status}
     if stats_total is not None: payload["stats_total"] = stats_total
     if stats_processed is not None: payload["stats_processed"] = stats_processed
     if error is not None: payload["error"] = error
-    supabase.table("jobs").update(payload).eq("id", job_id).execute()
+    get_storage().update_job(job_id, payload)
+    # тот же статус и счётчики — подписчикам SSE, без повторного чтения jobs
+    publish_event(job_id, "status", **payload)
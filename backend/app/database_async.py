@@ -0,0 +1,181 @@
+# app/database_async.py
+"""
+Асинхронный доступ к Supabase (PostgREST) для чтений дашборда.
+
+Синхронный клиент из database.py блокирует поток на каждом .execute(), а FastAPI
+выполняет sync-эндпоинты в общем threadpool (40 потоков на процесс): десяток
+медленных выгрузок — и остальные запросы ждут свободный поток. Здесь запросы идут
+через один httpx.AsyncClient на процесс:
+
+- keep-alive соединения (HTTP/2 — несколько запросов в одном соединении);
+- не больше max_concurrency запросов к PostgREST одновременно (семафор), остальные
+  ждут в event loop, а не занимают потоки;
+- таймауты на соединение, ответ и ожидание соединения из пула.
+
+Интерфейс повторяет построитель запросов supabase-py, только execute() — корутина:
+
+    rows = await get_async_db().table("comments").select("*").eq("status", "done").limit(10).execute()
+
+Ингест по-прежнему пишет через database.py: он выполняется в процессах воркеров
+(app/worker.py), где блокирующие вызовы никому не мешают.
+"""
+
+import asyncio
+import threading
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from .config import settings
+
+
+class PostgrestError(Exception):
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"PostgREST {status_code}: {message}")
+        self.status_code = status_code
+
+
+def _quote(value: Any) -> str:
+    """Значение для in.(...): в кавычках, если в нём есть разделители PostgREST"""
+    s = str(value)
+    if any(ch in s for ch in ',.:()"\\ '):
+        s = '"' + s.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return s
+
+
+class AsyncQuery:
+    def __init__(self, db: "AsyncPostgrest", table: str):
+        self._db = db
+        self._table = table
+        self._params: List[tuple] = []
+
+    def select(self, columns: str = "*") -> "AsyncQuery":
+        self._params.append(("select", columns))
+        return self
+
+    def _filter(self, column: str, op: str, value: Any) -> "AsyncQuery":
+        self._params.append((column, f"{op}.{value}"))
+        return self
+
+    def eq(self, column: str, value: Any) -> "AsyncQuery":
+        return self._filter(column, "eq", value)
+
+    def gte(self, column: str, value: Any) -> "AsyncQuery":
+        return self._filter(column, "gte", value)
+
+    def lte(self, column: str, value: Any) -> "AsyncQuery":
+        return self._filter(column, "lte", value)
+
+    def in_(self, column: str, values: List[Any]) -> "AsyncQuery":
+        return self._filter(column, "in", f"({','.join(_quote(v) for v in values)})")
+
+    def order(self, column: str, desc: bool = False) -> "AsyncQuery":
+        self._params.append(("order", f"{column}.{'desc' if desc else 'asc'}"))
+        return self
+
+    def limit(self, n: int) -> "AsyncQuery":
+        self._params.append(("limit", str(n)))
+        return self
+
+    async def execute(self) -> List[Dict]:
+        return await self._db.get(self._table, self._params)
+
+
+class AsyncPostgrest:
+    def __init__(self, url: str, key: str, http2: bool = True, max_connections: int = 20,
+                 max_concurrency: int = 50, timeout: float = 10):
+        """
+        Args:
+            url / key: SUPABASE_URL и service key
+            http2: мультиплексировать запросы в keep-alive соединениях
+            max_connections: соединений к PostgREST в пуле
+            max_concurrency: запросов к PostgREST одновременно на процесс
+            timeout: сек на соединение, ответ и ожидание соединения из пула
+        """
+        self.base_url = url.rstrip("/") + "/rest/v1"
+        self.headers = {"apikey": key, "Authorization": f"Bearer {key}", "Accept": "application/json"}
+        self.http2 = http2
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        # клиент и семафор привязаны к event loop — создаются в нём при первом запросе
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.waiting = 0
+
+    def _ensure_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                http2=self.http2,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                timeout=httpx.Timeout(self.timeout),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    def table(self, name: str) -> AsyncQuery:
+        return AsyncQuery(self, name)
+
+    async def get(self, table: str, params: List[tuple]) -> List[Dict]:
+        client = self._ensure_client()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            res = await client.get(f"/{table}", params=params)
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+        if res.status_code >= 400:
+            try:
+                message = res.json().get("message", res.text)
+            except ValueError:
+                message = res.text
+            raise PostgrestError(res.status_code, message)
+        return res.json()
+
+    async def get_jobs(self, job_ids: List[str]) -> Dict[str, Dict]:
+        """Асинхронный database.get_jobs: id -> {status, stats_total, stats_processed, error}"""
+        if not job_ids:
+            return {}
+        rows = await self.table("jobs").select("id,status,stats_total,stats_processed,error") \
+            .in_("id", job_ids).execute()
+        return {row["id"]: row for row in rows}
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._semaphore = None
+
+    def stats(self) -> Dict:
+        return {"http2": self.http2, "max_concurrency": self.max_concurrency,
+                "in_flight": self.in_flight, "waiting": self.waiting}
+
+
+_async_db: Optional[AsyncPostgrest] = None
+_async_db_lock = threading.Lock()
+
+
+def get_async_db() -> AsyncPostgrest:
+    global _async_db
+    with _async_db_lock:
+        if _async_db is None:
+            if not settings.supabase_url or not settings.supabase_key:
+                raise RuntimeError("Supabase creds missing. Check SUPABASE_URL and SUPABASE_SERVICE_KEY in .env")
+            _async_db = AsyncPostgrest(
+                settings.supabase_url,
+                settings.supabase_key,
+                http2=settings.supabase_http2,
+                max_connections=settings.supabase_max_connections,
+                max_concurrency=settings.supabase_max_concurrency,
+                timeout=settings.supabase_timeout
+            )
+        return _async_db
@@ -0,0 +1,138 @@
+# app/loadtest.py
+"""
+Нагрузочный тест чтений дашборда.
+
+    python -m app.loadtest --base-url http://localhost:8000 --clients 200 --duration 30
+
+N клиентов в цикле дёргают эндпоинты дашборда (comments, job-status, report,
+aggregates) или заданные --path, параллельно отдельный клиент раз в 100 мс опрашивает /health —
+его задержка показывает, ждут ли лёгкие запросы свободный поток. Итог: запросов
+в секунду, p50/p95/p99 и ошибки по эндпоинтам.
+
+Сравнение sync и async слоя: запустить API (uvicorn app.main:app --workers 1) на
+коммите до app/database_async.py, прогнать тест, затем то же на текущем коде.
+С sync-эндпоинтами пропускная способность упирается в threadpool (40 потоков на
+процесс) и растёт задержка /health; с async — в max_concurrency и сам PostgREST.
+
+Замер: 1 CPU на всё (API, нагрузка, фейковый PostgREST), 200 клиентов, 20 с:
+    PostgREST 50 мс   sync  81.7 req/s  p50 2.3 с  p99 6.1 с  /health p50 2017 мс
+                      async 76.5 req/s  p50 2.9 с  p99 4.3 с  /health p50 34 мс
+    PostgREST 300 мс  sync  72.5 req/s  p50 2.9 с  p99 5.8 с  /health p50 2162 мс
+                      async 60.1 req/s  p50 3.8 с  p99 4.7 с  /health p50 33 мс
+На одном ядре оба варианта упираются в CPU (~7 мс на запрос в API), поэтому req/s
+не растёт; async убирает голодание лёгких запросов и длинный хвост задержек.
+
+Список комментариев источника до и после кэша source_id и join в одном запросе:
+    python -m app.loadtest --clients 1 --path '/api/v1/comments?source_ext_id=vid1&limit=100'
+    python -m app.loadtest --clients 1 --path '/api/v1/comments?source_ext_id=v{n}&limit=100'
+Замер: тот же стенд, PostgREST 50 мс, 15 с; p50 (req/s):
+                      1 клиент          10 клиентов
+    два запроса       113 мс (8.7)      157 мс (62.3)
+    кэш (vid1)         61 мс (15.9)     113 мс (85.1)
+    промах (v{n})      60 мс (16.7)     116 мс (83.1)
+Один клиент — задержка падает вдвое (один round trip вместо двух); при 10 клиентах
+снова упирается в CPU, выигрыш меньше.
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import httpx
+
+DASHBOARD_ENDPOINTS = [
+    "/api/v1/comments?limit=100",
+    "/api/v1/comments?status=queued&limit=50",
+    "/api/v1/analytics/report?limit=200",
+    "/api/v1/analytics/aggregates",
+]
+
+
+def _percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def _client_loop(http: httpx.AsyncClient, endpoints: List[str], deadline: float,
+                       latencies: Dict[str, List[float]], errors: Dict[str, int]) -> None:
+    while time.monotonic() < deadline:
+        # {n} — новое значение на каждый запрос: мимо кэшей API
+        path = random.choice(endpoints).replace("{n}", str(random.randrange(10 ** 9)))
+        started = time.monotonic()
+        try:
+            res = await http.get(path)
+            ok = res.status_code < 400
+        except httpx.HTTPError:
+            ok = False
+        key = path.split("?")[0]
+        latencies[key].append(time.monotonic() - started)
+        if not ok:
+            errors[key] += 1
+
+
+async def _health_probe(http: httpx.AsyncClient, deadline: float, latencies: List[float]) -> None:
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        try:
+            await http.get("/health")
+            latencies.append(time.monotonic() - started)
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.1)
+
+
+async def run(base_url: str, clients: int, duration: float, endpoints: List[str]) -> Dict:
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    health: List[float] = []
+    limits = httpx.Limits(max_connections=clients + 1, max_keepalive_connections=clients + 1)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as http:
+        deadline = time.monotonic() + duration
+        await asyncio.gather(
+            _health_probe(http, deadline, health),
+            *[_client_loop(http, endpoints, deadline, latencies, errors) for _ in range(clients)]
+        )
+    total = sum(len(v) for v in latencies.values())
+    return {
+        "requests": total,
+        "rps": total / duration,
+        "endpoints": {
+            path: {"count": len(v), "errors": errors[path], "p50": _percentile(v, 0.5),
+                   "p95": _percentile(v, 0.95), "p99": _percentile(v, 0.99)}
+            for path, v in sorted(latencies.items())
+        },
+        "health": {"p50": _percentile(health, 0.5), "p99": _percentile(health, 0.99)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for dashboard read endpoints")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--clients", type=int, default=100, help="Одновременных клиентов")
+    parser.add_argument("--duration", type=float, default=30, help="Сек")
+    parser.add_argument("--job-id", default="", help="Добавить /analytics/job-status для этого job")
+    parser.add_argument("--path", action="append", default=[],
+                        help="Нагружать только эти пути вместо дашборда; {n} — случайное число на запрос")
+    args = parser.parse_args()
+
+    endpoints = args.path or list(DASHBOARD_ENDPOINTS)
+    if args.job_id:
+        endpoints.append(f"/api/v1/analytics/job-status?job_id={args.job_id}")
+
+    print(f"🚀 {args.clients} clients x {args.duration:.0f}s -> {args.base_url}")
+    result = asyncio.run(run(args.base_url, args.clients, args.duration, endpoints))
+    print(f"📊 {result['requests']} requests, {result['rps']:.1f} req/s")
+    for path, s in result["endpoints"].items():
+        print(f"   {path:<32} n={s['count']:<6} err={s['errors']:<4} "
+              f"p50={s['p50'] * 1000:.0f}ms p95={s['p95'] * 1000:.0f}ms p99={s['p99'] * 1000:.0f}ms")
+    h = result["health"]
+    print(f"   /health under load               p50={h['p50'] * 1000:.0f}ms p99={h['p99'] * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,10 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from datetime import datetime
 
-from .routers import parser, comments, analytics
+from .routers import parser, comments, analytics, watchlist
+from .routers.service.instagram_session_pool import close_session_pool
+from .service.youtube_client import get_client_pool
+from .storage.base import get_storage
 
 app = FastAPI(title="Altel AI Moderator API", version="1.0.0")
 
@@ -17,6 +20,16 @@ app.add_middleware(
 app.include_router(parser.router, prefix="/api/v1/parser", tags=["Parser"])
 app.include_router(comments.router, prefix="/api/v1/comments", tags=["Comments"])
 app.include_router(analytics.router, prefix="/api/v1/analytics", tags=["Analytics"])
+app.include_router(watchlist.router, prefix="/api/v1/watchlist", tags=["Watchlist"])
+
+@app.on_event("shutdown")
+async def close_clients():
+    # keep-alive соединения к PostgREST (Supabase)
+    await get_storage().aclose()
+    # keep-alive соединения к YouTube API
+    get_client_pool().close()
+    # Instagram сессии: сохраняем cookies и закрываем HTTP-сессии
+    close_session_pool()
 
 @app.get("/")
 def root():
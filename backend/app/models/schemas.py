@@ -5,6 +5,21 @@ from typing import Optional, List, Dict
 class ParseRequest(BaseModel):
     url: str
     max_comments: int = 500
+    max_videos: int = 50  # для ссылок на канал/плейлист; max_comments тогда — на одно видео
+    incremental: bool = False  # только новые комментарии с прошлого ингеста (водяной знак source)
+    timeout_seconds: Optional[int] = None  # дедлайн job (по умолчанию JOB_TIMEOUT), потом — timed_out
+
+class BulkParseRequest(BaseModel):
+    urls: List[str]
+    max_comments: int = 500  # на одну ссылку (для канала/плейлиста — на одно видео)
+    max_videos: int = 50
+    incremental: bool = False
+    timeout_seconds: Optional[int] = None  # дедлайн каждого дочернего job, как у ParseRequest
+
+class WatchRequest(BaseModel):
+    url: str
+    max_comments: int = 500  # на один обход
+    max_videos: int = 50
 
 # ---- Responses ----
 class JobStatus(BaseModel):
@@ -13,6 +28,26 @@ class JobStatus(BaseModel):
     stats_total: Optional[int] = None
     stats_processed: Optional[int] = None
     error: Optional[str] = None
+    coalesced: bool = False  # тот же контент уже в работе/недавно спарсен — возвращён существующий job
+
+class BulkChild(BaseModel):
+    url: str
+    job_id: Optional[str] = None
+    target: Optional[str] = None
+    status: str
+    coalesced: bool = False  # ссылка попала на уже существующий job
+    duplicate_of: Optional[str] = None  # та же цель встречается в списке раньше (url первой)
+    stats_total: Optional[int] = None
+    stats_processed: Optional[int] = None
+    error: Optional[str] = None
+
+class BulkJobStatus(BaseModel):
+    job_id: str
+    status: str
+    counts: Dict[str, int]  # статус -> количество дочерних job
+    stats_total: Optional[int] = None
+    stats_processed: Optional[int] = None
+    children: List[BulkChild]
 
 class CommentRow(BaseModel):
     comment_id: str = Field(alias="id")
@@ -1,7 +1,9 @@
 from fastapi import APIRouter, Query, HTTPException
 from typing import Optional, Any
-from ..database import supabase
+from ..storage.base import get_storage
+from ..service.comment_outbox import get_comment_outbox
 from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 import io
 import csv
 import json
@@ -12,33 +14,40 @@ from openpyxl import Workbook
 router = APIRouter()
 
 @router.get("/job-status")
-def job_status(job_id: str):
-    res = supabase.table("jobs").select("*").eq("id", job_id).limit(1).execute()
-    if not res.data:
+async def job_status(job_id: str):
+    row = await get_storage().fetch_job(job_id)
+    if row is None:
         return {"job_id": job_id, "status": "not_found"}
-    row = res.data[0]
+    # done — комментарии в локальном outbox; persisting, пока flusher не дописал их в хранилище;
+    # outbox_failed — строки, которые хранилище не приняло (dead letter, не повторяются)
+    outbox = get_comment_outbox()
+    pending = await run_in_threadpool(outbox.pending, job_id)
+    failed = await run_in_threadpool(outbox.failed, job_id)
     return {
         "job_id": row["id"],
         "status": row["status"],
         "stats_total": row.get("stats_total"),
         "stats_processed": row.get("stats_processed"),
         "error": row.get("error"),
+        "outbox_pending": pending,
+        "outbox_failed": failed,
+        "persisting": pending > 0,
     }
 
 @router.get("/report")
-def report(limit: int = 200):
-    res = supabase.table("v_comments_full").select("*").order("commented_at", desc=True).limit(limit).execute()
-    return {"rows": res.data}
+async def report(limit: int = 200):
+    rows = await get_storage().fetch_report(limit=limit)
+    return {"rows": rows}
 
 @router.get("/aggregates")
-def aggregates():
-    res = supabase.table("v_dashboard_aggregates").select("*").execute()
-    return {"rows": res.data}
+async def aggregates():
+    rows = await get_storage().fetch_aggregates()
+    return {"rows": rows}
 
 # ---------------------------
 # NEW: Export CSV / XLSX / XML
 # ---------------------------
-def _query_rows(
+async def _query_rows(
     platform: Optional[str],
     account: Optional[str],
     source_ext_id: Optional[str],
@@ -46,23 +55,8 @@ def _query_rows(
     date_to: Optional[str],
     limit: int,
 ):
-    q = supabase.table("v_comments_full").select("*")
-    if platform:
-        q = q.eq("platform", platform)
-    if account:
-        q = q.eq("account_handle", account)
-    if source_ext_id:
-        q = q.eq("source_ext_id", source_ext_id)
-    # date range по commented_at (ISO8601)
-    if date_from:
-        q = q.gte("commented_at", date_from)
-    if date_to:
-        q = q.lte("commented_at", date_to)
-
-    # сортировка от новых к старым, лимит
-    q = q.order("commented_at", desc=True).limit(limit)
-    res = q.execute()
-    return res.data or []
+    return await get_storage().fetch_report(platform=platform, account=account, source_ext_id=source_ext_id,
+                                            date_from=date_from, date_to=date_to, limit=limit)
 
 def _normalize_cell(v: Any) -> Any:
     # Приводим dict/list к JSON-строке, ISO для дат, остальное как есть
@@ -73,7 +67,7 @@ def _normalize_cell(v: Any) -> Any:
     return v
 
 @router.get("/export")
-def export_report(
+async def export_report(
     format: str = Query("csv", pattern="^(csv|xlsx|xml)$", description="csv|xlsx|xml"),
     platform: Optional[str] = Query(None, description="youtube|instagram|vk|..."),
     account: Optional[str] = Query(None, description="account_handle, например ALTEL5G"),
@@ -82,7 +76,11 @@ def export_report(
     date_to: Optional[str] = Query(None, description="ISO 8601"),
     limit: int = Query(1000, ge=1, le=50000),
 ):
-    rows = _query_rows(platform, account, source_ext_id, date_from, date_to, limit)
+    rows = await _query_rows(platform, account, source_ext_id, date_from, date_to, limit)
+    # сборка файла до 50000 строк — CPU, не держим event loop
+    return await run_in_threadpool(_render_export, format, rows)
+
+def _render_export(format: str, rows: list):
     if not rows:
         # Вернём пустой файл нужного формата
         rows = []
@@ -1,13 +1,36 @@
 # app/routers/parser.py
 
-from fastapi import APIRouter, BackgroundTasks, HTTPException
-
-from .service.instagram_parser import InstagramParser
-from ..models.schemas import ParseRequest, JobStatus
+import io
+import json
+import re
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from fastapi import APIRouter, File, Header, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from openpyxl import load_workbook
+
+from .service.instagram_comment_cursors import get_cursor_store
+from .service.instagram_parser import InstagramParser, JobFetchCache
+from .service.instagram_session_pool import InstagramSessionPool, NoSessionAvailable, get_session_pool
+from ..models.schemas import ParseRequest, JobStatus, BulkParseRequest, BulkChild, BulkJobStatus
 from ..service.youtube_parser import YouTubeParser
+from ..service.ingest_pipeline import stream_comments, JobProgress
+from ..service.watermarks import WatermarkTracker
+from ..service.youtube_quota import get_quota_ledger, next_reset, QuotaExhausted
+from ..service.job_queue import get_job_queue, RetryLater, FINISHED_STATUSES
+from ..service.cancellation import JobCancelled, propagate_context
+from ..service.job_events import get_event_bus, TERMINAL_STATUSES
+from ..service.comment_outbox import get_comment_outbox
 from ..config import settings
+from ..storage.base import get_storage
 from ..database import (
-    upsert_account, create_job, upsert_source, insert_comments_batch, mark_job
+    StorageUnavailable, upsert_account, create_job, create_jobs, delete_jobs, upsert_source, mark_job,
+    get_source, get_sources, update_source_meta
 )
 
 router = APIRouter()
@@ -27,92 +50,503 @@ def _detect_platform_from_url(url: str) -> str:
         return 'unknown'
 
 
+def canonical_target(platform: str, url: str) -> Optional[str]:
+    """
+    Что именно парсим, независимо от вида ссылки:
+        youtu.be/ID, youtube.com/watch?v=ID&t=1 -> youtube:video:ID
+        instagram.com/reel/X/?igsh=...          -> instagram:post:X
+        instagram.com/Altel_Kazakhstan          -> instagram:profile:altel_kazakhstan
+    None — ссылку не удалось разобрать (склейка дублей не применяется).
+    """
+    if platform == 'youtube':
+        content_type = YouTubeParser.detect_content_type(url)
+        if content_type == 'video':
+            return f"youtube:video:{YouTubeParser.extract_video_id(url)}"
+        if content_type == 'playlist':
+            return f"youtube:playlist:{YouTubeParser.extract_playlist_id(url)}"
+        if content_type == 'channel':
+            ((param, value),) = YouTubeParser.extract_channel_ref(url).items()
+            # id канала регистрозависим, handle и username — нет
+            return f"youtube:channel:{param}:{value if param == 'id' else value.lower()}"
+    elif platform == 'instagram':
+        content_type = InstagramParser.detect_content_type(url)
+        if content_type == 'post':
+            try:
+                return f"instagram:post:{InstagramParser.extract_post_id_from_url(url)}"
+            except ValueError:
+                return None
+        if content_type == 'profile':
+            return f"instagram:profile:{InstagramParser.extract_username_from_url(url).lower()}"
+    return None
+
+
 @router.post("/start", response_model=JobStatus)
-def start_parse(req: ParseRequest, background: BackgroundTasks):
+def start_parse(req: ParseRequest):
+    """
+    Создаёт job и ставит его в очередь — выполняют воркеры (python -m app.worker).
+    Если тот же контент уже в очереди, парсится или спарсен в пределах
+    JOB_COALESCE_WINDOW — возвращает существующий job вместо нового.
+    """
     platform = _detect_platform_from_url(req.url)
 
     if platform == 'youtube':
-        if not settings.youtube_api_key:
+        if not settings.youtube_keys:
             raise HTTPException(500, "YOUTUBE_API_KEY is not set")
-        job_id = create_job(source_type=platform, input_url=req.url)
-        background.add_task(_run_youtube_ingest, job_id, req.url, req.max_comments)
+    elif platform != 'instagram':
+        raise HTTPException(400, f"Platform '{platform}' is not supported yet")
+
+    queue = get_job_queue()
+    payload = {
+        "url": req.url,
+        "max_comments": req.max_comments,
+        "max_videos": req.max_videos,
+        "incremental": req.incremental,
+        "timeout_seconds": req.timeout_seconds,
+    }
+    target = canonical_target(platform, req.url)
+    if target is None:
+        job_id = create_job(source_type=platform, input_url=req.url, status="queued")
+        queue.enqueue(job_id, platform, payload)
+        return JobStatus(job_id=job_id, status="queued")
+
+    job_id, status, coalesced = queue.enqueue_unique(
+        target, platform, payload,
+        create_job=lambda: create_job(source_type=platform, input_url=req.url, status="queued"),
+        fresh_seconds=settings.job_coalesce_window,
+        discard_jobs=delete_jobs
+    )
+    if coalesced:
+        print(f"🔗 {target} already has job {job_id} ({status}), not starting another")
+    return JobStatus(job_id=job_id, status=status, coalesced=coalesced)
 
+
+def run_parse_job(platform: str, job_id: str, payload: dict) -> None:
+    """Выполняет задачу из очереди (вызывается воркером)"""
+    if platform == 'youtube':
+        _run_youtube_ingest(job_id, payload["url"], payload["max_comments"], payload.get("incremental", False),
+                            payload.get("max_videos", 50))
     elif platform == 'instagram':
-        job_id = create_job(source_type=platform, input_url=req.url)
-        background.add_task(_run_instagram_ingest, job_id, req.url, req.max_comments)
+        _run_instagram_ingest(job_id, payload["url"], payload["max_comments"], payload.get("incremental", False))
+    else:
+        raise ValueError(f"Platform '{platform}' is not supported yet")
 
+
+def _urls_from_file(filename: str, content: bytes) -> List[str]:
+    """Ссылки из загруженного файла: .xlsx (все ячейки всех листов) или текст/CSV"""
+    if filename.lower().endswith(".xlsx"):
+        workbook = load_workbook(io.BytesIO(content), read_only=True)
+        text = "\n".join(str(value) for sheet in workbook.worksheets
+                         for row in sheet.iter_rows(values_only=True) for value in row if value)
     else:
-        raise HTTPException(400, f"Platform '{platform}' is not supported yet")
+        text = content.decode("utf-8-sig", errors="ignore")
+    return re.findall(r"https?://[^\s,;\"'<>]+", text)
+
+
+def refresh_bulk_parents(job_id: str) -> None:
+    """
+    Обновляет bulk job, в которые входит задача: stats_processed — сколько дочерних
+    завершено, после последней — итоговый статус (вызывается воркером).
+    """
+    queue = get_job_queue()
+    for parent_id in queue.bulk_parents(job_id):
+        _refresh_bulk_parent(queue, parent_id)
+
+
+def _bulk_status(total: int, finished: int, done: int, error: int) -> str:
+    """
+    Статус bulk job по детям: running, пока не завершены все; с ошибками — partial
+    (часть выполнена) или error; cancelled — только если все невыполненные отменены / по таймауту.
+    """
+    if finished < total:
+        return "running"
+    if error:
+        return "partial" if done else "error"
+    return "done" if done else "cancelled"
+
+
+def _refresh_bulk_parent(queue, parent_id: str) -> None:
+    summary = queue.bulk_summary(parent_id)
+    status = _bulk_status(summary["total"], summary["finished"], summary["done"], summary["error"])
+    failed = summary["error"]
+    mark_job(parent_id, status=status, stats_total=summary["total"], stats_processed=summary["finished"],
+             error=f"{failed} of {summary['total']} jobs failed" if failed and status != "running" else None)
+
+
+def _start_bulk(urls: List[str], max_comments: int, max_videos: int, incremental: bool,
+                timeout_seconds: Optional[int] = None) -> BulkJobStatus:
+    """
+    Bulk job: дубли целей внутри списка отбрасываются, уже идущие/свежие цели склеиваются
+    с существующими job, остальные ставятся в очередь одним пакетом с пониженным приоритетом.
+    Лимиты платформ соблюдают воркеры (лимиты очереди, квота YouTube, темп Instagram).
+    timeout_seconds — дедлайн каждого дочернего job, как у одиночного.
+    """
+    urls = [u.strip() for u in urls if u and u.strip()]
+    if not urls:
+        raise HTTPException(400, "No URLs given")
+    if len(urls) > settings.bulk_max_urls:
+        raise HTTPException(400, f"Too many URLs: {len(urls)} > {settings.bulk_max_urls}")
+
+    children: List[BulkChild] = []
+    items: List[Dict] = []
+    first_url: Dict[str, str] = {}
+    for url in urls:
+        platform = _detect_platform_from_url(url)
+        if platform not in ('youtube', 'instagram'):
+            children.append(BulkChild(url=url, status="rejected", error=f"Platform '{platform}' is not supported yet"))
+            continue
+        if platform == 'youtube' and not settings.youtube_keys:
+            children.append(BulkChild(url=url, status="rejected", error="YOUTUBE_API_KEY is not set"))
+            continue
+        target = canonical_target(platform, url)
+        if target is None:
+            children.append(BulkChild(url=url, status="rejected", error="Cannot determine content from URL"))
+            continue
+        if target in first_url:
+            children.append(BulkChild(url=url, target=target, status="duplicate", duplicate_of=first_url[target]))
+            continue
+        first_url[target] = url
+        children.append(BulkChild(url=url, target=target, status="queued"))
+        items.append({"url": url, "target": target, "platform": platform, "payload": {
+            "url": url,
+            "max_comments": max_comments,
+            "max_videos": max_videos,
+            "incremental": incremental,
+            "timeout_seconds": timeout_seconds,
+        }})
+
+    if not items:
+        raise HTTPException(400, "None of the URLs can be parsed")
+
+    queue = get_job_queue()
+    # queued, пока дети не в очереди: running ставит _refresh_bulk_parent ниже
+    parent_id = create_job(source_type="bulk", input_url=f"{len(urls)} urls", status="queued")
+    try:
+        results = queue.enqueue_bulk(
+            parent_id, items,
+            create_jobs=lambda new: create_jobs([{"source_type": i["platform"], "input_url": i["url"]} for i in new]),
+            fresh_seconds=settings.job_coalesce_window,
+            discard_jobs=delete_jobs
+        )
+    except Exception as e:
+        # иначе родитель без детей навсегда остался бы в queued
+        mark_job(parent_id, status="error", error=f"Bulk enqueue failed: {e}")
+        raise
+    by_target = {r["target"]: r for r in results}
+    for child in children:
+        result = by_target.get(child.target)
+        if result is None:
+            continue
+        child.job_id = result["job_id"]
+        if child.status != "duplicate":
+            child.status, child.coalesced = result["status"], result["coalesced"]
+
+    _refresh_bulk_parent(queue, parent_id)
+    coalesced = sum(r["coalesced"] for r in results)
+    print(f"📦 Bulk job {parent_id}: {len(urls)} urls -> {len(results) - coalesced} new jobs, "
+          f"{coalesced} already running/fresh, {len(urls) - len(results)} duplicates/rejected")
+    return BulkJobStatus(job_id=parent_id, status="running", counts=dict(Counter(c.status for c in children)),
+                         children=children)
+
+
+@router.post("/bulk", response_model=BulkJobStatus)
+def start_bulk_parse(req: BulkParseRequest):
+    """Много ссылок одним bulk job (например, недельный аудит)"""
+    return _start_bulk(req.urls, req.max_comments, req.max_videos, req.incremental, req.timeout_seconds)
+
+
+@router.post("/bulk/upload", response_model=BulkJobStatus)
+async def start_bulk_parse_upload(file: UploadFile = File(...), max_comments: int = 500, max_videos: int = 50,
+                                  incremental: bool = False, timeout_seconds: Optional[int] = None):
+    """Bulk job из файла со ссылками (.txt/.csv — по ссылке в строке, или .xlsx)"""
+    content = await file.read()
+    # разбор файла и постановка в очередь — в пуле потоков, event loop не блокируется
+    urls = await run_in_threadpool(_urls_from_file, file.filename or "", content)
+    return await run_in_threadpool(_start_bulk, urls, max_comments, max_videos, incremental, timeout_seconds)
+
+
+@router.get("/bulk/{job_id}", response_model=BulkJobStatus)
+async def get_bulk_status(job_id: str):
+    """Сводный и по-дочерний прогресс bulk job: очередь — локально, счётчики — одним запросом к jobs"""
+    rows = await run_in_threadpool(get_job_queue().bulk_children, job_id)
+    if not rows:
+        raise HTTPException(404, f"Bulk job {job_id} not found")
+    jobs = await get_storage().fetch_jobs([r["job_id"] for r in rows])
+
+    children = []
+    for r in rows:
+        job = jobs.get(r["job_id"], {})
+        # итог берём из очереди, промежуточный статус (running, deferred) — из jobs
+        status = r["status"] if r["status"] in FINISHED_STATUSES else job.get("status") or r["status"]
+        children.append(BulkChild(
+            url=r["url"], job_id=r["job_id"], target=r["target"],
+            status=status or "unknown",
+            stats_total=job.get("stats_total"), stats_processed=job.get("stats_processed"),
+            error=job.get("error") or r["error"]
+        ))
+    counts = dict(Counter(c.status for c in children))
+    finished = sum(counts.get(s, 0) for s in FINISHED_STATUSES)
+    return BulkJobStatus(
+        job_id=job_id,
+        status=_bulk_status(len(children), finished, counts.get("done", 0), counts.get("error", 0)),
+        counts=counts,
+        stats_total=sum(c.stats_total or 0 for c in children),
+        stats_processed=sum(c.stats_processed or 0 for c in children),
+        children=children
+    )
 
-    return JobStatus(job_id=job_id, status="running")
 
+def _previous_watermark(platform: str, ext_id: str, incremental: bool) -> Optional[dict]:
+    """Водяной знак прошлого ингеста source ({} — ингестов ещё не было), None — полный режим"""
+    if not incremental:
+        return None
+    src = get_source(platform, ext_id)
+    return ((src or {}).get("raw_meta") or {}).get("watermark") or {}
+
+
+def _save_watermark(source_id: str, raw_meta: dict, tracker: WatermarkTracker,
+                    incremental: bool, fetched: int, max_comments: int) -> None:
+    """
+    Сохраняет новый водяной знак в sources.raw_meta.
+    Обход, обрезанный max_comments, границу не двигает: полный (не по времени) водяной
+    знак не даёт вовсе, инкрементальный запоминает полученный отрезок (resume).
+    """
+    truncated = fetched >= max_comments
+    if truncated and not incremental:
+        return
+    update_source_meta(source_id, {**raw_meta, "watermark": tracker.result(truncated=truncated)})
+
+
+def _allocate_comment_budget(new_comments: Dict[str, int], budget: int) -> Dict[str, int]:
+    """
+    Делит лимит комментариев между постами пропорционально числу новых комментариев.
+    Посту не выделяется больше, чем у него новых; остаток перераспределяется между остальными.
+    """
+    allocation: Dict[str, int] = {}
+    pending = {k: n for k, n in new_comments.items() if n > 0}
+    left = budget
+    while pending and left > 0:
+        total = sum(pending.values())
+        # посты, которым пропорциональной доли хватает на все новые комментарии
+        covered = {k: n for k, n in pending.items() if left * n / total >= n}
+        if not covered:
+            # доли с округлением вниз, остаток — постам с наибольшей дробной частью
+            shares = {k: left * n / total for k, n in pending.items()}
+            for k, share in shares.items():
+                allocation[k] = int(share)
+            rest = left - sum(int(share) for share in shares.values())
+            for k in sorted(shares, key=lambda k: shares[k] - int(shares[k]), reverse=True)[:rest]:
+                allocation[k] += 1
+            break
+        for k, n in covered.items():
+            allocation[k] = n
+            left -= n
+            del pending[k]
+    return {k: n for k, n in allocation.items() if n > 0}
+
+
+def _youtube_parser() -> YouTubeParser:
+    quota = get_quota_ledger()
+    api_key = quota.pick_key()
+    if not api_key:
+        raise QuotaExhausted("YouTube API quota exceeded for all configured keys")
+    return YouTubeParser(
+        api_key=api_key,
+        reply_concurrency=settings.youtube_reply_concurrency,
+        inline_replies=settings.youtube_inline_replies,
+        quota=quota
+    )
 
-def _run_youtube_ingest(job_id: str, url: str, max_comments: int):
-    """Существующий YouTube ингест"""
+
+def _run_youtube_ingest(job_id: str, url: str, max_comments: int, incremental: bool = False,
+                        max_videos: int = 50):
+    """YouTube ингест: одно видео, плейлист или канал"""
     try:
-        yt = YouTubeParser(api_key=settings.youtube_api_key)
-        v = yt.get_video_info(url)
+        yt = _youtube_parser()
+        content_type = yt.detect_content_type(url)
 
-        # account
-        account_id = upsert_account(
-            platform="youtube",
-            handle=v["channel_title"] or v["channel_handle"] or "unknown",
-            url=v["channel_url"],
-            title=v["channel_title"] or "YouTube Channel"
-        )
+        if content_type == 'video':
+            v = yt.get_video_info(url)
+            fetched, inserted = _ingest_youtube_video(yt, job_id, v, max_comments, incremental)
 
-        # source (video)
-        source_id = upsert_source(
-            job_id=job_id,
-            account_id=account_id,
-            platform="youtube",
-            ext_id=v["video_id"],
-            title=v["title"],
-            author=v["channel_title"],
-            published_at=v["published_at"],
-            raw_meta={"view_count": v["view_count"], "comment_count": v["comment_count"]}
-        )
-
-        # comments
-        comments = yt.parse_comments(v["video_id"], max_results=max_comments)
-        inserted = insert_comments_batch(source_id, comments)
+        elif content_type in ('playlist', 'channel'):
+            fetched, inserted = _ingest_youtube_collection(yt, job_id, url, content_type,
+                                                           max_comments, max_videos, incremental)
+        else:
+            raise ValueError(f"Cannot determine YouTube content type from URL: {url}")
 
         # обновим job
-        mark_job(job_id, status="done", stats_total=len(comments), stats_processed=inserted)
+        mark_job(job_id, status="done", stats_total=fetched, stats_processed=inserted)
+        print(f"📊 YouTube API calls for job {job_id}: {sum(yt.call_stats.values())} {yt.call_stats}")
+    except QuotaExhausted as e:
+        # уже записанные комментарии остаются; воркер вернёт задачу в очередь до сброса квоты
+        mark_job(job_id, status="deferred", error=str(e))
+        raise RetryLater(str(e), (next_reset() - datetime.now(timezone.utc)).total_seconds())
+    except JobCancelled as e:
+        # записанное остаётся, stats_processed — последний записанный чанк
+        mark_job(job_id, status=e.status, error=str(e))
+        raise
+    except StorageUnavailable:
+        raise  # воркер вернёт задачу в очередь; статус в хранилище сейчас не записать
     except Exception as e:
         mark_job(job_id, status="error", error=str(e))
         raise
 
 
-def _run_instagram_ingest(job_id: str, url: str, max_comments: int):
+def _youtube_account(v: dict) -> str:
+    return upsert_account(
+        platform="youtube",
+        handle=v["channel_title"] or v["channel_handle"] or "unknown",
+        url=v["channel_url"],
+        title=v["channel_title"] or "YouTube Channel"
+    )
+
+
+def _ingest_youtube_video(yt: YouTubeParser, job_id: str, v: dict, max_comments: int,
+                          incremental: bool = False, account_id: Optional[str] = None,
+                          progress: Optional[JobProgress] = None):
+    """
+    Ингест комментариев одного видео (метаданные v — из get_video_info / get_videos_info).
+    Возвращает (получено, записано).
+    Квоты не хватает — QuotaExhausted: job помечается deferred и возвращается в очередь до сброса квоты.
+    """
+    # Хватит ли квоты: запускаем полностью, урезаем до топ-комментариев или откладываем
+    plan = yt.quota.plan_job(v["comment_count"], max_comments, yt.inline_replies)
+    if plan["action"] == "defer":
+        raise QuotaExhausted(f"YouTube quota exhausted, retry after {plan['retry_after']}")
+    if plan["action"] == "shrink":
+        print(f"⚠️ Low YouTube quota ({plan['remaining_units']} units): "
+              f"top-level comments only, max {plan['max_comments']}")
+        max_comments = plan["max_comments"]
+
+    # account
+    account_id = account_id or _youtube_account(v)
+
+    # source (video); старый водяной знак сохраняем до конца ингеста
+    watermark = _previous_watermark("youtube", v["video_id"], incremental)
+    raw_meta = {"view_count": v["view_count"], "comment_count": v["comment_count"]}
+    source_id = upsert_source(
+        job_id=job_id,
+        account_id=account_id,
+        platform="youtube",
+        ext_id=v["video_id"],
+        title=v["title"],
+        author=v["channel_title"],
+        published_at=v["published_at"],
+        raw_meta={**raw_meta, "watermark": watermark} if watermark else raw_meta
+    )
+
+    # comments: страницы пишутся в БД по мере получения
+    tracker = WatermarkTracker(watermark)
+    fetched, inserted = stream_comments(
+        job_id, source_id,
+        tracker.observe(yt.iter_comment_pages(v["video_id"], max_results=max_comments, since=watermark,
+                                              top_level_only=plan["top_level_only"])),
+        progress=progress,
+        stats_total=min(v["comment_count"], max_comments)
+    )
+    _save_watermark(source_id, raw_meta, tracker, incremental, fetched, max_comments)
+    return fetched, inserted
+
+
+def _ingest_youtube_collection(yt: YouTubeParser, job_id: str, url: str, content_type: str,
+                               max_comments: int, max_videos: int, incremental: bool):
+    """
+    Ингест плейлиста или всех загрузок канала в рамках одного job.
+    Метаданные видео — пачками по 50, видео обрабатываются параллельно
+    (youtube_video_concurrency), самые комментируемые — первыми.
+    max_comments — лимит на одно видео.
+    """
+    if content_type == 'channel':
+        playlist_id = yt.get_uploads_playlist(url)["uploads_playlist_id"]
+    else:
+        playlist_id = yt.extract_playlist_id(url)
+
+    video_ids = list(yt.iter_playlist_video_ids(playlist_id, max_videos=max_videos))
+    videos = yt.get_videos_info(video_ids)
+    videos = [v for v in videos if v["comment_count"] > 0]
+    videos.sort(key=lambda v: v["comment_count"], reverse=True)
+    print(f"📺 {len(videos)} videos with comments in {content_type} {playlist_id}")
+
+    progress = JobProgress(job_id, stats_total=sum(min(v["comment_count"], max_comments) for v in videos))
+    # accounts — заранее в этом потоке: потоки пула только читают словарь
+    accounts: dict = {}
+    for v in videos:
+        if v["channel_id"] not in accounts:
+            accounts[v["channel_id"]] = _youtube_account(v)
+
+    def ingest_one(v: dict):
+        result = _ingest_youtube_video(yt, job_id, v, max_comments, incremental,
+                                       account_id=accounts[v["channel_id"]], progress=progress)
+        print(f"  ✅ {v['video_id']}: {result[1]}/{result[0]} comments")
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, settings.youtube_video_concurrency),
+                            thread_name_prefix="yt-videos") as pool:
+        # отправляем в порядке приоритета — пул берёт задачи по очереди
+        futures = [pool.submit(propagate_context(ingest_one), v) for v in videos]
+        try:
+            for fut in futures:
+                fut.result()
+        except BaseException:
+            for fut in futures:
+                fut.cancel()
+            raise
+
+    return progress.fetched, progress.processed
+
+
+def _run_instagram_ingest(job_id: str, url: str, max_comments: int, incremental: bool = False):
     """Instagram ингест для постов и профилей"""
     try:
-        # Инициализируем парсер
-        ig = InstagramParser(
-            username=settings.instagram_username,
-            password=None,  # Не передаем пароль если есть сессия
-            session_file=settings.instagram_session_file
-        )
-
-        content_type = ig.detect_content_type(url)
+        pool = get_session_pool()
+        job_cache = JobFetchCache(job_id)
+        content_type = InstagramParser.detect_content_type(url)
 
         if content_type == 'post':
             # Парсим один пост
-            _ingest_instagram_post(ig, job_id, url, max_comments)
+            with pool.session(job_cache) as ig:
+                _ingest_instagram_post(ig, job_id, url, max_comments, incremental)
 
         elif content_type == 'profile':
             # Парсим последние посты профиля
-            _ingest_instagram_profile(ig, job_id, url, max_comments)
+            _ingest_instagram_profile(pool, job_cache, job_id, url, max_comments, incremental)
 
         else:
             raise ValueError(f"Cannot determine Instagram content type from URL: {url}")
 
+        print(f"📊 Instagram requests for job {job_id}: {job_cache.stats()}")
+
+    except NoSessionAvailable as e:
+        # все аккаунты в карантине — воркер вернёт задачу в очередь до конца карантина
+        mark_job(job_id, status="deferred", error=str(e))
+        raise RetryLater(str(e), e.retry_after)
+    except JobCancelled as e:
+        mark_job(job_id, status=e.status, error=str(e))
+        raise
+    except StorageUnavailable:
+        raise
     except Exception as e:
         mark_job(job_id, status="error", error=str(e))
         raise
 
 
-def _ingest_instagram_post(ig: InstagramParser, job_id: str, url: str, max_comments: int):
+def _instagram_pages(pages: Iterable[list]) -> Iterator[list]:
+    """Приводит страницы комментариев Instagram к формату insert_comments_batch"""
+    for page in pages:
+        yield [{
+            "id": c["id"],
+            "text": c["text"],
+            "author": c["author"],
+            "author_channel_id": c["author_id"],
+            "published_at": c.get("created_at"),
+            "likes": c.get("likes", 0),
+            "updated_at": c.get("created_at"),
+            "parent_comment_id": c.get("parent_comment_id")
+        } for c in page]
+
+
+def _ingest_instagram_post(ig: InstagramParser, job_id: str, url: str, max_comments: int,
+                           incremental: bool = False):
     """Ингест одного Instagram поста"""
 
     try:
@@ -127,7 +561,16 @@ def _ingest_instagram_post(ig: InstagramParser, job_id: str, url: str, max_comme
             title=post_info["author_username"]
         )
 
-        # Создаём source (пост)
+        # Создаём source (пост); старый водяной знак сохраняем до конца ингеста
+        watermark = _previous_watermark("instagram", post_info["post_id"], incremental)
+        raw_meta = {
+            "likes_count": post_info["likes_count"],
+            "comments_count": post_info["comments_count"],
+            "is_video": post_info["is_video"],
+            "video_view_count": post_info.get("video_view_count"),
+            "location": post_info.get("location"),
+            "hashtags": post_info.get("hashtags", [])
+        }
         source_id = upsert_source(
             job_id=job_id,
             account_id=account_id,
@@ -136,14 +579,7 @@ def _ingest_instagram_post(ig: InstagramParser, job_id: str, url: str, max_comme
             title=post_info["caption"][:100] if post_info["caption"] else f"Post {post_info['post_id']}",
             author=post_info["author_username"],
             published_at=post_info["created_at"],
-            raw_meta={
-                "likes_count": post_info["likes_count"],
-                "comments_count": post_info["comments_count"],
-                "is_video": post_info["is_video"],
-                "video_view_count": post_info.get("video_view_count"),
-                "location": post_info.get("location"),
-                "hashtags": post_info.get("hashtags", [])
-            }
+            raw_meta={**raw_meta, "watermark": watermark} if watermark else raw_meta
         )
 
         # Проверяем, требуется ли авторизация для комментариев
@@ -158,40 +594,25 @@ def _ingest_instagram_post(ig: InstagramParser, job_id: str, url: str, max_comme
             )
             return
 
-        # Парсим комментарии
-        comments = ig.parse_comments(post_info["post_id"], max_results=max_comments)
-
-        if not comments:
-            # Если комментариев нет или не удалось получить
-            mark_job(
-                job_id=job_id,
-                status="done",
-                stats_total=0,
-                stats_processed=0
-            )
-            return
-
-        # Преобразуем формат комментариев для совместимости с БД
-        formatted_comments = []
-        for c in comments:
-            formatted_comments.append({
-                "id": c["id"],
-                "text": c["text"],
-                "author": c["author"],
-                "author_channel_id": c["author_id"],
-                "published_at": c["created_at"],
-                "likes": c.get("likes", 0),
-                "updated_at": c["created_at"],
-                "parent_comment_id": c.get("parent_comment_id")
-            })
-
-        inserted = insert_comments_batch(source_id, formatted_comments)
+        # Парсим комментарии и пишем их в БД по мере получения
+        tracker = WatermarkTracker(watermark)
+        checkpoint = get_cursor_store().checkpoint(post_info["post_id"])
+        fetched, inserted = stream_comments(
+            job_id, source_id,
+            tracker.observe(_instagram_pages(
+                ig.iter_comment_pages(post_info["post_id"], max_results=max_comments, since=watermark,
+                                      checkpoint=checkpoint)
+            )),
+            stats_total=min(post_info["comments_count"], max_comments),
+            on_flush=checkpoint.persisted
+        )
+        _save_watermark(source_id, raw_meta, tracker, incremental, fetched, max_comments)
 
         # Обновляем статус job
         mark_job(
             job_id=job_id,
             status="done",
-            stats_total=len(comments),
+            stats_total=fetched,
             stats_processed=inserted
         )
     except Exception as e:
@@ -199,19 +620,43 @@ def _ingest_instagram_post(ig: InstagramParser, job_id: str, url: str, max_comme
         raise
 
 
-def _ingest_instagram_profile(ig: InstagramParser, job_id: str, url: str, max_comments: int):
-    """Ингест последних постов Instagram профиля"""
+def _ingest_instagram_profile(pool: InstagramSessionPool, job_cache: JobFetchCache, job_id: str, url: str,
+                              max_comments: int, incremental: bool = False):
+    """Ингест последних постов Instagram профиля: посты раздаются сессиям пула параллельно"""
 
-    username = ig.extract_username_from_url(url)
+    username = InstagramParser.extract_username_from_url(url)
     if not username:
         raise ValueError(f"Cannot extract username from URL: {url}")
 
-    # Парсим профиль (10 последних постов, по 100 комментариев на пост)
-    profile_data = ig.parse_profile_posts(
-        username=username,
-        max_posts=10,
-        max_comments_per_post=min(max_comments // 10, 100)  # Распределяем лимит
-    )
+    # Метаданные 10 последних постов; комментарии стримим ниже по каждому посту
+    with pool.session(job_cache) as ig:
+        profile_data = ig.parse_profile_posts(
+            username=username,
+            max_posts=10,
+            max_comments_per_post=0
+        )
+        logged_in = ig.logged_in
+
+    # Сколько новых комментариев у каждого поста с прошлого обхода (один запрос к sources)
+    stored = get_sources("instagram", [p["post_id"] for p in profile_data["posts"]])
+    new_comments = {}
+    for post_data in profile_data["posts"]:
+        post_id = post_data["post_id"]
+        raw_meta = (stored.get(post_id) or {}).get("raw_meta") or {}
+        ingested = raw_meta.get("comments_count_ingested") if incremental else None
+        new_comments[post_id] = max(0, post_data["comments_count"] - (ingested or 0))
+        # оборванный прошлый обход: остаток старых комментариев тоже нужно добрать
+        checkpoint = get_cursor_store().checkpoint(post_id)
+        if checkpoint.resume_state:
+            new_comments[post_id] = max(new_comments[post_id],
+                                        post_data["comments_count"] - checkpoint.persisted_count)
+
+    # Посты без новых комментариев пропускаем, бюджет делим пропорционально новым
+    posts = [p for p in profile_data["posts"] if new_comments[p["post_id"]] > 0]
+    budgets = _allocate_comment_budget({p["post_id"]: new_comments[p["post_id"]] for p in posts}, max_comments)
+    skipped = len(profile_data["posts"]) - len(posts)
+    if skipped:
+        print(f"⏭️ {skipped}/{len(profile_data['posts'])} posts of @{username} have no new comments, skipped")
 
     # Создаём account для профиля
     account_id = upsert_account(
@@ -221,56 +666,168 @@ def _ingest_instagram_profile(ig: InstagramParser, job_id: str, url: str, max_co
         title=profile_data["profile"]["full_name"] or profile_data["profile"]["username"]
     )
 
-    total_comments = 0
-    total_inserted = 0
-
-    # Обрабатываем каждый пост
-    for post_data in profile_data["posts"]:
-        # Создаём source для каждого поста
+    progress = JobProgress(job_id, stats_total=sum(budgets.values()))
+
+    def ingest_post(post_data: dict):
+        post_id = post_data["post_id"]
+        # Создаём source для поста; водяной знак берём из уже прочитанных sources
+        previous_meta = (stored.get(post_id) or {}).get("raw_meta") or {}
+        watermark = (previous_meta.get("watermark") or {}) if incremental else None
+        raw_meta = {
+            "likes": post_data["likes"],
+            "comments_count": post_data["comments_count"],
+            "is_video": post_data["is_video"],
+            "video_views": post_data.get("video_views")
+        }
+        if "comments_count_ingested" in previous_meta:
+            raw_meta["comments_count_ingested"] = previous_meta["comments_count_ingested"]
         source_id = upsert_source(
             job_id=job_id,
             account_id=account_id,
             platform="instagram",
-            ext_id=post_data["post_id"],
-            title=post_data["caption"][:100] if post_data["caption"] else f"Post {post_data['post_id']}",
+            ext_id=post_id,
+            title=post_data["caption"][:100] if post_data["caption"] else f"Post {post_id}",
             author=profile_data["profile"]["username"],
             published_at=post_data["created_at"],
-            raw_meta={
-                "likes": post_data["likes"],
-                "comments_count": post_data["comments_count"],
-                "is_video": post_data["is_video"],
-                "video_views": post_data.get("video_views")
-            }
+            raw_meta={**raw_meta, "watermark": watermark} if watermark else raw_meta
         )
 
-        # Вставляем комментарии
-        if post_data["comments"]:
-            formatted_comments = []
-            for c in post_data["comments"]:
-                formatted_comments.append({
-                    "id": c["id"],
-                    "text": c["text"],
-                    "author": c["author"],
-                    "author_channel_id": c["author_id"],
-                    "published_at": c.get("created_at"),
-                    "likes": c.get("likes", 0),
-                    "updated_at": c.get("created_at"),
-                    "parent_comment_id": c.get("parent_comment_id")
-                })
-
-            inserted = insert_comments_batch(source_id, formatted_comments)
-            total_comments += len(post_data["comments"])
-            total_inserted += inserted
+        # Стримим комментарии поста через свободную сессию пула
+        budget = budgets.get(post_id, 0)
+        if logged_in and budget > 0:
+            tracker = WatermarkTracker(watermark)
+            checkpoint = get_cursor_store().checkpoint(post_id)
+            with pool.session(job_cache) as ig:
+                fetched, _ = stream_comments(
+                    job_id, source_id,
+                    tracker.observe(_instagram_pages(
+                        ig.iter_comment_pages(post_id, max_results=budget,
+                                              since=watermark, checkpoint=checkpoint)
+                    )),
+                    progress=progress,
+                    on_flush=checkpoint.persisted
+                )
+            # обход дошёл до конца/водяного знака — пост учтён целиком, иначе только полученное
+            if fetched < budget and not checkpoint.store.load(post_id):
+                raw_meta["comments_count_ingested"] = post_data["comments_count"]
+            else:
+                raw_meta["comments_count_ingested"] = raw_meta.get("comments_count_ingested", 0) + fetched
+            _save_watermark(source_id, raw_meta, tracker, incremental, fetched, budget)
+
+    # По одному посту на сессию: аккаунты не делят лимиты, поэтому работают параллельно
+    with ThreadPoolExecutor(max_workers=len(pool), thread_name_prefix="ig-posts") as executor:
+        futures = [executor.submit(propagate_context(ingest_post), post_data) for post_data in posts]
+        try:
+            for fut in futures:
+                fut.result()
+        except BaseException:
+            for fut in futures:
+                fut.cancel()
+            raise
 
     # Обновляем статус job
     mark_job(
         job_id=job_id,
         status="done",
-        stats_total=total_comments,
-        stats_processed=total_inserted
+        stats_total=progress.fetched,
+        stats_processed=progress.processed
     )
 
-    print(f"✅ Instagram profile ingestion complete: {total_inserted}/{total_comments} comments")
+    print(f"✅ Instagram profile ingestion complete: {progress.processed}/{progress.fetched} comments")
+
+
+@router.get("/instagram/sessions", summary="Instagram session pool status")
+def get_instagram_sessions():
+    """Состояние пула Instagram аккаунтов: health, карантин, лимиты и выученный темп (AIMD)"""
+    return {"sessions": get_session_pool().status()}
+
+
+def _cancel_one(queue, job_id: str) -> Optional[str]:
+    state = queue.request_cancel(job_id)
+    if state == "cancelled":
+        # ещё не начинался — воркер его уже не возьмёт
+        mark_job(job_id, status="cancelled", error="Cancelled by user")
+        refresh_bulk_parents(job_id)
+    return state
+
+
+@router.post("/jobs/{job_id}/cancel", response_model=JobStatus)
+def cancel_job(job_id: str):
+    """
+    Отмена job: ждущий в очереди отменяется сразу, выполняемый воркер прерывает на
+    ближайшей проверке (между страницами, перед запросом, в паузе лимитера) —
+    статус cancelled, записанные комментарии и stats_processed остаются.
+    Для bulk job отменяются все его незавершённые дочерние.
+    """
+    queue = get_job_queue()
+    children = queue.bulk_children(job_id)
+    if children:
+        states = [_cancel_one(queue, c["job_id"]) for c in children if c["status"] not in FINISHED_STATUSES]
+        if not states:  # все дочерние уже завершены
+            s = queue.bulk_summary(job_id)
+            return JobStatus(job_id=job_id, status=_bulk_status(s["total"], s["finished"], s["done"], s["error"]))
+        return JobStatus(job_id=job_id, status="cancelling" if "cancelling" in states else "cancelled")
+
+    state = _cancel_one(queue, job_id)
+    if state is None:
+        raise HTTPException(404, f"Job {job_id} not found in queue")
+    return JobStatus(job_id=job_id, status=state)
+
+
+@router.get("/jobs/{job_id}/events", summary="Job progress stream (Server-Sent Events)")
+async def job_events(job_id: str, last_event_id: Optional[str] = Header(None)):
+    """
+    SSE поток прогресса job вместо опроса /analytics/job-status:
+        status     — статус и счётчики job (queued, running + stats_processed, deferred,
+                     done, partial, error, cancelled, timed_out)
+        page       — получена страница комментариев
+        write      — комментарии дописаны из outbox в Supabase: строк, время каждого upsert-запроса,
+                     pending — сколько строк job ещё ждёт в outbox (0 — всё записано),
+                     failed — строки, отвергнутые хранилищем (dead letter)
+        rate_limit — аккаунт Instagram упёрся в лимит, пауза wait_seconds
+    Первым событием — текущий статус job из хранилища: если job уже завершён, поток сразу закрывается
+    (журнал событий хранится job_events_ttl, старый job мог остаться без итогового события).
+    Затем уже накопленные события и живые; поток закрывается после итогового статуса.
+    При переподключении EventSource сам передаёт Last-Event-ID — пропущенное дошлётся.
+    """
+    after = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+    job = await get_storage().fetch_job(job_id)
+    if job is None:
+        raise HTTPException(404, f"Job {job_id} not found")
+    current = {k: job[k] for k in ("status", "stats_total", "stats_processed", "error") if job.get(k) is not None}
+
+    async def sse():
+        # без id: снимок статуса не сдвигает Last-Event-ID журнала
+        yield f"event: status\ndata: {json.dumps({'job_id': job_id, 'ts': time.time(), **current})}\n\n"
+        if current["status"] in TERMINAL_STATUSES:
+            return
+        async for event in get_event_bus().stream(job_id, after_seq=after):
+            if event is None:
+                yield ": ping\n\n"
+                continue
+            data = {"job_id": job_id, "ts": event["ts"], **event["data"]}
+            yield f"id: {event['seq']}\nevent: {event['type']}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(sse(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get("/queue", summary="Job queue status")
+def get_queue_status():
+    """Задачи в очереди по платформам и статусам, лимиты одновременного выполнения"""
+    return get_job_queue().stats()
+
+
+@router.get("/outbox", summary="Comment outbox depth and flush lag")
+def get_outbox_status():
+    """Комментарии, ещё не дописанные в Supabase: глубина, лаг самой старой строки, последняя ошибка"""
+    return get_comment_outbox().metrics()
+
+
+@router.get("/quota", summary="YouTube API quota usage")
+def get_youtube_quota():
+    """Расход квоты YouTube Data API за текущие сутки (PT) по ключам"""
+    return get_quota_ledger().usage()
 
 
 @router.get("/platforms", summary="Get supported platforms")
@@ -281,8 +838,9 @@ def get_supported_platforms():
             {
                 "platform": "youtube",
                 "status": "active",
-                "url_patterns": ["youtube.com/watch", "youtu.be/"],
-                "features": ["video_comments", "channel_info"]
+                "url_patterns": ["youtube.com/watch", "youtu.be/", "youtube.com/playlist?list=",
+                                 "youtube.com/@{handle}", "youtube.com/channel/{id}"],
+                "features": ["video_comments", "channel_info", "playlist_videos", "channel_uploads"]
             },
             {
                 "platform": "instagram",
@@ -0,0 +1,128 @@
+# app/routers/service/instagram_comment_cursors.py
+"""
+Чекпоинты обхода комментариев Instagram.
+
+Состояние пагинации (instaloader FrozenNodeIterator для GraphQL или FrozenIPhoneComments
+для iPhone endpoint больших постов) хранится по shortcode поста в JSON-файле. Позиция сдвигается только после того, как комментарии до неё записаны
+в БД, поэтому после rate limit или падения процесса обход продолжается с последнего
+курсора: записанные комментарии повторно не запрашиваются, незаписанные не теряются.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple
+
+from ...config import settings
+
+
+class CommentCursorStore:
+    def __init__(self, directory: str = "./instagram_cursors"):
+        self.directory = Path(directory)
+        self._lock = threading.Lock()
+
+    def _path(self, shortcode: str) -> Path:
+        return self.directory / f"{shortcode}.json"
+
+    def load(self, shortcode: str) -> Optional[Dict]:
+        try:
+            with open(self._path(shortcode), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def save(self, shortcode: str, frozen: Dict, persisted: int) -> None:
+        """Атомарная запись (tmp + rename) — файл не бывает наполовину записан"""
+        path = self._path(shortcode)
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"shortcode": shortcode, "frozen": frozen, "persisted": persisted,
+                           "saved_at": time.time()}, f)
+            os.replace(tmp, path)
+
+    def clear(self, shortcode: str) -> None:
+        with self._lock:
+            try:
+                self._path(shortcode).unlink()
+            except FileNotFoundError:
+                pass
+
+    def checkpoint(self, shortcode: str) -> "CommentCheckpoint":
+        return CommentCheckpoint(self, shortcode)
+
+
+class CommentCheckpoint:
+    """
+    Чекпоинт одного поста на время ингеста.
+
+    Парсер отмечает позицию после каждой отданной страницы (mark), writer сообщает,
+    какие комментарии записаны (persisted) — на диск попадает последняя позиция,
+    все комментарии до которой уже в БД.
+    """
+
+    def __init__(self, store: CommentCursorStore, shortcode: str):
+        self.store = store
+        self.shortcode = shortcode
+        saved = store.load(shortcode) or {}
+        self.resume_state: Optional[Dict] = saved.get("frozen")
+        self.persisted_count: int = saved.get("persisted", 0)
+        # (id последнего комментария страницы, состояние итератора; None — обход завершён)
+        self._marks: Deque[Tuple[str, Optional[Dict]]] = deque()
+        self._lock = threading.Lock()
+
+    def mark(self, last_comment_id: Optional[str], frozen: Optional[Dict]) -> None:
+        """Позиция после страницы, заканчивающейся last_comment_id (None — страниц после прошлой отметки не было)"""
+        with self._lock:
+            if last_comment_id is not None:
+                self._marks.append((last_comment_id, frozen))
+                return
+            if self._marks:
+                # позиция та же, что после последней отданной страницы: применяем её,
+                # когда writer запишет эту страницу, а не раньше ждущих отметок
+                comment_id, _ = self._marks[-1]
+                self._marks[-1] = (comment_id, frozen)
+                return
+        self._commit(frozen, 0)
+
+    def persisted(self, rows: List[Dict]) -> None:
+        """Callback writer'а (stream_comments on_flush): rows записаны в БД"""
+        written = {r["id"] for r in rows}
+        latest = None
+        with self._lock:
+            # записи идут по порядку: всё до последней записанной отметки уже в БД
+            for i, (comment_id, _) in enumerate(self._marks):
+                if comment_id in written:
+                    latest = i
+            if latest is None:
+                self.persisted_count += len(rows)
+                return
+            for _ in range(latest):
+                self._marks.popleft()
+            _, frozen = self._marks.popleft()
+        self._commit(frozen, len(rows))
+
+    def _commit(self, frozen: Optional[Dict], written: int) -> None:
+        with self._lock:
+            self.persisted_count += written
+            persisted = self.persisted_count
+        if frozen is None:
+            self.store.clear(self.shortcode)
+        else:
+            self.store.save(self.shortcode, frozen, persisted)
+
+
+_store: Optional[CommentCursorStore] = None
+_store_lock = threading.Lock()
+
+
+def get_cursor_store() -> CommentCursorStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = CommentCursorStore(settings.instagram_cursor_dir)
+        return _store
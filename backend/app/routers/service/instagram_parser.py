@@ -1,19 +1,128 @@
 # app/service/instagram_parser.py
 
 import instaloader
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Iterator, NamedTuple, Optional
 import re
 import time
 import random
+import threading
 from pathlib import Path
 import os
 import json
 
+from ...service.cancellation import check_cancelled, interruptible_sleep
+from ...service.job_events import publish_event
+from ...service.watermarks import in_fetched_range, is_seen
+from .instagram_comment_cursors import CommentCheckpoint
+from .instagram_rate_limit_manager import RateLimitManager, is_rate_limit_error
+
+# GraphQL запрос комментариев поста (instaloader Post.get_comments, посты до одной страницы)
+COMMENTS_QUERY_HASH = '97b41c52301f77ce508f55e66d17620e'
+
+
+class JobFetchCache:
+    """
+    Посты (instaloader.Post) по shortcode и счётчик запросов на время одного job.
+    Метаданные каждого поста запрашиваются один раз, даже если job ходит через несколько сессий.
+    """
+
+    def __init__(self, job_id: Optional[str] = None):
+        self.job_id = job_id  # для событий прогресса (rate limit)
+        self._posts: Dict[str, instaloader.Post] = {}
+        self._lock = threading.Lock()
+        self.requests: Dict[str, int] = defaultdict(int)
+
+    def get(self, shortcode: str) -> Optional[instaloader.Post]:
+        with self._lock:
+            return self._posts.get(shortcode)
+
+    def put(self, post: instaloader.Post) -> None:
+        with self._lock:
+            self._posts[post.shortcode] = post
+
+    def count(self, kind: str, n: int = 1) -> None:
+        with self._lock:
+            self.requests[kind] += n
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.requests)
+
+
+class AdaptivePacing(instaloader.RateController):
+    """Темп задаёт RateLimitManager (AIMD) — встроенные паузы instaloader отключены"""
+
+    def wait_before_query(self, query_type: str) -> None:
+        pass
+
+
+class FrozenIPhoneComments(NamedTuple):
+    """Позиция IPhoneCommentIterator для чекпоинта (как instaloader.FrozenNodeIterator у GraphQL)"""
+    endpoint: str  # "iphone" — отличает от состояния NodeIterator
+    mediaid: int
+    next_min_id: Optional[str]
+    exhausted: bool
+    remaining: List[Dict]  # ещё не отданные node текущей страницы
+    total_index: int
+
+
+class IPhoneCommentIterator:
+    """
+    Комментарии поста через iPhone endpoint (api/v1/media/{id}/comments/): так instaloader
+    4.10.3 обходит посты длиннее одной страницы GraphQL — пагинация GraphQL на них
+    ненадёжна (instaloader #2125). В отличие от Post.get_comments позицию (min_id следующей
+    страницы и остаток текущей) можно сохранить freeze() и продолжить с неё.
+    node отдаются в виде GraphQL (id, text, created_at, owner, edge_liked_by).
+    """
+
+    def __init__(self, context: instaloader.InstaloaderContext, mediaid: int, frozen: Optional[Dict] = None):
+        frozen = frozen or {}
+        self.context = context
+        self.mediaid = mediaid
+        self.next_min_id: Optional[str] = frozen.get("next_min_id")
+        self.exhausted: bool = frozen.get("exhausted", False)
+        self.remaining: List[Dict] = list(frozen.get("remaining") or [])
+        self.total_index: int = frozen.get("total_index", 0)
+
+    def __iter__(self) -> "IPhoneCommentIterator":
+        return self
+
+    def __next__(self) -> Dict:
+        while not self.remaining:
+            if self.exhausted:
+                raise StopIteration
+            params = {"can_support_threading": "true", "permalink_enabled": "false"}
+            if self.next_min_id is not None:
+                params["min_id"] = self.next_min_id
+            data = self.context.get_iphone_json(f"api/v1/media/{self.mediaid}/comments/", params)
+            # позиция сдвигается только после ответа: после ошибки запрашивается та же страница
+            self.remaining = [self._node(c) for c in data.get("comments", [])]
+            self.next_min_id = data.get("next_min_id") or None
+            self.exhausted = self.next_min_id is None
+        self.total_index += 1
+        return self.remaining.pop(0)
+
+    @staticmethod
+    def _node(comment: Dict) -> Dict:
+        user = comment.get("user") or {}
+        return {
+            "id": comment["pk"],
+            "text": comment.get("text", ""),
+            "created_at": comment.get("created_at"),
+            "owner": {"username": user.get("username", ""), "id": user.get("pk", user.get("id", ""))},
+            "edge_liked_by": {"count": comment.get("comment_like_count", 0)},
+        }
+
+    def freeze(self) -> FrozenIPhoneComments:
+        return FrozenIPhoneComments("iphone", self.mediaid, self.next_min_id, self.exhausted,
+                                    list(self.remaining), self.total_index)
+
 
 class InstagramParser:
     def __init__(self, username: Optional[str] = None, password: Optional[str] = None,
-                 session_file: Optional[str] = None):
+                 session_file: Optional[str] = None, rate_limiter: Optional[RateLimitManager] = None):
         """
         Инициализация Instagram парсера через Instaloader
 
@@ -21,6 +130,7 @@ class InstagramParser:
             username: Instagram логин
             password: Instagram пароль (не нужен если есть сессия)
             session_file: Путь к файлу сессии
+            rate_limiter: Общий (межпроцессный) лимитер запросов для этого аккаунта
         """
         # Настройки для обхода rate limiting
         self.L = instaloader.Instaloader(
@@ -36,7 +146,8 @@ class InstagramParser:
             filename_pattern='{date}',
             request_timeout=300,  # Увеличили таймаут
             fatal_status_codes=[429],  # 429 = Too Many Requests
-            max_connection_attempts=3  # Меньше попыток переподключения
+            max_connection_attempts=3,  # Меньше попыток переподключения
+            rate_controller=AdaptivePacing
         )
 
         # Настройки rate limiting
@@ -50,7 +161,16 @@ class InstagramParser:
         self.logged_in = False
         self.username = username
         self.last_request_time = None
-        self.min_delay_between_requests = 3  # Минимальная задержка между запросами
+        self.rate_limiter = rate_limiter or RateLimitManager(name=username or "anonymous")
+        self.rate_limit_hits = 0  # сколько раз Instagram ответил 429 / "Please wait" этой сессии
+        self.job_cache: Optional[JobFetchCache] = None  # выставляет пул сессий на время job
+
+        # Все запросы instaloader идут через context.get_json (GraphQL) и context.get_iphone_json
+        # (i.instagram.com, комментарии больших постов): здесь каждый запрос ждёт токен лимитера,
+        # а его исход подстраивает темп (AIMD) и попадает в статистику job
+        self._pacing = threading.local()
+        self.L.context.get_json = self._paced(self.L.context.get_json)
+        self.L.context.get_iphone_json = self._paced(self.L.context.get_iphone_json)
 
         # Приоритет: 1) переданный session_file, 2) из ENV, 3) стандартный путь Instaloader
         if session_file and os.path.exists(session_file):
@@ -70,23 +190,75 @@ class InstagramParser:
             self.session_file = None
 
         # Попытка загрузить существующую сессию
-        if self.username and self.session_file and os.path.exists(self.session_file):
-            try:
-                self.L.load_session_from_file(self.username, self.session_file)
-                self.logged_in = True
-                print(f"✅ Session loaded for {self.username}")
-
-                # НЕ проверяем сессию сразу чтобы избежать rate limit
-                # Проверка произойдет при первом реальном запросе
-
-            except Exception as e:
-                print(f"⚠️ Failed to load session: {e}")
-                self.logged_in = False
+        self.session_mtime: Optional[float] = None  # mtime файла на момент загрузки/сохранения
+        self._load_session()
 
         # Если сессия не загрузилась и есть пароль, пытаемся войти
         if not self.logged_in and username and password:
             self._login_with_retry(username, password)
 
+    def _paced(self, request):
+        """Запрос instaloader через лимитер; вложенный (get_iphone_json -> get_json) — без второго токена"""
+        def paced_request(*args, **kwargs):
+            if getattr(self._pacing, "active", False):
+                return request(*args, **kwargs)
+            self._wait_if_needed()
+            if self.job_cache is not None:
+                self.job_cache.count("http_requests")
+            self._pacing.active = True
+            try:
+                data = request(*args, **kwargs)
+            except Exception as e:
+                if is_rate_limit_error(e):
+                    self._on_rate_limited()
+                raise
+            finally:
+                self._pacing.active = False
+            self.rate_limiter.record_success()
+            return data
+
+        return paced_request
+
+    def _file_mtime(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.session_file) if self.session_file else None
+        except OSError:
+            return None
+
+    def _load_session(self) -> bool:
+        if not (self.username and self.session_file and os.path.exists(self.session_file)):
+            return False
+        try:
+            self.L.load_session_from_file(self.username, self.session_file)
+            self.logged_in = True
+            self.session_mtime = self._file_mtime()
+            print(f"✅ Session loaded for {self.username}")
+
+            # НЕ проверяем сессию сразу чтобы избежать rate limit
+            # Проверка произойдет при первом реальном запросе
+
+        except Exception as e:
+            print(f"⚠️ Failed to load session: {e}")
+            self.logged_in = False
+        return self.logged_in
+
+    def refresh_session(self) -> None:
+        """
+        Фоновое обновление долгоживущей сессии (без запросов к Instagram):
+        файл изменился (заново прошли setup_instagram_auth.py) — перечитываем его,
+        иначе сохраняем в файл текущие cookies, чтобы рестарт поднимал свежую сессию.
+        """
+        mtime = self._file_mtime()
+        if mtime is not None and mtime != self.session_mtime:
+            self._load_session()
+        elif self.logged_in and self.session_file:
+            self.L.save_session_to_file(self.session_file)
+            self.session_mtime = self._file_mtime()
+
+    def close(self) -> None:
+        """Закрывает HTTP-сессию instaloader"""
+        self.L.close()
+
     def _login_with_retry(self, username: str, password: str, max_retries: int = 3):
         """Вход с повторными попытками при ошибке"""
         for attempt in range(max_retries):
@@ -94,7 +266,7 @@ class InstagramParser:
                 wait_time = (attempt + 1) * 30  # 30, 60, 90 секунд
                 if attempt > 0:
                     print(f"⏳ Waiting {wait_time} seconds before retry...")
-                    time.sleep(wait_time)
+                    interruptible_sleep(wait_time)
 
                 self.L.login(username, password)
                 self.logged_in = True
@@ -104,12 +276,14 @@ class InstagramParser:
                 if self.session_file:
                     os.makedirs(os.path.dirname(self.session_file) or ".", exist_ok=True)
                     self.L.save_session_to_file(self.session_file)
+                    self.session_mtime = self._file_mtime()
                     print(f"✅ Session saved to {self.session_file}")
                 break
 
             except instaloader.exceptions.ConnectionException as e:
                 if "Please wait a few minutes" in str(e):
                     print(f"⚠️ Rate limited on login attempt {attempt + 1}/{max_retries}")
+                    self.rate_limit_hits += 1
                     if attempt == max_retries - 1:
                         print(f"❌ Failed to login after {max_retries} attempts due to rate limiting")
                         self.logged_in = False
@@ -120,18 +294,46 @@ class InstagramParser:
                 self.logged_in = False
                 break
 
+    def _on_rate_limited(self):
+        """Instagram ответил 429 / "Please wait a few minutes" — блокируем аккаунт в лимитере"""
+        self.rate_limit_hits += 1
+        blocked = self.rate_limiter.record_rate_limit()
+        if self.job_cache is not None and self.job_cache.job_id:
+            publish_event(self.job_cache.job_id, "rate_limit", account=self.rate_limiter.name,
+                          wait_seconds=blocked)
+
     def _wait_if_needed(self):
-        """Ждёт перед следующим запросом чтобы избежать rate limiting"""
-        if self.last_request_time:
-            elapsed = (datetime.now() - self.last_request_time).total_seconds()
-            if elapsed < self.min_delay_between_requests:
-                wait_time = self.min_delay_between_requests - elapsed + random.uniform(0.5, 2.0)
-                print(f"⏳ Waiting {wait_time:.1f}s to avoid rate limiting...")
-                time.sleep(wait_time)
+        """Ждёт токен у общего rate limiter перед следующим запросом (ожидание прерывает отмена job)"""
+        check_cancelled()
+        waited = self.rate_limiter.acquire(sleep=interruptible_sleep)
+        if waited > 0:
+            # небольшой случайный разброс (до 10% паузы), чтобы запросы не шли ровным темпом
+            interruptible_sleep(random.uniform(0, 0.1 * waited))
 
         self.last_request_time = datetime.now()
 
-    def extract_post_id_from_url(self, url: str) -> str:
+    def _bind(self, post: instaloader.Post) -> instaloader.Post:
+        """Post из кэша job, привязанный к контексту (сессии) этого парсера"""
+        if post._context is self.L.context:
+            return post
+        bound = instaloader.Post(self.L.context, post._node, post._owner_profile)
+        bound._full_metadata_dict = post._full_metadata_dict
+        return bound
+
+    def get_post(self, shortcode: str) -> instaloader.Post:
+        """Post по shortcode: из кэша job, иначе один запрос Post.from_shortcode"""
+        cached = self.job_cache.get(shortcode) if self.job_cache is not None else None
+        if cached is not None:
+            return self._bind(cached)
+
+        post = instaloader.Post.from_shortcode(self.L.context, shortcode)
+        if self.job_cache is not None:
+            self.job_cache.count("post_metadata")
+            self.job_cache.put(post)
+        return post
+
+    @staticmethod
+    def extract_post_id_from_url(url: str) -> str:
         """
         Извлекает shortcode поста из URL
 
@@ -152,7 +354,8 @@ class InstagramParser:
 
         raise ValueError(f"Could not extract post ID from URL: {url}")
 
-    def extract_username_from_url(self, url: str) -> Optional[str]:
+    @staticmethod
+    def extract_username_from_url(url: str) -> Optional[str]:
         """
         Извлекает username из URL профиля
 
@@ -178,15 +381,9 @@ class InstagramParser:
 
         for attempt in range(retry_count):
             try:
-                if attempt > 0:
-                    wait_time = (attempt + 1) * 60  # 60, 120, 180 секунд
-                    print(f"⏳ Waiting {wait_time}s before retry {attempt + 1}/{retry_count}...")
-                    time.sleep(wait_time)
-
-                self._wait_if_needed()
-
+                # После rate limit пауза выдерживается лимитером (блокировка 5/15/60 мин)
                 shortcode = self.extract_post_id_from_url(url)
-                post = instaloader.Post.from_shortcode(self.L.context, shortcode)
+                post = self.get_post(shortcode)
 
                 # Собираем базовую информацию
                 info = {
@@ -211,6 +408,7 @@ class InstagramParser:
             except instaloader.exceptions.ConnectionException as e:
                 last_error = e
                 if "Please wait a few minutes" in str(e) or "429" in str(e):
+                    # лимитер уже заблокировал аккаунт и замедлил темп — следующая попытка ждёт его
                     print(f"⚠️ Rate limited on attempt {attempt + 1}/{retry_count}")
                 else:
                     raise e
@@ -220,99 +418,199 @@ class InstagramParser:
 
         raise Exception(f"Failed to get post info after {retry_count} attempts: {last_error}")
 
-    def parse_comments(self, post_id: str, max_results: int = 500) -> List[Dict]:
+    def parse_comments(self, post_id: str, max_results: int = 500, since: Optional[Dict] = None,
+                       post: Optional[instaloader.Post] = None) -> List[Dict]:
         """
         Парсит комментарии к посту Instagram с обработкой rate limiting
 
         Args:
             post_id: Shortcode поста
             max_results: Максимальное количество комментариев
+            since: Водяной знак прошлого ингеста — остановиться на уже виденных
+            post: Уже загруженный instaloader.Post (без повторного запроса метаданных)
 
         Returns:
             List[Dict] с комментариями
         """
         comments = []
+        for page in self.iter_comment_pages(post_id, max_results, since=since, post=post):
+            comments.extend(page)
+        return comments
+
+    def _comment_iterator(self, post: instaloader.Post, resume_state: Optional[Dict] = None):
+        """
+        Итератор node комментариев поста с freeze() — позицию обхода можно сохранить и продолжить.
+        Endpoint выбирается как в Post.get_comments: пост длиннее страницы GraphQL — iPhone
+        endpoint (IPhoneCommentIterator), иначе GraphQL NodeIterator.
+        """
+        iphone = post.comments > instaloader.NodeIterator.page_length()
+        if resume_state and (resume_state.get("endpoint") == "iphone") != iphone:
+            # чекпоинт другого endpoint (пост перерос страницу GraphQL) — обход с начала
+            print(f"⚠️ Cannot resume comments of post {post.shortcode}: saved cursor is for another endpoint")
+            resume_state = None
+        if iphone:
+            iterator = IPhoneCommentIterator(self.L.context, post.mediaid, resume_state)
+            if resume_state:
+                print(f"⏩ Resuming comments of post {post.shortcode} from #{iterator.total_index}")
+            return iterator
+
+        resume_state = resume_state if resume_state and resume_state.get("remaining_data") else None
+        iterator = instaloader.NodeIterator(
+            self.L.context,
+            COMMENTS_QUERY_HASH,
+            lambda d: d['data']['shortcode_media']['edge_media_to_parent_comment'],
+            lambda node: node,  # сырые node, в dict переводим сами
+            {'shortcode': post.shortcode},
+            f'https://www.instagram.com/p/{post.shortcode}/',
+            # при продолжении первая страница берётся из чекпоинта, без лишнего запроса
+            first_data=resume_state["remaining_data"] if resume_state else None,
+        )
+        if resume_state:
+            # курсор к аккаунту не привязан — продолжаем с той сессией, что выдал пул
+            frozen = instaloader.FrozenNodeIterator(**{**resume_state, "context_username": self.L.context.username})
+            try:
+                iterator.thaw(frozen)
+                print(f"⏩ Resuming comments of post {post.shortcode} from #{frozen.total_index}")
+            except instaloader.exceptions.InvalidArgumentException as e:
+                print(f"⚠️ Cannot resume comments of post {post.shortcode}: {e}")
+                return self._comment_iterator(post)
+        return iterator
+
+    @staticmethod
+    def _comment_dict(node: Dict) -> Dict:
+        created_at = None
+        if node.get("created_at"):
+            created_at = datetime.fromtimestamp(node["created_at"], tz=timezone.utc).replace(tzinfo=None).isoformat()
+        return {
+            "id": str(node["id"]),
+            "text": node.get("text", ""),
+            "author": node["owner"]["username"],
+            "author_id": str(node["owner"]["id"]),
+            "likes": (node.get("edge_liked_by") or {}).get("count", 0),
+            "created_at": created_at,
+            "parent_comment_id": None
+        }
 
+    def iter_comment_pages(self, post_id: str, max_results: int = 500, page_size: int = 50,
+                           since: Optional[Dict] = None,
+                           post: Optional[instaloader.Post] = None,
+                           checkpoint: Optional[CommentCheckpoint] = None) -> Iterator[List[Dict]]:
+        """
+        То же, что parse_comments, но отдаёт комментарии страницами по page_size (генератор).
+        После rate limit обход продолжается с курсора, на котором оборвался.
+
+        since — водяной знак (см. service/watermarks.py): Instagram отдаёт комментарии
+        от новых к старым, поэтому обход прекращается на первом уже виденном.
+        post — уже загруженный Post: метаданные поста повторно не запрашиваются.
+        checkpoint — чекпоинт поста (instagram_comment_cursors.py): обход начинается с
+        сохранённого курсора, после каждой страницы позиция отмечается в чекпоинте.
+        """
         # Проверяем авторизацию
         if not self.logged_in:
             print(f"⚠️ Not logged in. Cannot fetch comments.")
-            return []
+            return
+
+        seen = set()
+        page: List[Dict] = []
+        resume_state = checkpoint.resume_state if checkpoint else None
+        if resume_state:
+            # продолжаем оборванный обход: дальше идут более старые, ещё не записанные
+            # комментарии — водяной знак (он по самым свежим) их отсёк бы
+            since = None
+        iterator = None
+
+        def flush_page() -> Iterator[List[Dict]]:
+            nonlocal page
+            if page:
+                if checkpoint:
+                    checkpoint.mark(page[-1]["id"], iterator.freeze()._asdict())
+                yield page
+                page = []
 
         max_retries = 3
         for retry in range(max_retries):
             try:
-                if retry > 0:
-                    # Экспоненциальная задержка: 2 мин, 5 мин, 10 мин
-                    wait_time = min(120 * (2 ** retry), 600)
-                    print(f"⏳ Rate limited. Waiting {wait_time}s before retry {retry + 1}/{max_retries}...")
-                    time.sleep(wait_time)
-
-                self._wait_if_needed()
-
-                post = instaloader.Post.from_shortcode(self.L.context, post_id)
+                # Пост берётся из кэша job, если метаданные уже запрашивались
+                post = self._bind(post) if post is not None else self.get_post(post_id)
 
                 # Проверяем, доступны ли комментарии
                 if post.comments == 0:
                     print(f"ℹ️ Post {post_id} has no comments")
-                    return []
+                    if checkpoint:
+                        checkpoint.mark(None, None)
+                    return
 
-                print(f"📥 Fetching up to {max_results} comments from post {post_id}...")
+                if iterator is None:
+                    print(f"📥 Fetching up to {max_results} comments from post {post_id}...")
+                else:
+                    # после rate limit — новый итератор с той же позиции
+                    resume_state = iterator.freeze()._asdict()
 
+                iterator = self._comment_iterator(post, resume_state)
                 comment_count = 0
-                for comment in post.get_comments():
-                    if comment_count >= max_results:
+                for node in iterator:
+                    if len(seen) >= max_results:
                         break
 
                     try:
-                        # Добавляем случайную задержку между комментариями
-                        if comment_count > 0 and comment_count % 10 == 0:
-                            delay = random.uniform(2, 5)
-                            time.sleep(delay)
-
-                        # Базовая структура комментария
-                        comment_data = {
-                            "id": str(comment.id),
-                            "text": comment.text,
-                            "author": comment.owner.username,
-                            "author_id": str(comment.owner.userid),
-                            "likes": getattr(comment, 'likes_count', 0),
-                            "created_at": comment.created_at_utc.isoformat() if comment.created_at_utc else None,
-                            "parent_comment_id": None
-                        }
-
-                        comments.append(comment_data)
                         comment_count += 1
 
+                        comment_data = self._comment_dict(node)
+                        if comment_data["id"] in seen:
+                            continue
+
+                        if is_seen(since, comment_data["id"], comment_data["created_at"]):
+                            print(f"ℹ️ Reached already ingested comments of post {post_id}")
+                            break
+                        if in_fetched_range(since, comment_data["created_at"]):
+                            continue  # получен обрезанным ингестом — идём ниже, к непрочитанным
+
+                        seen.add(comment_data["id"])
+                        page.append(comment_data)
+
+                        if len(page) >= page_size:
+                            yield from flush_page()
+
                         # Progress update
-                        if comment_count % 50 == 0:
-                            print(f"  Progress: {comment_count}/{min(post.comments, max_results)} comments...")
+                        if len(seen) % 50 == 0:
+                            print(f"  Progress: {len(seen)}/{min(post.comments, max_results)} comments...")
 
                     except Exception as e:
                         print(f"⚠️ Error processing comment {comment_count}: {e}")
                         continue
 
-                print(f"✅ Successfully parsed {len(comments)} comments from post {post_id}")
-                return comments
+                # Обход завершён (конец, лимит или водяной знак) — чекпоинт больше не нужен.
+                # Отметка до yield, как в flush_page: writer может записать страницу раньше,
+                # чем генератор продолжится, и отметка без записи осталась бы навсегда
+                if checkpoint:
+                    checkpoint.mark(page[-1]["id"] if page else None, None)
+                if page:
+                    yield page
+                    page = []
+                print(f"✅ Successfully parsed {len(seen)} comments from post {post_id}")
+                return
 
             except instaloader.exceptions.ConnectionException as e:
                 if "Please wait a few minutes" in str(e) or "something went wrong" in str(e):
                     print(f"⚠️ Rate limited while fetching comments (attempt {retry + 1}/{max_retries})")
                     if retry == max_retries - 1:
                         print(f"❌ Failed to fetch comments after {max_retries} attempts")
-                        return comments  # Возвращаем то, что успели получить
+                        break  # Отдаём то, что успели получить; курсор остаётся в чекпоинте
                 else:
                     raise e
             except instaloader.exceptions.LoginRequiredException:
                 print(f"❌ Login required to access comments")
-                return []
+                break
             except Exception as e:
                 print(f"❌ Error parsing comments: {str(e)}")
                 if retry == max_retries - 1:
-                    return comments  # Возвращаем то, что успели получить
+                    break  # Отдаём то, что успели получить
 
-        return comments
+        if iterator is not None:
+            yield from flush_page()
 
-    def detect_content_type(self, url: str) -> str:
+    @staticmethod
+    def detect_content_type(url: str) -> str:
         """
         Определяет тип контента по URL
 
@@ -321,7 +619,7 @@ class InstagramParser:
         """
         if '/p/' in url or '/reel/' in url or '/tv/' in url:
             return 'post'
-        elif self.extract_username_from_url(url):
+        elif InstagramParser.extract_username_from_url(url):
             return 'profile'
         return 'unknown'
 
@@ -343,8 +641,9 @@ class InstagramParser:
         }
 
         try:
-            self._wait_if_needed()
             profile = instaloader.Profile.from_username(self.L.context, username)
+            if self.job_cache is not None:
+                self.job_cache.count("profile_metadata")
 
             # Информация о профиле
             result["profile"] = {
@@ -367,9 +666,10 @@ class InstagramParser:
                 if post_count >= max_posts:
                     break
 
-                # Большая задержка между постами
-                if post_count > 0:
-                    time.sleep(random.uniform(5, 10))
+                # Пост из ленты профиля уже содержит метаданные — кладём его в кэш job,
+                # чтобы ингест комментариев не запрашивал его повторно по shortcode
+                if self.job_cache is not None:
+                    self.job_cache.put(post)
 
                 post_data = {
                     "post_id": post.shortcode,
@@ -386,7 +686,7 @@ class InstagramParser:
                 # Парсим комментарии к посту
                 if self.logged_in and max_comments_per_post > 0:
                     try:
-                        comments = self.parse_comments(post.shortcode, max_comments_per_post)
+                        comments = self.parse_comments(post.shortcode, max_comments_per_post, post=post)
                         post_data["comments"] = comments
                     except Exception as e:
                         print(f"Failed to parse comments for post {post.shortcode}: {e}")
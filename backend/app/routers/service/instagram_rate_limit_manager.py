@@ -1,136 +1,288 @@
 # instagram_rate_limit_manager.py
 """
 Утилита для управления rate limiting при работе с Instagram
+
+Token bucket (темп запросов) + скользящее окно (лимит запросов в час) + блокировка
+после 429. Состояние хранится в SQLite (WAL): каждая выдача токена — короткая
+транзакция BEGIN IMMEDIATE, поэтому счётчики корректно делятся между процессами
+uvicorn и воркерами, а файл не перезаписывается целиком на каждый запрос.
+
+Темп адаптивный (AIMD): после каждого успешного ответа скорость растёт на
+rate_increase запросов/сек, после 429 / "something went wrong" — падает в
+rate_decrease раз. Выученный темп лежит в той же таблице и переживает job и рестарты.
+
+Использование:
+    limiter = RateLimitManager("altel_account")
+    limiter.acquire()                 # ждёт токен
+
+    with limiter:                     # ждёт токен, успех ускоряет, 429 -> блокировка и замедление
+        post = instaloader.Post.from_shortcode(...)
+
+    @limiter.limited
+    def fetch(...): ...
 """
 
+import functools
+import sqlite3
 import time
-import json
-from datetime import datetime, timedelta
-from pathlib import Path
-from typing import Dict, Optional
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterator, Optional, Tuple
 
+# Паузы после повторных rate limit (минуты): 1-й, 2-й, 3-й, дальше
+RATE_LIMIT_BACKOFF_MINUTES = [5, 15, 60, 240]
 
-class RateLimitManager:
-    """Менеджер для отслеживания и управления rate limits"""
 
-    def __init__(self, cache_file: str = "instagram_rate_limit.json"):
-        self.cache_file = Path(cache_file)
-        self.load_state()
+def is_rate_limit_error(error: BaseException) -> bool:
+    error_msg = str(error).lower()
+    return "please wait" in error_msg or "429" in error_msg or "something went wrong" in error_msg
 
-    def load_state(self):
-        """Загружает состояние из файла"""
-        if self.cache_file.exists():
-            with open(self.cache_file, 'r') as f:
-                self.state = json.load(f)
-        else:
-            self.state = {
-                "last_request_time": None,
-                "request_count": 0,
-                "last_rate_limit_time": None,
-                "rate_limit_count": 0,
-                "blocked_until": None
-            }
-
-    def save_state(self):
-        """Сохраняет состояние в файл"""
-        with open(self.cache_file, 'w') as f:
-            json.dump(self.state, f, indent=2, default=str)
+
+class RateLimitManager:
+    """Менеджер для отслеживания и управления rate limits (общий для процессов)"""
+
+    def __init__(self, name: str = "default", db_path: str = "instagram_rate_limit.db",
+                 min_interval: float = 1.0, burst: int = 1,
+                 max_requests_per_hour: int = 100,
+                 start_interval: float = 3.0, max_interval: float = 300.0,
+                 rate_increase: float = 0.0005, rate_decrease: float = 0.5):
+        """
+        Args:
+            name: Имя лимита (например, Instagram аккаунт) — у каждого своё состояние
+            db_path: SQLite файл, общий для всех процессов
+            min_interval: Минимум секунд на токен — быстрее AIMD не разгоняется
+            burst: Ёмкость bucket — сколько запросов можно сделать подряд без паузы
+            max_requests_per_hour: Лимит скользящего окна в 1 час
+            start_interval: Секунд на токен, пока темп ещё не выучен
+            max_interval: Максимум секунд на токен — медленнее AIMD не опускается
+            rate_increase: Прибавка к скорости (запросов/сек) за успешный ответ
+            rate_decrease: Во сколько раз падает скорость после rate limit
+        """
+        self.name = name
+        self.db_path = db_path
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.start_interval = min(max(start_interval, min_interval), self.max_interval)
+        self.rate_increase = rate_increase
+        self.rate_decrease = rate_decrease
+        self.burst = max(1, burst)
+        self.max_requests_per_hour = max_requests_per_hour
+        self.window_seconds = 3600
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets ("
+                " name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL,"
+                " blocked_until REAL, rate_limit_count INTEGER NOT NULL DEFAULT 0,"
+                " last_rate_limit_time REAL, last_request_time REAL, rate REAL)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(rate_buckets)")}
+            if "rate" not in columns:  # база от версии без AIMD
+                conn.execute("ALTER TABLE rate_buckets ADD COLUMN rate REAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS rate_requests (name TEXT NOT NULL, ts REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS rate_requests_name_ts ON rate_requests (name, ts)")
+            conn.execute(
+                "INSERT OR IGNORE INTO rate_buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                (self.name, float(self.burst), time.time())
+            )
+
+    @property
+    def min_rate(self) -> float:
+        return 1.0 / self.max_interval
+
+    @property
+    def max_rate(self) -> float:
+        return 1.0 / self.min_interval
+
+    def _rate(self, conn: sqlite3.Connection) -> float:
+        """Выученная скорость (запросов/сек) в пределах [min_rate, max_rate]"""
+        (rate,) = conn.execute("SELECT rate FROM rate_buckets WHERE name = ?", (self.name,)).fetchone()
+        if rate is None:
+            rate = 1.0 / self.start_interval
+        return min(self.max_rate, max(self.min_rate, rate))
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """BEGIN IMMEDIATE — эксклюзивная запись между процессами на время проверки"""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+    def _check(self, conn: sqlite3.Connection, now: float, consume: bool) -> Tuple[bool, Optional[float]]:
+        tokens, updated_at, blocked_until = conn.execute(
+            "SELECT tokens, updated_at, blocked_until FROM rate_buckets WHERE name = ?", (self.name,)
+        ).fetchone()
+
+        # Блокировка после rate limit
+        if blocked_until and now < blocked_until:
+            return False, blocked_until - now
+        if blocked_until:
+            conn.execute(
+                "UPDATE rate_buckets SET blocked_until = NULL, rate_limit_count = 0 WHERE name = ?",
+                (self.name,)
+            )
+
+        # Скользящее окно: не больше max_requests_per_hour за последний час
+        window_start = now - self.window_seconds
+        conn.execute("DELETE FROM rate_requests WHERE name = ? AND ts < ?", (self.name, window_start))
+        in_window, oldest = conn.execute(
+            "SELECT COUNT(*), MIN(ts) FROM rate_requests WHERE name = ?", (self.name,)
+        ).fetchone()
+        if in_window >= self.max_requests_per_hour:
+            return False, oldest + self.window_seconds - now
+
+        # Token bucket: пополнение с выученной скоростью, не больше burst
+        rate = self._rate(conn)
+        tokens = min(float(self.burst), tokens + (now - updated_at) * rate)
+        if tokens < 1 - 1e-9:  # допуск на округление float
+            conn.execute("UPDATE rate_buckets SET tokens = ?, updated_at = ? WHERE name = ?",
+                         (tokens, now, self.name))
+            return False, (1 - tokens) / rate
+
+        if consume:
+            tokens = max(0.0, tokens - 1)
+            conn.execute("INSERT INTO rate_requests (name, ts) VALUES (?, ?)", (self.name, now))
+            conn.execute(
+                "UPDATE rate_buckets SET tokens = ?, updated_at = ?, last_request_time = ? WHERE name = ?",
+                (tokens, now, now, self.name)
+            )
+        return True, None
 
     def can_make_request(self) -> tuple[bool, Optional[float]]:
         """
-        Проверяет, можно ли делать запрос
+        Проверяет, можно ли делать запрос (токен не расходует)
         Returns: (можно_ли, время_ожидания_в_секундах)
         """
-        now = datetime.now()
-
-        # Проверяем блокировку
-        if self.state["blocked_until"]:
-            blocked_until = datetime.fromisoformat(self.state["blocked_until"])
-            if now < blocked_until:
-                wait_time = (blocked_until - now).total_seconds()
-                return False, wait_time
-            else:
-                # Блокировка истекла
-                self.state["blocked_until"] = None
-                self.state["rate_limit_count"] = 0
-
-        # Проверяем время с последнего запроса
-        if self.state["last_request_time"]:
-            last_time = datetime.fromisoformat(self.state["last_request_time"])
-            elapsed = (now - last_time).total_seconds()
-
-            # Минимум 3 секунды между запросами
-            if elapsed < 3:
-                return False, 3 - elapsed
-
-            # Сброс счетчика если прошло больше часа
-            if elapsed > 3600:
-                self.state["request_count"] = 0
-
-        # Ограничение на количество запросов в час
-        if self.state["request_count"] >= 100:
-            # Блокируем на час
-            self.state["blocked_until"] = (now + timedelta(hours=1)).isoformat()
-            self.save_state()
-            return False, 3600
-
-        return True, None
+        with self._transaction() as conn:
+            return self._check(conn, time.time(), consume=False)
 
-    def record_request(self):
-        """Записывает успешный запрос"""
-        self.state["last_request_time"] = datetime.now().isoformat()
-        self.state["request_count"] += 1
-        self.save_state()
-
-    def record_rate_limit(self):
-        """Записывает факт rate limiting"""
-        now = datetime.now()
-        self.state["last_rate_limit_time"] = now.isoformat()
-        self.state["rate_limit_count"] += 1
-
-        # Экспоненциальная задержка в зависимости от количества rate limits
-        if self.state["rate_limit_count"] == 1:
-            wait_minutes = 5
-        elif self.state["rate_limit_count"] == 2:
-            wait_minutes = 15
-        elif self.state["rate_limit_count"] == 3:
-            wait_minutes = 60
-        else:
-            wait_minutes = 240  # 4 часа
+    def try_acquire(self) -> tuple[bool, Optional[float]]:
+        """Забирает токен, если можно. Returns: (получен, время_ожидания)"""
+        with self._transaction() as conn:
+            return self._check(conn, time.time(), consume=True)
 
-        self.state["blocked_until"] = (now + timedelta(minutes=wait_minutes)).isoformat()
-        self.save_state()
+    def acquire(self, timeout: Optional[float] = None, sleep: Callable[[float], None] = time.sleep) -> float:
+        """
+        Ждёт и забирает токен.
+        Returns: сколько секунд ждали. TimeoutError, если ждать дольше timeout.
+        """
+        started = time.time()
+        while True:
+            ok, wait_time = self.try_acquire()
+            if ok:
+                return time.time() - started
+            if timeout is not None and time.time() - started + wait_time > timeout:
+                raise TimeoutError(f"Rate limit '{self.name}': need to wait {wait_time:.0f}s")
+            if wait_time > 60:
+                print(f"⏳ Rate limit active for {self.name}. Waiting {wait_time:.0f} seconds...")
+            sleep(wait_time)
 
-        print(f"⚠️ Rate limited! Blocking for {wait_minutes} minutes")
-        print(f"   This is rate limit #{self.state['rate_limit_count']} in this session")
+    def record_request(self):
+        """Записывает запрос, сделанный без acquire()"""
+        with self._transaction() as conn:
+            now = time.time()
+            conn.execute("INSERT INTO rate_requests (name, ts) VALUES (?, ?)", (self.name, now))
+            conn.execute("UPDATE rate_buckets SET last_request_time = ? WHERE name = ?", (now, self.name))
+
+    def record_success(self) -> float:
+        """Успешный ответ — аддитивно ускоряемся. Returns: новая скорость (запросов/сек)"""
+        with self._transaction() as conn:
+            rate = min(self.max_rate, self._rate(conn) + self.rate_increase)
+            conn.execute("UPDATE rate_buckets SET rate = ? WHERE name = ?", (rate, self.name))
+        return rate
+
+    def record_rate_limit(self) -> float:
+        """Записывает факт rate limiting. Returns: на сколько секунд заблокированы"""
+        with self._transaction() as conn:
+            now = time.time()
+            (count,) = conn.execute(
+                "SELECT rate_limit_count FROM rate_buckets WHERE name = ?", (self.name,)
+            ).fetchone()
+            count += 1
+            # Экспоненциальная задержка в зависимости от количества rate limits
+            wait_minutes = RATE_LIMIT_BACKOFF_MINUTES[min(count, len(RATE_LIMIT_BACKOFF_MINUTES)) - 1]
+            # ... и мультипликативное замедление выученного темпа
+            rate = max(self.min_rate, self._rate(conn) * self.rate_decrease)
+            conn.execute(
+                "UPDATE rate_buckets SET rate_limit_count = ?, last_rate_limit_time = ?, blocked_until = ?,"
+                " tokens = 0, updated_at = ?, rate = ? WHERE name = ?",
+                (count, now, now + wait_minutes * 60, now, rate, self.name)
+            )
+
+        print(f"⚠️ Rate limited! Blocking {self.name} for {wait_minutes} minutes")
+        print(f"   This is rate limit #{count} in this session, pace slowed to {60 * rate:.1f} req/min")
+        return wait_minutes * 60.0
+
+    # --- декоратор / контекстный менеджер ---
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is None:
+            self.record_success()
+        elif is_rate_limit_error(exc):
+            self.record_rate_limit()
+        return False
+
+    def limited(self, func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+        return wrapper
 
     def reset(self):
-        """Сброс всех ограничений (использовать осторожно)"""
-        self.state = {
-            "last_request_time": None,
-            "request_count": 0,
-            "last_rate_limit_time": None,
-            "rate_limit_count": 0,
-            "blocked_until": None
-        }
-        self.save_state()
+        """Сброс всех ограничений и выученного темпа (использовать осторожно)"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM rate_requests WHERE name = ?", (self.name,))
+            conn.execute(
+                "UPDATE rate_buckets SET tokens = ?, updated_at = ?, blocked_until = NULL,"
+                " rate_limit_count = 0, last_rate_limit_time = NULL, rate = NULL WHERE name = ?",
+                (float(self.burst), time.time(), self.name)
+            )
         print("✅ Rate limit state reset")
 
     def status(self) -> Dict:
         """Возвращает текущий статус"""
-        now = datetime.now()
+        now = time.time()
+        with self._transaction() as conn:
+            can_request, wait_time = self._check(conn, now, consume=False)
+            blocked_until, rate_limit_count, last_request = conn.execute(
+                "SELECT blocked_until, rate_limit_count, last_request_time FROM rate_buckets WHERE name = ?",
+                (self.name,)
+            ).fetchone()
+            (requests_made,) = conn.execute(
+                "SELECT COUNT(*) FROM rate_requests WHERE name = ? AND ts >= ?",
+                (self.name, now - self.window_seconds)
+            ).fetchone()
+            rate = self._rate(conn)
+
         status = {
-            "can_request": self.can_make_request()[0],
-            "requests_made": self.state["request_count"],
-            "requests_remaining": max(0, 100 - self.state["request_count"]),
-            "rate_limit_count": self.state["rate_limit_count"]
+            "name": self.name,
+            "can_request": can_request,
+            "wait_seconds": wait_time or 0,
+            "requests_made": requests_made,
+            "requests_remaining": max(0, self.max_requests_per_hour - requests_made),
+            "rate_limit_count": rate_limit_count,
+            "pace_requests_per_minute": round(60 * rate, 2),  # выученный AIMD темп
+            "pace_interval_seconds": round(1 / rate, 2),
+            "last_request_time": datetime.fromtimestamp(last_request).isoformat() if last_request else None
         }
 
-        if self.state["blocked_until"]:
-            blocked_until = datetime.fromisoformat(self.state["blocked_until"])
-            if now < blocked_until:
-                status["blocked_for_seconds"] = (blocked_until - now).total_seconds()
-                status["blocked_until"] = self.state["blocked_until"]
+        if blocked_until and now < blocked_until:
+            status["blocked_for_seconds"] = blocked_until - now
+            status["blocked_until"] = datetime.fromtimestamp(blocked_until).isoformat()
 
         return status
 
@@ -140,45 +292,27 @@ def safe_instagram_request(func, *args, **kwargs):
     """
     Обертка для безопасного выполнения Instagram запросов
     """
-    manager = RateLimitManager()
-
-    # Проверяем, можно ли делать запрос
-    can_request, wait_time = manager.can_make_request()
-
-    if not can_request:
-        print(f"⏳ Rate limit active. Waiting {wait_time:.0f} seconds...")
-        time.sleep(wait_time)
-
-    try:
-        # Делаем запрос
-        result = func(*args, **kwargs)
-        manager.record_request()
-        return result
-
-    except Exception as e:
-        error_msg = str(e).lower()
-        if "please wait" in error_msg or "429" in error_msg or "something went wrong" in error_msg:
-            manager.record_rate_limit()
-            raise
-        else:
-            raise
+    with RateLimitManager():
+        return func(*args, **kwargs)
 
 
 if __name__ == "__main__":
     import sys
 
-    manager = RateLimitManager()
+    name = sys.argv[2] if len(sys.argv) > 2 else "default"
+    manager = RateLimitManager(name)
 
     if len(sys.argv) > 1:
         command = sys.argv[1]
 
         if command == "status":
             status = manager.status()
-            print("\n📊 Instagram Rate Limit Status:")
+            print(f"\n📊 Instagram Rate Limit Status ({name}):")
             print(f"   Can make request: {'✅ Yes' if status['can_request'] else '❌ No'}")
             print(f"   Requests made: {status['requests_made']}")
             print(f"   Requests remaining: {status['requests_remaining']}")
             print(f"   Rate limit hits: {status['rate_limit_count']}")
+            print(f"   Learned pace: {status['pace_requests_per_minute']} req/min")
 
             if 'blocked_for_seconds' in status:
                 minutes = status['blocked_for_seconds'] / 60
@@ -193,10 +327,10 @@ if __name__ == "__main__":
 
         else:
             print(f"Unknown command: {command}")
-            print("Usage: python instagram_rate_limit_manager.py [status|reset]")
+            print("Usage: python instagram_rate_limit_manager.py [status|reset] [name]")
     else:
         print("Instagram Rate Limit Manager")
-        print("Usage: python instagram_rate_limit_manager.py [status|reset]")
+        print("Usage: python instagram_rate_limit_manager.py [status|reset] [name]")
         print("\nCurrent status:")
         status = manager.status()
-        print(f"Can make request: {'Yes' if status['can_request'] else 'No'}")
\ No newline at end of file
+        print(f"Can make request: {'Yes' if status['can_request'] else 'No'}")
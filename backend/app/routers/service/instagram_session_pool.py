@@ -0,0 +1,270 @@
+# app/routers/service/instagram_session_pool.py
+"""
+Пул Instagram сессий.
+
+Загружает все файлы сессий из папки (их создаёт setup_instagram_auth.py) и держит
+по InstagramParser на аккаунт — у каждого свой rate limiter и health score.
+Работа раздаётся наименее занятой здоровой сессии; после 429 / "Please wait a few
+minutes" сессия уходит в карантин (15 мин, дальше удваивается).
+
+Пул живёт всё время работы приложения: создаётся при первом Instagram job, фоновый
+поток периодически обновляет сессии (новые/перезаписанные файлы, сохранение cookies),
+на shutdown FastAPI пул закрывается (close_session_pool).
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+from ...service.cancellation import JobCancelled
+from ...config import settings
+from .instagram_parser import InstagramParser, JobFetchCache
+from .instagram_rate_limit_manager import RateLimitManager, is_rate_limit_error
+
+QUARANTINE_BASE_SECONDS = 15 * 60
+QUARANTINE_MAX_SECONDS = 6 * 3600
+
+
+class NoSessionAvailable(Exception):
+    """Все сессии в карантине"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"All Instagram sessions are quarantined, retry in {retry_after / 60:.0f} min")
+        self.retry_after = retry_after
+
+
+@dataclass
+class PooledSession:
+    username: str
+    parser: InstagramParser
+    health: float = 1.0  # 0..1: растёт на успехах, падает вдвое на ошибках
+    in_use: int = 0
+    quarantined_until: float = 0.0
+    strikes: int = 0  # подряд идущие rate limit
+    requests_ok: int = 0
+    requests_failed: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def available(self, now: float) -> bool:
+        return self.quarantined_until <= now
+
+
+def discover_session_files(sessions_dir: str) -> Dict[str, str]:
+    """username -> путь к файлу сессии (./sessions/<username> или session-<username>)"""
+    found = {}
+    directory = Path(sessions_dir)
+    if directory.is_dir():
+        for path in sorted(directory.iterdir()):
+            if path.is_file() and not path.name.startswith("."):
+                username = path.name[len("session-"):] if path.name.startswith("session-") else path.name
+                found[username] = str(path)
+    return found
+
+
+class InstagramSessionPool:
+    def __init__(self, sessions: Dict[str, str], limiter_factory: Callable[[str], RateLimitManager]):
+        """
+        Args:
+            sessions: username -> файл сессии
+            limiter_factory: лимитер для аккаунта (по username)
+        """
+        self._lock = threading.Lock()
+        self._limiter_factory = limiter_factory
+        self._sessions: List[PooledSession] = []
+        self._stop = threading.Event()
+        self._refresher: Optional[threading.Thread] = None
+        for username, session_file in sessions.items():
+            self._add(username, session_file)
+
+        if not self._sessions:
+            # Сессий нет — анонимный парсер (метаданные постов без комментариев)
+            print("⚠️ No Instagram sessions loaded, using anonymous access")
+            self._sessions.append(PooledSession(
+                username="anonymous",
+                parser=InstagramParser(rate_limiter=limiter_factory("anonymous"))
+            ))
+
+        print(f"✅ Instagram session pool: {len(self._sessions)} session(s)")
+
+    def _add(self, username: str, session_file: str) -> bool:
+        parser = InstagramParser(username=username, session_file=session_file,
+                                 rate_limiter=self._limiter_factory(username))
+        if not parser.logged_in:
+            parser.close()
+            return False
+        with self._lock:
+            # первая настоящая сессия заменяет анонимную (если та сейчас не занята)
+            dropped = [s for s in self._sessions if s.username == "anonymous" and not s.in_use]
+            self._sessions = [s for s in self._sessions if s not in dropped] + [PooledSession(username, parser)]
+        for session in dropped:
+            session.parser.close()
+        return True
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _pick(self) -> PooledSession:
+        now = time.time()
+        with self._lock:
+            ready = [s for s in self._sessions if s.available(now)]
+            if not ready:
+                retry_after = min(s.quarantined_until for s in self._sessions) - now
+                raise NoSessionAvailable(retry_after)
+            # наименее занятая, среди равных — самая здоровая
+            chosen = min(ready, key=lambda s: (s.in_use, -s.health))
+            chosen.in_use += 1
+            return chosen
+
+    def _quarantine(self, session: PooledSession) -> None:
+        session.strikes += 1
+        seconds = min(QUARANTINE_BASE_SECONDS * 2 ** (session.strikes - 1), QUARANTINE_MAX_SECONDS)
+        session.quarantined_until = time.time() + seconds
+        session.health *= 0.5
+        print(f"🚫 Instagram session {session.username} quarantined for {seconds / 60:.0f} min")
+
+    def _release(self, session: PooledSession, hits_before: int, error: Optional[BaseException]) -> None:
+        with self._lock:
+            session.in_use -= 1
+            rate_limited = session.parser.rate_limit_hits > hits_before or (
+                error is not None and is_rate_limit_error(error)
+            )
+            if rate_limited:
+                session.requests_failed += 1
+                self._quarantine(session)
+            elif error is not None:
+                session.requests_failed += 1
+                session.health *= 0.8
+            else:
+                session.requests_ok += 1
+                session.strikes = 0
+                session.health = min(1.0, session.health + 0.1)
+
+    @contextmanager
+    def session(self, job_cache: Optional[JobFetchCache] = None) -> Iterator[InstagramParser]:
+        """
+        Берёт сессию на время блока; 429 внутри блока отправляет её в карантин.
+        job_cache — кэш постов и счётчик запросов job, общий для всех его сессий.
+        """
+        pooled = self._pick()
+        hits_before = pooled.parser.rate_limit_hits
+        with pooled.lock:
+            pooled.parser.job_cache = job_cache
+            try:
+                yield pooled.parser
+            except JobCancelled:
+                self._release(pooled, hits_before, None)  # отмена job — не вина сессии
+                raise
+            except BaseException as e:
+                self._release(pooled, hits_before, e)
+                raise
+            finally:
+                pooled.parser.job_cache = None
+        self._release(pooled, hits_before, None)
+
+    def refresh(self, sessions: Optional[Dict[str, str]] = None) -> None:
+        """
+        Обновляет сессии, которые сейчас не заняты job, и добавляет новые аккаунты.
+        Запросов к Instagram не делает.
+        """
+        with self._lock:
+            pooled = list(self._sessions)
+        known = {s.username for s in pooled}
+        for session in pooled:
+            if session.username == "anonymous" or not session.lock.acquire(blocking=False):
+                continue
+            try:
+                session.parser.refresh_session()
+            except Exception as e:
+                print(f"⚠️ Failed to refresh Instagram session {session.username}: {e}")
+            finally:
+                session.lock.release()
+
+        for username, session_file in (sessions or {}).items():
+            if username not in known and self._add(username, session_file):
+                print(f"✅ Instagram session {username} added to pool")
+
+    def start_refresh(self, interval: float, discover: Callable[[], Dict[str, str]]) -> None:
+        """Фоновый поток: refresh(discover()) раз в interval секунд"""
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.refresh(discover())
+                except Exception as e:
+                    print(f"⚠️ Instagram session refresh failed: {e}")
+
+        self._refresher = threading.Thread(target=loop, name="ig-session-refresh", daemon=True)
+        self._refresher.start()
+
+    def close(self) -> None:
+        """Останавливает обновление, сохраняет cookies и закрывает HTTP-сессии"""
+        self._stop.set()
+        if self._refresher:
+            self._refresher.join(timeout=5)
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            try:
+                if session.username != "anonymous":
+                    session.parser.refresh_session()
+                session.parser.close()
+            except Exception as e:
+                print(f"⚠️ Failed to close Instagram session {session.username}: {e}")
+
+    def status(self) -> List[Dict]:
+        now = time.time()
+        with self._lock:
+            return [{
+                "username": s.username,
+                "logged_in": s.parser.logged_in,
+                "health": round(s.health, 3),
+                "in_use": s.in_use,
+                "quarantined_for_seconds": max(0.0, s.quarantined_until - now),
+                "requests_ok": s.requests_ok,
+                "requests_failed": s.requests_failed,
+                "rate_limit": s.parser.rate_limiter.status(),
+            } for s in self._sessions]
+
+
+_pool: Optional[InstagramSessionPool] = None
+_pool_lock = threading.Lock()
+
+
+def _limiter_for(username: str) -> RateLimitManager:
+    return RateLimitManager(
+        name=username,
+        db_path=settings.instagram_rate_limit_db,
+        min_interval=settings.instagram_min_delay,
+        start_interval=settings.instagram_start_delay,
+        max_interval=settings.instagram_max_delay,
+        max_requests_per_hour=settings.instagram_max_requests_per_hour
+    )
+
+
+def _configured_sessions() -> Dict[str, str]:
+    sessions = discover_session_files(settings.instagram_sessions_dir)
+    if settings.instagram_username and settings.instagram_username not in sessions:
+        sessions[settings.instagram_username] = settings.instagram_session_file
+    return sessions
+
+
+def get_session_pool() -> InstagramSessionPool:
+    """Пул сессий процесса: все файлы из INSTAGRAM_SESSIONS_DIR + сессия из INSTAGRAM_USERNAME"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = InstagramSessionPool(_configured_sessions(), _limiter_for)
+            if settings.instagram_session_refresh_interval > 0:
+                _pool.start_refresh(settings.instagram_session_refresh_interval, _configured_sessions)
+        return _pool
+
+
+def close_session_pool() -> None:
+    """Для shutdown приложения: пул закрывается, только если он был создан"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
@@ -0,0 +1,139 @@
+# app/routers/watchlist.py
+"""
+Watchlist API и планировщик повторных обходов (вызывается воркером, app/worker.py).
+
+Обходы идут через ту же очередь и те же _run_youtube_ingest/_run_instagram_ingest,
+что и ручной запуск, всегда инкрементально (только новые комментарии).
+"""
+
+from typing import Dict, Iterable, List
+
+from fastapi import APIRouter, HTTPException
+
+from .parser import canonical_target, _detect_platform_from_url
+from .service.instagram_session_pool import get_session_pool
+from ..config import settings
+from ..database import create_job, delete_jobs, get_jobs
+from ..models.schemas import WatchRequest
+from ..service.job_queue import get_job_queue
+from ..service.watchlist import budget_stretch, get_watchlist
+from ..service.youtube_quota import get_quota_ledger
+
+router = APIRouter()
+
+# приоритет обходов watchlist в очереди: после ручных запусков, вместе с bulk
+WATCH_PRIORITY = -1
+
+
+def _youtube_budget() -> float:
+    ledger = get_quota_ledger()
+    if not ledger.api_keys:
+        return 0
+    daily = ledger.daily_limit * len(ledger.api_keys)
+    # остаток квоты за вычетом резерва на ручные запуски
+    reserve = daily * (1 - settings.watchlist_youtube_share)
+    return daily * settings.watchlist_youtube_share if ledger.total_remaining() > reserve else 0
+
+
+def _instagram_budget() -> float:
+    return (settings.instagram_max_requests_per_hour * 24 * len(get_session_pool())
+            * settings.watchlist_instagram_share)
+
+
+_BUDGETS = {"youtube": _youtube_budget, "instagram": _instagram_budget}
+
+
+def _platform_budgets(platforms: Iterable[str]) -> Dict[str, float]:
+    """
+    Суточный бюджет watchlist по платформам: доля квоты YouTube (units) и лимита
+    запросов Instagram по всем аккаунтам пула. 0 — платформу сейчас не обходим.
+    Считается только для платформ из watchlist: без целей Instagram воркер
+    не поднимает пул сессий.
+    """
+    return {p: _BUDGETS[p]() for p in platforms if p in _BUDGETS}
+
+
+def schedule_due() -> List[str]:
+    """
+    Ставит в очередь обходы целей, которым пора (вызывается воркером периодически).
+    Returns: job_id поставленных обходов
+    """
+    watchlist = get_watchlist()
+    queue = get_job_queue()
+    items = watchlist.items()
+    if not items:
+        return []
+
+    budgets = _platform_budgets({i["platform"] for i in items if i["enabled"]})
+    stretch = {p: budget_stretch(items, p, budget) for p, budget in budgets.items()}
+    for platform, factor in stretch.items():
+        if factor > 1:
+            print(f"🐢 Watchlist {platform}: intervals x{factor:.1f} to stay within budget")
+
+    job_ids = []
+    for item in watchlist.claim_due(stretch, platforms=[p for p, b in budgets.items() if b > 0]):
+        payload = {
+            "url": item["url"],
+            "max_comments": item["max_comments"],
+            "max_videos": item["max_videos"],
+            "incremental": True,
+        }
+        job_id, status, coalesced = queue.enqueue_unique(
+            item["target"], item["platform"], payload,
+            create_job=lambda: create_job(source_type=item["platform"], input_url=item["url"], status="queued"),
+            priority=WATCH_PRIORITY,
+            discard_jobs=delete_jobs
+        )
+        watchlist.started(item["target"], job_id)
+        job_ids.append(job_id)
+        print(f"👀 Watchlist: {item['target']} -> job {job_id}"
+              f"{' (already ' + status + ')' if coalesced else ''}, interval {item['interval'] / 60:.0f} min")
+    return job_ids
+
+
+def record_watch_result(job_id: str, succeeded: bool, incremental: bool) -> None:
+    """
+    Итог обхода -> скорость комментариев и следующий интервал цели (вызывается воркером).
+    incremental — payload выполненной задачи: обход мог склеиться с ручным запуском
+    без incremental, и тогда stats_total — все комментарии, а не новые; скорость не меняем.
+    """
+    new_comments = None
+    if succeeded and incremental:
+        # инкрементальный обход: полученные комментарии — новые с прошлого раза
+        job = get_jobs([job_id]).get(job_id) or {}
+        new_comments = job.get("stats_total") or 0
+    item = get_watchlist().record_crawl(job_id, new_comments)
+    if item is not None and item["velocity"] is not None:
+        print(f"👀 Watchlist: {item['target']} ~{item['velocity']:.1f} comments/h, "
+              f"next crawl in {item['interval'] / 60:.0f} min")
+
+
+def _target_or_400(url: str) -> tuple:
+    platform = _detect_platform_from_url(url)
+    if platform not in ('youtube', 'instagram'):
+        raise HTTPException(400, f"Platform '{platform}' is not supported yet")
+    target = canonical_target(platform, url)
+    if target is None:
+        raise HTTPException(400, "Cannot determine content from URL")
+    return platform, target
+
+
+@router.get("", summary="Watched targets with their crawl intervals")
+def list_watchlist():
+    return {"items": get_watchlist().items()}
+
+
+@router.post("", summary="Watch a channel, video, post or profile")
+def add_to_watchlist(req: WatchRequest):
+    platform, target = _target_or_400(req.url)
+    if platform == 'youtube' and not settings.youtube_keys:
+        raise HTTPException(500, "YOUTUBE_API_KEY is not set")
+    return get_watchlist().add(target, platform, req.url, req.max_comments, req.max_videos)
+
+
+@router.delete("", summary="Stop watching")
+def remove_from_watchlist(url: str):
+    _, target = _target_or_400(url)
+    if not get_watchlist().remove(target):
+        raise HTTPException(404, f"{target} is not watched")
+    return {"target": target, "removed": True}
@@ -0,0 +1,141 @@
+# app/service/bulk_writer.py
+"""
+Пакетная запись строк в Supabase чанками.
+
+Один upsert на десятки тысяч строк упирается в лимит тела запроса и таймауты,
+а с return=representation ещё и гонит весь набор обратно. Здесь строки режутся
+на чанки, ограниченные и числом строк, и размером JSON; чанки отправляются
+параллельно (общий на процесс пул — одновременных запросов не больше concurrency,
+сколько бы job ни писали разом), каждый — с return=minimal и точным count.
+Упавший чанк повторяется сам по себе, остальные не переотправляются.
+Время каждого чанка попадает в результат write().
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from ..config import settings
+from .cancellation import interruptible_sleep, propagate_context
+
+
+class BulkWriteError(Exception):
+    """Часть чанков не записалась после всех попыток"""
+
+    def __init__(self, written: int, failed_rows: int, error: Exception):
+        super().__init__(f"{failed_rows} rows not written ({written} written): {error}")
+        self.written = written
+        self.failed_rows = failed_rows
+        self.error = error
+
+
+class BulkWriter:
+    def __init__(self, max_rows: int = 500, max_bytes: int = 1_000_000, concurrency: int = 4,
+                 max_attempts: int = 3, backoff: float = 1.0):
+        """
+        Args:
+            max_rows: строк в одном запросе
+            max_bytes: примерный размер JSON одного запроса
+            concurrency: запросов одновременно на процесс
+            max_attempts: попыток на чанк
+            backoff: пауза перед повтором, сек (удваивается)
+        """
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def chunks(self, rows: List[Dict]) -> List[List[Dict]]:
+        """Режет строки на чанки не больше max_rows строк и max_bytes JSON"""
+        chunks: List[List[Dict]] = []
+        chunk: List[Dict] = []
+        size = 0
+        for row in rows:
+            row_size = len(json.dumps(row, default=str, ensure_ascii=False).encode()) + 1
+            if chunk and (len(chunk) >= self.max_rows or size + row_size > self.max_bytes):
+                chunks.append(chunk)
+                chunk, size = [], 0
+            chunk.append(row)
+            size += row_size
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="bulk-write")
+            return self._pool
+
+    def _send(self, send: Callable[[List[Dict]], int], chunk: List[Dict]) -> Dict:
+        started = time.monotonic()
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                written = send(chunk)
+                return {"rows": len(chunk), "written": written, "attempts": attempt,
+                        "seconds": round(time.monotonic() - started, 3), "error": None}
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    return {"rows": len(chunk), "written": 0, "attempts": attempt,
+                            "seconds": round(time.monotonic() - started, 3), "error": e}
+                delay = self.backoff * 2 ** (attempt - 1)
+                print(f"⚠️ Chunk of {len(chunk)} rows failed (attempt {attempt}/{self.max_attempts}): {e}; "
+                      f"retry in {delay:.1f}s")
+                interruptible_sleep(delay)
+
+    def write(self, send: Callable[[List[Dict]], int], rows: List[Dict]) -> Dict:
+        """
+        Записывает rows чанками через send(chunk) -> записано строк.
+
+        Returns:
+            {"written", "seconds", "chunks": [{"rows", "written", "attempts", "seconds"}]}
+        Raises:
+            BulkWriteError: чанк не записался за max_attempts (остальные записаны)
+        """
+        started = time.monotonic()
+        chunks = self.chunks(rows)
+        if len(chunks) == 1:
+            results = [self._send(send, chunks[0])]
+        else:
+            pool = self._executor()
+            # propagate_context: отмена job прерывает паузы перед повтором
+            futures = [pool.submit(propagate_context(self._send), send, c) for c in chunks]
+            results = [f.result() for f in futures]
+
+        written = sum(r["written"] for r in results)
+        failed = [r for r in results if r["error"] is not None]
+        if failed:
+            raise BulkWriteError(written, sum(r["rows"] for r in failed), failed[0]["error"])
+        return {
+            "written": written,
+            "seconds": round(time.monotonic() - started, 3),
+            "chunks": [{k: r[k] for k in ("rows", "written", "attempts", "seconds")} for r in results],
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+                self._pool = None
+
+
+_writer: Optional[BulkWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_bulk_writer() -> BulkWriter:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = BulkWriter(
+                max_rows=settings.ingest_upsert_rows,
+                max_bytes=settings.ingest_upsert_max_bytes,
+                concurrency=settings.ingest_upsert_concurrency,
+                max_attempts=settings.ingest_upsert_attempts
+            )
+        return _writer
@@ -0,0 +1,105 @@
+# app/service/cancellation.py
+"""
+Кооперативная отмена и дедлайны job.
+
+Воркер кладёт CancelToken выполняемого job в contextvar; ингест проверяет его между
+страницами и перед каждым запросом к API (check_cancelled), а паузы делает через
+interruptible_sleep — отмена будит спящий поток сразу, а не после паузы.
+
+JobCancelled наследует BaseException (как asyncio.CancelledError): широкие
+`except Exception` в парсерах (повторы, пропуск битых комментариев) её не глотают.
+
+contextvar не переходит в новые потоки сам — функции для Thread/ThreadPoolExecutor
+оборачиваются propagate_context().
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Iterator, Optional
+
+
+class JobCancelled(BaseException):
+    """Job отменён пользователем"""
+    status = "cancelled"
+
+
+class JobTimedOut(JobCancelled):
+    """Job не уложился в дедлайн"""
+    status = "timed_out"
+
+
+class CancelToken:
+    def __init__(self, deadline: Optional[float] = None):
+        """deadline — time.time(), после которого job прерывается (None — без дедлайна)"""
+        self.deadline = deadline
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+
+    def cancel(self, reason: str = "Cancelled by user") -> None:
+        self.reason = reason
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def remaining(self) -> Optional[float]:
+        return None if self.deadline is None else self.deadline - time.time()
+
+    def check(self) -> None:
+        if self._event.is_set():
+            raise JobCancelled(self.reason)
+        if self.deadline is not None and time.time() >= self.deadline:
+            raise JobTimedOut("Job deadline exceeded")
+
+    def sleep(self, seconds: float) -> None:
+        """Пауза, которую прерывают отмена и дедлайн"""
+        self.check()
+        remaining = self.remaining()
+        timeout = seconds if remaining is None else min(seconds, max(0.0, remaining))
+        self._event.wait(timeout)
+        self.check()
+
+
+_current: contextvars.ContextVar[Optional[CancelToken]] = contextvars.ContextVar("job_cancel_token", default=None)
+
+
+@contextmanager
+def job_scope(token: CancelToken) -> Iterator[CancelToken]:
+    """Код внутри блока (и потоки, запущенные через propagate_context) видит token"""
+    reset = _current.set(token)
+    try:
+        yield token
+    finally:
+        _current.reset(reset)
+
+
+def check_cancelled() -> None:
+    """JobCancelled / JobTimedOut, если текущий job отменён или просрочен; вне job — ничего"""
+    token = _current.get()
+    if token is not None:
+        token.check()
+
+
+def interruptible_sleep(seconds: float) -> None:
+    """time.sleep, который прерывается отменой текущего job"""
+    token = _current.get()
+    if token is None:
+        time.sleep(seconds)
+    else:
+        token.sleep(seconds)
+
+
+def propagate_context(fn: Callable) -> Callable:
+    """Обёртка для запуска fn в другом потоке с contextvars вызывающего (в том числе токеном job)"""
+    context = contextvars.copy_context()
+
+    @wraps(fn)
+    def run(*args, **kwargs):
+        # Context нельзя войти из двух потоков сразу — каждому вызову своя копия
+        return context.copy().run(fn, *args, **kwargs)
+
+    return run
@@ -0,0 +1,365 @@
+# app/service/comment_outbox.py
+"""
+Локальный outbox комментариев: ингест пишет на диск, в Supabase дописывает flusher.
+
+    ингест: append() -> SQLite (WAL) на локальном диске, скорость диска
+    flusher: поток в том же процессе забирает строки пачками, апсертит их через
+             bulk_writer в выбранное хранилище (get_storage) и удаляет записанные;
+             упавшие повторяются с backoff
+
+Outbox нужен удалённому хранилищу (Supabase). Локальное (STORAGE_BACKEND=sqlite) уже
+на диске — ингест пишет в него сразу (ingest_pipeline), иначе каждая строка писалась бы дважды.
+
+Если Supabase тормозит или лежит, ингест не падает и не теряет комментарии, за
+которые уже заплачено квотой API: они ждут в outbox и дописываются, когда Supabase
+вернётся, в том числе другим процессом после перезапуска.
+
+Идемпотентность: в outbox одна строка на (source_id, ext_comment_id) — повторный
+append заменяет её и увеличивает version, а flusher удаляет только ту версию,
+которую записал. Upsert в Supabase по тому же ключу, поэтому повтор пачки безопасен.
+Лаг и глубину показывает metrics() (GET /parser/outbox).
+
+Job завершается, когда его комментарии легли в outbox, а не в Supabase: сколько строк
+job ещё ждёт записи, показывают pending() (GET /analytics/job-status: outbox_pending,
+persisting) и поле pending событий write.
+
+Dead letter: строки, которые хранилище не принимает (ограничение, формат, 4xx — не
+is_transient), не повторяются вечно. Отвергнутая пачка делится пополам, пока не найдутся
+сами такие строки; они, как и строки после max_attempts повторов, переносятся в
+outbox_dead и видны в failed(), metrics() и поле failed событий write.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from ..config import settings
+from ..database import upsert_comment_rows
+from ..storage.base import get_storage
+from .bulk_writer import BulkWriteError, get_bulk_writer
+from .job_events import publish_event
+
+
+class CommentOutbox:
+    def __init__(self, db_path: str = "comment_outbox.db", batch_size: int = 2000, flush_interval: float = 1.0,
+                 max_backoff: float = 300, lease_seconds: float = 120, max_attempts: int = 100):
+        """
+        Args:
+            db_path: SQLite файл outbox
+            batch_size: строк за один проход flusher'а
+            flush_interval: пауза flusher'а, когда писать нечего
+            max_backoff: предел паузы перед повтором строки, сек
+            lease_seconds: строки, взятые flusher'ом, другие процессы не трогают столько сек
+            max_attempts: после стольких неудачных проходов строка уходит в dead letter (0 — без предела)
+        """
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, source_id TEXT NOT NULL, ext_comment_id TEXT NOT NULL,"
+                " job_id TEXT, row TEXT NOT NULL, version INTEGER NOT NULL DEFAULT 1,"
+                " enqueued_at REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+                " next_attempt_at REAL NOT NULL DEFAULT 0, lease_until REAL NOT NULL DEFAULT 0, last_error TEXT,"
+                " UNIQUE (source_id, ext_comment_id))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS outbox_ready ON outbox (next_attempt_at, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS outbox_job ON outbox (job_id)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox_stats (key TEXT PRIMARY KEY, value)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox_dead ("
+                " source_id TEXT NOT NULL, ext_comment_id TEXT NOT NULL, job_id TEXT, row TEXT NOT NULL,"
+                " attempts INTEGER NOT NULL, error TEXT, failed_at REAL NOT NULL,"
+                " PRIMARY KEY (source_id, ext_comment_id))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS outbox_dead_job ON outbox_dead (job_id)")
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        """Чтение без блокировки записи (WAL)"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def append(self, job_id: str, rows: List[Dict]) -> int:
+        """Кладёт строки comments в outbox (одна транзакция) и будит flusher"""
+        if not rows:
+            return 0
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO outbox (source_id, ext_comment_id, job_id, row, enqueued_at) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(source_id, ext_comment_id) DO UPDATE SET row = excluded.row,"
+                " job_id = excluded.job_id, version = version + 1, attempts = 0, next_attempt_at = 0,"
+                " lease_until = 0, last_error = NULL",
+                [(r["source_id"], r["ext_comment_id"], job_id, json.dumps(r, default=str), now) for r in rows]
+            )
+        self.start()
+        self._wake.set()
+        return len(rows)
+
+    def _claim(self) -> List[sqlite3.Row]:
+        now = time.time()
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, version, job_id, source_id, ext_comment_id, row, attempts FROM outbox"
+                " WHERE next_attempt_at <= ? AND lease_until <= ? ORDER BY id LIMIT ?",
+                (now, now, self.batch_size)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE outbox SET lease_until = ? WHERE id = ?",
+                [(now + self.lease_seconds, r["id"]) for r in rows]
+            )
+        return rows
+
+    def flush_once(self) -> Dict:
+        """
+        Один проход: пачка готовых строк -> Supabase.
+        Returns: {"flushed", "failed"}
+        """
+        claimed = self._claim()
+        if not claimed:
+            return {"flushed": 0, "failed": 0}
+
+        by_key = {(r["source_id"], r["ext_comment_id"]): r for r in claimed}
+        written_keys = []
+        keys_lock = threading.Lock()
+
+        def send(chunk: List[Dict]) -> int:
+            n = upsert_comment_rows(chunk)
+            with keys_lock:
+                written_keys.extend((c["source_id"], c["ext_comment_id"]) for c in chunk)
+            return n
+
+        error: Optional[Exception] = None
+        result = None
+        try:
+            result = get_bulk_writer().write(send, [json.loads(r["row"]) for r in claimed])
+        except BulkWriteError as e:
+            error = e.error
+        except Exception as e:
+            error = e
+
+        written = [by_key[k] for k in written_keys]
+        written_ids = {r["id"] for r in written}
+        failed = [r for r in claimed if r["id"] not in written_ids]
+        dead: List[Tuple[sqlite3.Row, str]] = []
+        retry_error = error
+        if failed and error is not None and not get_storage().is_transient(error):
+            # хранилище отвергло пачку не из-за сбоя: ищем сами строки, остальные дописываем
+            isolated, dead, retry_error = self._isolate(failed)
+            written += isolated
+            settled = {r["id"] for r in isolated} | {r["id"] for r, _ in dead}
+            failed = [r for r in failed if r["id"] not in settled]
+        if self.max_attempts:
+            exhausted = {r["id"] for r in failed if r["attempts"] + 1 >= self.max_attempts}
+            dead += [(r, str(retry_error)) for r in failed if r["id"] in exhausted]
+            failed = [r for r in failed if r["id"] not in exhausted]
+
+        now = time.time()
+        per_job: Dict[str, Dict[str, int]] = {}
+        for rows, key in ((written, "rows"), ([r for r, _ in dead], "failed")):
+            for r in rows:
+                if r["job_id"]:
+                    counts = per_job.setdefault(r["job_id"], {"rows": 0, "failed": 0})
+                    counts[key] += 1
+        with self._transaction() as conn:
+            # строку, заменённую append'ом во время записи (version выросла), оставляем
+            conn.executemany("DELETE FROM outbox WHERE id = ? AND version = ?",
+                             [(r["id"], r["version"]) for r in written])
+            # записанная строка снимает прежнюю ошибку того же комментария
+            conn.executemany("DELETE FROM outbox_dead WHERE source_id = ? AND ext_comment_id = ?",
+                             [(r["source_id"], r["ext_comment_id"]) for r in written])
+            for r, reason in dead:
+                if conn.execute("DELETE FROM outbox WHERE id = ? AND version = ?",
+                                (r["id"], r["version"])).rowcount:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO outbox_dead (source_id, ext_comment_id, job_id, row, attempts,"
+                        " error, failed_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (r["source_id"], r["ext_comment_id"], r["job_id"], r["row"], r["attempts"] + 1, reason, now)
+                    )
+            conn.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, lease_until = 0, last_error = ?"
+                " WHERE id = ? AND version = ?",
+                [(now + min(self.max_backoff, 2 ** r["attempts"]), str(retry_error), r["id"], r["version"])
+                 for r in failed]
+            )
+            conn.execute(
+                "INSERT INTO outbox_stats (key, value) VALUES ('flushed_total', ?)"
+                " ON CONFLICT(key) DO UPDATE SET value = value + excluded.value", (len(written),)
+            )
+            if written:
+                conn.execute("INSERT OR REPLACE INTO outbox_stats (key, value) VALUES ('last_flush_at', ?)", (now,))
+            if error is not None:
+                conn.execute("INSERT OR REPLACE INTO outbox_stats (key, value) VALUES ('last_error', ?)",
+                             (str(error),))
+                conn.execute("INSERT OR REPLACE INTO outbox_stats (key, value) VALUES ('last_error_at', ?)", (now,))
+            # остаток каждого job после этой пачки — для события write
+            remaining = dict(conn.execute(
+                f"SELECT job_id, COUNT(*) FROM outbox WHERE job_id IN ({','.join('?' * len(per_job))})"
+                " GROUP BY job_id", list(per_job)
+            ).fetchall()) if per_job else {}
+
+        for job_id, counts in per_job.items():
+            publish_event(job_id, "write", rows=counts["rows"], failed=counts["failed"],
+                          pending=remaining.get(job_id, 0),
+                          seconds=result["seconds"] if result else None,
+                          chunks=result["chunks"] if result else None)
+        if dead:
+            print(f"❌ Outbox: {len(dead)} rows rejected by storage, moved to dead letter: {dead[0][1]}")
+        if failed:
+            print(f"⚠️ Outbox: {len(failed)} rows not written to storage, will retry: {retry_error}")
+        return {"flushed": len(written), "failed": len(failed), "dead": len(dead)}
+
+    def _isolate(self, rows: List[sqlite3.Row]) -> Tuple[List[sqlite3.Row], List[Tuple[sqlite3.Row, str]],
+                                                          Optional[Exception]]:
+        """
+        Пачку отвергли не из-за сбоя: делим пополам, пока не останутся отдельные строки,
+        которые хранилище не принимает. Сбой (is_transient) прерывает поиск — непроверенные
+        строки идут на обычный повтор.
+        Returns: (записанные, [(отвергнутая, ошибка)], ошибка сбоя или None)
+        """
+        written: List[sqlite3.Row] = []
+        dead: List[Tuple[sqlite3.Row, str]] = []
+        parts = [rows]
+        while parts:
+            part = parts.pop()
+            try:
+                upsert_comment_rows([json.loads(r["row"]) for r in part])
+                written.extend(part)
+            except Exception as e:
+                if get_storage().is_transient(e):
+                    return written, dead, e
+                if len(part) == 1:
+                    dead.append((part[0], str(e)))
+                else:
+                    mid = len(part) // 2
+                    parts += [part[mid:], part[:mid]]
+        return written, dead, None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                result = self.flush_once()
+            except Exception as e:  # сбой самой SQLite — не роняем поток
+                print(f"⚠️ Outbox flush failed: {e}")
+                result = {"flushed": 0, "failed": 1}
+            if (result["flushed"] or result.get("dead")) and not result["failed"]:
+                continue  # есть что писать дальше — без паузы
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+
+    def start(self) -> None:
+        """Запускает flusher в этом процессе (если ещё не запущен)"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="comment-outbox", daemon=True)
+                self._thread.start()
+
+    def close(self, drain_timeout: float = 30) -> int:
+        """Останавливает flusher, перед этим до drain_timeout сек дописывает готовое. Returns: осталось строк"""
+        deadline = time.time() + drain_timeout
+        with self._lock:
+            thread = self._thread
+        while thread is not None and time.time() < deadline:
+            metrics = self.metrics()
+            if metrics["ready"] == 0:
+                break
+            time.sleep(0.2)
+        self._stop.set()
+        self._wake.set()
+        if thread is not None:
+            thread.join(timeout=5)
+        return self.metrics()["depth"]
+
+    def pending(self, job_id: str) -> int:
+        """Строк job, ещё не записанных в хранилище"""
+        with self._reader() as conn:
+            (n,) = conn.execute("SELECT COUNT(*) FROM outbox WHERE job_id = ?", (job_id,)).fetchone()
+        return n
+
+    def failed(self, job_id: str) -> int:
+        """Строк job в dead letter: хранилище их не приняло"""
+        with self._reader() as conn:
+            (n,) = conn.execute("SELECT COUNT(*) FROM outbox_dead WHERE job_id = ?", (job_id,)).fetchone()
+        return n
+
+    def metrics(self) -> Dict:
+        now = time.time()
+        with self._reader() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) AS depth, COUNT(DISTINCT source_id) AS sources, COUNT(DISTINCT job_id) AS jobs,"
+                " SUM(next_attempt_at <= ?) AS ready, SUM(attempts > 0) AS retrying,"
+                " MIN(enqueued_at) AS oldest FROM outbox", (now,)
+            ).fetchone()
+            stats = {r["key"]: r["value"] for r in conn.execute("SELECT key, value FROM outbox_stats")}
+            dead = conn.execute("SELECT COUNT(*) AS rows, MAX(failed_at) AS last FROM outbox_dead").fetchone()
+        last_flush = stats.get("last_flush_at")
+        return {
+            "depth": row["depth"],
+            "sources": row["sources"],
+            "jobs": row["jobs"],
+            "ready": row["ready"] or 0,
+            "retrying": row["retrying"] or 0,
+            # лаг: сколько ждёт самая старая незаписанная строка
+            "flush_lag_seconds": round(now - row["oldest"], 1) if row["oldest"] else 0,
+            "last_flush_seconds_ago": round(now - last_flush, 1) if last_flush else None,
+            "flushed_total": stats.get("flushed_total", 0),
+            "last_error": stats.get("last_error"),
+            "last_error_seconds_ago": round(now - stats["last_error_at"], 1) if stats.get("last_error_at") else None,
+            # отвергнуты хранилищем или исчерпали max_attempts — не повторяются
+            "dead": dead["rows"],
+            "last_dead_seconds_ago": round(now - dead["last"], 1) if dead["last"] else None,
+        }
+
+
+_outbox: Optional[CommentOutbox] = None
+_outbox_lock = threading.Lock()
+
+
+def get_comment_outbox() -> CommentOutbox:
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = CommentOutbox(
+                db_path=settings.outbox_db,
+                batch_size=settings.outbox_batch_size,
+                flush_interval=settings.outbox_flush_interval,
+                max_backoff=settings.outbox_max_backoff,
+                max_attempts=settings.outbox_max_attempts
+            )
+        return _outbox
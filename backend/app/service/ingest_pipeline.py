@@ -0,0 +1,164 @@
+# app/service/ingest_pipeline.py
+"""
+Потоковый ингест: парсер отдаёт страницы комментариев, запись в БД идёт параллельно.
+
+fetch (поток-продюсер) -> ограниченная очередь страниц -> writer (текущий поток):
+writer копит строки в чанки фиксированного размера, кладёт их в локальный outbox
+(comment_outbox: в Supabase их дописывает flusher) и после каждого чанка обновляет
+прогресс job (stats_processed). Локальное хранилище (STORAGE_BACKEND=sqlite) само
+на диске — туда чанк пишется сразу, мимо outbox, чтобы строки не писались дважды. Память ограничена размером очереди
+и одного чанка, а не max_comments. Каждая полученная страница — событие "page" для SSE.
+"""
+
+import queue
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from ..config import settings
+from ..database import StorageUnavailable, comment_rows, mark_job, upsert_comments
+from ..storage.base import get_storage
+from .bulk_writer import BulkWriteError
+from .comment_outbox import get_comment_outbox
+from .cancellation import check_cancelled, propagate_context
+from .job_events import publish_event
+
+_DONE = object()
+
+
+class JobProgress:
+    """
+    Прогресс job, общий для нескольких source (в том числе из разных потоков):
+    после каждого записанного чанка обновляет jobs.stats_processed.
+    """
+
+    def __init__(self, job_id: str, stats_total: Optional[int] = None):
+        self.job_id = job_id
+        self.stats_total = stats_total
+        self.fetched = 0
+        self.processed = 0
+        self.per_source: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, source_id: str, fetched: int, inserted: int) -> None:
+        with self._lock:
+            self.fetched += fetched
+            self.processed += inserted
+            self.per_source[source_id] = self.per_source.get(source_id, 0) + inserted
+            processed, total = self.processed, self.stats_total
+        try:
+            mark_job(self.job_id, status="running", stats_total=total, stats_processed=processed)
+        except Exception as e:  # прогресс — не повод прерывать ингест; комментарии уже в outbox
+            print(f"⚠️ Cannot update progress of job {self.job_id}: {e}")
+
+
+def _write_chunk(job_id: str, source_id: str, chunk: List[Dict]) -> int:
+    """Чанк комментариев: в локальное хранилище сразу, в удалённое — через outbox. Returns: принято строк"""
+    if not get_storage().local:
+        return get_comment_outbox().append(job_id, comment_rows(source_id, chunk))
+    try:
+        result = upsert_comments(source_id, chunk)
+    except BulkWriteError as e:
+        raise StorageUnavailable(f"upsert_comments: {e}") from e
+    publish_event(job_id, "write", rows=result["written"], pending=0, seconds=result["seconds"],
+                  chunks=result["chunks"])
+    return len(chunk)
+
+
+class _FetchError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def _produce(pages: Iterable[List[Dict]], q: "queue.Queue", stop: threading.Event):
+    """Гонит страницы из генератора в очередь, пока writer не попросил остановиться"""
+    try:
+        for page in pages:
+            check_cancelled()  # отмена/дедлайн job — как ошибка парсера: writer допишет полученное
+            while not stop.is_set():
+                try:
+                    q.put(page, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+            if stop.is_set():
+                break
+        item = _DONE
+    except BaseException as e:  # ошибку парсера пробрасываем в writer
+        item = _FetchError(e)
+    finally:
+        close = getattr(pages, "close", None)
+        if stop.is_set() and close:
+            close()
+
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+
+
+def stream_comments(job_id: str, source_id: str, pages: Iterable[List[Dict]],
+                    progress: Optional[JobProgress] = None,
+                    stats_total: Optional[int] = None,
+                    chunk_size: Optional[int] = None,
+                    queue_pages: Optional[int] = None,
+                    on_flush: Optional[Callable[[List[Dict]], None]] = None) -> Tuple[int, int]:
+    """
+    Стримит страницы комментариев в comments одного source.
+
+    Args:
+        job_id: job, в котором обновляется прогресс
+        source_id: source, к которому пишутся комментарии
+        pages: генератор страниц (list[dict]) от парсера
+        progress: общий прогресс job (для нескольких source в одном job)
+        stats_total: ожидаемое общее количество (если progress не передан)
+        on_flush: вызывается с каждым записанным чанком (например, сдвинуть чекпоинт парсера)
+
+    Returns:
+        (получено, записано)
+    """
+    progress = progress or JobProgress(job_id, stats_total)
+    chunk_size = chunk_size or settings.ingest_chunk_size
+    q: "queue.Queue" = queue.Queue(maxsize=queue_pages or settings.ingest_queue_pages)
+    stop = threading.Event()
+
+    producer = threading.Thread(target=propagate_context(_produce), args=(pages, q, stop),
+                                name=f"ingest-fetch-{job_id}", daemon=True)
+    producer.start()
+
+    fetched = 0
+    inserted = 0
+    chunk: List[Dict] = []
+
+    def flush():
+        nonlocal inserted, chunk
+        if not chunk:
+            return
+        written = _write_chunk(job_id, source_id, chunk)
+        inserted += written
+        progress.add(source_id, len(chunk), written)
+        if on_flush:
+            on_flush(chunk)
+        chunk = []
+
+    try:
+        while True:
+            item = q.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _FetchError):
+                flush()  # уже полученное не теряем
+                raise item.error
+            for c in item:
+                chunk.append(c)
+                fetched += 1
+                if len(chunk) >= chunk_size:
+                    flush()
+            publish_event(job_id, "page", source_id=source_id, comments=len(item), fetched=fetched)
+        flush()
+    finally:
+        stop.set()
+        producer.join(timeout=5)
+
+    return fetched, inserted
@@ -0,0 +1,235 @@
+# app/service/job_events.py
+"""
+События прогресса job для push-канала (SSE).
+
+Ингест выполняется в воркерах (app/worker.py), а клиенты подключены к API — поэтому
+события пишутся в общий SQLite журнал (WAL), а не только в память процесса:
+
+    воркер: publish_event() -> job_events (seq по порядку)
+    API:    один поток-читатель на процесс забирает новые события одним запросом
+            и раздаёт их подписчикам (asyncio очереди SSE соединений)
+
+Сколько бы дашбордов ни было открыто, нагрузка — один локальный запрос за интервал
+опроса и ни одного запроса к Supabase. Подключившийся клиент сначала получает уже
+накопленные события job (или после Last-Event-ID), затем живые.
+"""
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set
+
+from ..config import settings
+
+# после этих статусов событий по job больше не будет
+TERMINAL_STATUSES = {"done", "partial", "error", "cancelled", "timed_out"}
+
+
+class JobEventLog:
+    def __init__(self, db_path: str = "job_events.db", ttl_seconds: float = 86400):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self._last_prune = 0.0
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_events ("
+                " seq INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL,"
+                " type TEXT NOT NULL, data TEXT NOT NULL, ts REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS job_events_job ON job_events (job_id, seq)")
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        """Чтение без блокировки записи (WAL)"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def publish(self, job_id: str, event_type: str, data: Dict) -> int:
+        now = time.time()
+        with self._transaction() as conn:
+            cur = conn.execute(
+                "INSERT INTO job_events (job_id, type, data, ts) VALUES (?, ?, ?, ?)",
+                (job_id, event_type, json.dumps(data), now)
+            )
+            if now - self._last_prune > 3600:
+                conn.execute("DELETE FROM job_events WHERE ts < ?", (now - self.ttl_seconds,))
+                self._last_prune = now
+            return cur.lastrowid
+
+    @staticmethod
+    def _row(row: sqlite3.Row) -> Dict:
+        return {"seq": row["seq"], "job_id": row["job_id"], "type": row["type"],
+                "data": json.loads(row["data"]), "ts": row["ts"]}
+
+    def read(self, job_id: str, after_seq: int = 0) -> List[Dict]:
+        """События одного job после after_seq"""
+        with self._reader() as conn:
+            rows = conn.execute(
+                "SELECT * FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq", (job_id, after_seq)
+            ).fetchall()
+        return [self._row(r) for r in rows]
+
+    def read_all(self, after_seq: int, limit: int = 1000) -> List[Dict]:
+        """Новые события всех job (для потока-читателя)"""
+        with self._reader() as conn:
+            rows = conn.execute(
+                "SELECT * FROM job_events WHERE seq > ? ORDER BY seq LIMIT ?", (after_seq, limit)
+            ).fetchall()
+        return [self._row(r) for r in rows]
+
+    def last_seq(self) -> int:
+        with self._reader() as conn:
+            (seq,) = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM job_events").fetchone()
+        return seq
+
+
+class _Subscriber:
+    def __init__(self, job_id: str, loop: asyncio.AbstractEventLoop):
+        self.job_id = job_id
+        self.loop = loop
+        self.queue: "asyncio.Queue[Dict]" = asyncio.Queue()
+
+
+class JobEventBus:
+    """
+    Раздача событий подписчикам в этом процессе. Поток-читатель работает, только пока
+    есть подписчики, и опрашивает журнал раз в poll_interval.
+    """
+
+    def __init__(self, log: JobEventLog, poll_interval: float = 0.5):
+        self.log = log
+        self.poll_interval = poll_interval
+        self._subscribers: Dict[str, Set[_Subscriber]] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def _tail(self, cursor: int) -> None:
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            try:
+                events = self.log.read_all(cursor)
+            except sqlite3.Error as e:
+                print(f"⚠️ Cannot read job events: {e}")
+                events = []
+            for event in events:
+                cursor = event["seq"]
+                with self._lock:
+                    subscribers = list(self._subscribers.get(event["job_id"], ()))
+                for sub in subscribers:
+                    sub.loop.call_soon_threadsafe(sub.queue.put_nowait, event)
+            if not events:
+                time.sleep(self.poll_interval)
+
+    def _subscribe(self, job_id: str) -> _Subscriber:
+        sub = _Subscriber(job_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.setdefault(job_id, set()).add(sub)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._tail, args=(self.log.last_seq(),),
+                                                name="job-events-tail", daemon=True)
+                self._thread.start()
+        return sub
+
+    def _unsubscribe(self, sub: _Subscriber) -> None:
+        with self._lock:
+            subs = self._subscribers.get(sub.job_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.job_id]
+
+    async def stream(self, job_id: str, after_seq: int = 0, keepalive: float = 15.0):
+        """
+        Асинхронный генератор событий job: накопленные после after_seq, затем живые.
+        None — за keepalive секунд событий не было (повод отправить ping).
+        Заканчивается после события со статусом из TERMINAL_STATUSES.
+        """
+        # подписка до чтения накопленного: событие между ними придёт из очереди, дубли отсекаются по seq
+        sub = self._subscribe(job_id)
+        try:
+            last = after_seq
+            backlog = await asyncio.get_running_loop().run_in_executor(None, self.log.read, job_id, after_seq)
+            for event in backlog:
+                last = event["seq"]
+                yield event
+                if _is_terminal(event):
+                    return
+            while True:
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event["seq"] <= last:
+                    continue
+                last = event["seq"]
+                yield event
+                if _is_terminal(event):
+                    return
+        finally:
+            self._unsubscribe(sub)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+
+def _is_terminal(event: Dict) -> bool:
+    return event["type"] == "status" and event["data"].get("status") in TERMINAL_STATUSES
+
+
+_log: Optional[JobEventLog] = None
+_bus: Optional[JobEventBus] = None
+_events_lock = threading.Lock()
+
+
+def get_event_log() -> JobEventLog:
+    global _log
+    with _events_lock:
+        if _log is None:
+            _log = JobEventLog(settings.job_events_db, settings.job_events_ttl)
+        return _log
+
+
+def get_event_bus() -> JobEventBus:
+    global _bus
+    log = get_event_log()
+    with _events_lock:
+        if _bus is None:
+            _bus = JobEventBus(log, settings.job_events_poll_interval)
+        return _bus
+
+
+def publish_event(job_id: str, event_type: str, **data) -> None:
+    """Публикует событие job. Ошибка журнала не должна ронять ингест — только предупреждение"""
+    try:
+        get_event_log().publish(job_id, event_type, data)
+    except sqlite3.Error as e:
+        print(f"⚠️ Cannot publish {event_type} event for job {job_id}: {e}")
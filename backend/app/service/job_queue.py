@@ -0,0 +1,432 @@
+# app/service/job_queue.py
+"""
+Durable очередь ingest-задач.
+
+API только создаёт job (Supabase jobs) и кладёт задачу в очередь; выполняют её
+воркеры (app/worker.py) — отдельные процессы, сколько угодно. Очередь — SQLite (WAL)
+как локальная замена Postgres: захват задачи — транзакция BEGIN IMMEDIATE, поэтому
+одну задачу получает ровно один воркер.
+
+- lease: захваченная задача принадлежит воркеру до lease_expires_at, воркер
+  продлевает её heartbeat'ом; упавший воркер перестаёт продлевать — после истечения
+  lease задача возвращается в очередь (не более max_attempts раз);
+- лимиты по платформам: не больше N одновременно выполняемых задач платформы
+  (общая квота YouTube, ограниченный пул Instagram аккаунтов);
+- отложенные задачи (квота/сессии кончились) возвращаются в очередь с available_at;
+- склейка дублей: задача с тем же target (платформа + id контента), которая ждёт,
+  выполняется или завершилась недавно, не создаётся заново — возвращается её job_id;
+- отмена: ждущая задача отменяется сразу, у выполняемой выставляется cancel_requested —
+  воркер видит флаг и прерывает ингест (app/service/cancellation.py);
+- bulk: родительский job объединяет дочерние задачи (bulk_children); дочерние идут
+  с пониженным приоритетом, чтобы одиночные запросы не ждали всю пачку.
+
+Статус для пользователя по-прежнему в Supabase jobs (mark_job); здесь — только
+состояние выполнения.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from ..config import settings
+
+
+class RetryLater(Exception):
+    """Задачу нельзя выполнить сейчас — вернуть в очередь через retry_after секунд"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# задача больше не будет выполняться
+FINISHED_STATUSES = ("done", "error", "cancelled", "timed_out")
+
+
+class JobQueue:
+    def __init__(self, db_path: str = "job_queue.db", lease_seconds: float = 120,
+                 limits: Optional[Dict[str, int]] = None, max_attempts: int = 3):
+        """
+        Args:
+            db_path: SQLite файл, общий для API и всех воркеров
+            lease_seconds: Срок аренды задачи без heartbeat
+            limits: Платформа -> максимум одновременно выполняемых задач
+            max_attempts: Сколько раз задачу можно захватить (после истёкших lease)
+        """
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.limits = limits or {}
+        self.max_attempts = max_attempts
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_queue ("
+                " job_id TEXT PRIMARY KEY, platform TEXT NOT NULL, payload TEXT NOT NULL,"
+                " status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+                " available_at REAL NOT NULL, created_at REAL NOT NULL,"
+                " lease_owner TEXT, lease_expires_at REAL, heartbeat_at REAL,"
+                " finished_at REAL, error TEXT, target TEXT, priority INTEGER NOT NULL DEFAULT 0,"
+                " cancel_requested INTEGER NOT NULL DEFAULT 0)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(job_queue)")}
+            if "target" not in columns:  # база от версии без склейки дублей
+                conn.execute("ALTER TABLE job_queue ADD COLUMN target TEXT")
+            if "priority" not in columns:  # база от версии без bulk
+                conn.execute("ALTER TABLE job_queue ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+            if "cancel_requested" not in columns:  # база от версии без отмены
+                conn.execute("ALTER TABLE job_queue ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS bulk_children ("
+                " parent_id TEXT NOT NULL, job_id TEXT NOT NULL, url TEXT NOT NULL, target TEXT,"
+                " PRIMARY KEY (parent_id, job_id))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS bulk_children_job ON bulk_children (job_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS job_queue_status ON job_queue (status, available_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS job_queue_target ON job_queue (target, created_at)")
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        """Чтение без блокировки записи (WAL)"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _discard(discard_jobs: Optional[Callable[[List[str]], None]], job_ids: List[str]) -> None:
+        """Убирает jobs, созданные до вставки и проигравшие склейку; сбой — только в лог"""
+        if not job_ids or discard_jobs is None:
+            return
+        try:
+            discard_jobs(job_ids)
+        except Exception as e:
+            print(f"⚠️ Cannot delete orphan jobs {job_ids}: {e}")
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, job_id: str, platform: str, payload: Dict,
+                delay: float = 0, target: Optional[str] = None, priority: int = 0) -> None:
+        now = time.time()
+        conn.execute(
+            "INSERT INTO job_queue (job_id, platform, payload, status, available_at, created_at, target, priority)"
+            " VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+            (job_id, platform, json.dumps(payload), now + delay, now, target, priority)
+        )
+
+    @staticmethod
+    def _find_recent(conn: sqlite3.Connection, target: str, fresh_seconds: float) -> Optional[sqlite3.Row]:
+        """Ждущая, выполняемая или завершённая не раньше fresh_seconds назад задача по target"""
+        return conn.execute(
+            "SELECT job_id, status FROM job_queue WHERE target = ?"
+            " AND ((status IN ('queued', 'running') AND cancel_requested = 0)"
+            " OR (status = 'done' AND finished_at >= ?))"
+            " ORDER BY created_at DESC LIMIT 1",
+            (target, time.time() - fresh_seconds)
+        ).fetchone()
+
+    def enqueue(self, job_id: str, platform: str, payload: Dict, delay: float = 0) -> None:
+        with self._transaction() as conn:
+            self._insert(conn, job_id, platform, payload, delay)
+
+    def enqueue_unique(self, target: str, platform: str, payload: Dict, create_job: Callable[[], str],
+                       fresh_seconds: float = 0, priority: int = 0,
+                       discard_jobs: Optional[Callable[[List[str]], None]] = None) -> Tuple[str, str, bool]:
+        """
+        Ставит задачу, если по target нет ждущей, выполняемой или завершённой не раньше
+        fresh_seconds назад. Одновременные запросы из разных процессов API получают один job.
+
+        create_job() создаёт job в Supabase — сетевой вызов, поэтому вне блокировки очереди:
+        сначала проверка без блокировки, затем create_job(), затем повторная проверка и
+        вставка одной короткой транзакцией BEGIN IMMEDIATE. Если за это время задачу по
+        target поставил другой процесс, созданный job лишний — его удаляет discard_jobs.
+
+        Returns: (job_id, статус в очереди, True если это уже существующая задача)
+        """
+        with self._reader() as conn:
+            row = self._find_recent(conn, target, fresh_seconds)
+        if row is not None:
+            return row["job_id"], row["status"], True
+
+        job_id = create_job()
+        try:
+            with self._transaction() as conn:
+                row = self._find_recent(conn, target, fresh_seconds)
+                if row is None:
+                    self._insert(conn, job_id, platform, payload, target=target, priority=priority)
+        except BaseException:
+            self._discard(discard_jobs, [job_id])
+            raise
+        if row is not None:
+            self._discard(discard_jobs, [job_id])
+            return row["job_id"], row["status"], True
+        return job_id, "queued", False
+
+    def enqueue_bulk(self, parent_id: str, items: List[Dict], create_jobs: Callable[[List[Dict]], List[str]],
+                     fresh_seconds: float = 0, priority: int = -1,
+                     discard_jobs: Optional[Callable[[List[str]], None]] = None) -> List[Dict]:
+        """
+        Дочерние задачи bulk job (со склейкой дублей, как enqueue_unique).
+
+        Args:
+            items: [{"url", "target", "platform", "payload"}], target уникальны
+            create_jobs(items) создаёт job в Supabase для новых задач одним запросом
+                (вне блокировки очереди), возвращает их id в том же порядке
+            discard_jobs(job_ids) удаляет созданные job, чьи target успел поставить другой процесс
+
+        Returns: [{"url", "target", "job_id", "status", "coalesced"}] в порядке items
+        """
+        results, missing = [], []
+        with self._reader() as conn:
+            for item in items:
+                row = self._find_recent(conn, item["target"], fresh_seconds)
+                result = {"url": item["url"], "target": item["target"], "job_id": None,
+                          "status": "queued", "coalesced": row is not None}
+                if row is not None:
+                    result.update(job_id=row["job_id"], status=row["status"])
+                else:
+                    missing.append((item, result))
+                results.append(result)
+
+        job_ids = create_jobs([item for item, _ in missing]) if missing else []
+        orphans = []
+        try:
+            with self._transaction() as conn:
+                for (item, result), job_id in zip(missing, job_ids):
+                    row = self._find_recent(conn, item["target"], fresh_seconds)
+                    if row is not None:
+                        orphans.append(job_id)
+                        result.update(job_id=row["job_id"], status=row["status"], coalesced=True)
+                        continue
+                    result["job_id"] = job_id
+                    self._insert(conn, job_id, item["platform"], item["payload"], target=item["target"],
+                                 priority=priority)
+                conn.executemany(
+                    "INSERT OR IGNORE INTO bulk_children (parent_id, job_id, url, target) VALUES (?, ?, ?, ?)",
+                    [(parent_id, r["job_id"], r["url"], r["target"]) for r in results]
+                )
+        except BaseException:
+            self._discard(discard_jobs, job_ids)
+            raise
+        self._discard(discard_jobs, orphans)
+        return results
+
+    def bulk_children(self, parent_id: str) -> List[Dict]:
+        """Дочерние задачи bulk job с их состоянием в очереди"""
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT c.job_id, c.url, c.target, q.platform, q.status, q.attempts, q.error"
+                " FROM bulk_children c LEFT JOIN job_queue q ON q.job_id = c.job_id"
+                " WHERE c.parent_id = ? ORDER BY c.rowid",
+                (parent_id,)
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def bulk_parents(self, job_id: str) -> List[str]:
+        """Bulk job, в которые входит задача (одна задача может быть в нескольких после склейки)"""
+        with self._transaction() as conn:
+            rows = conn.execute("SELECT parent_id FROM bulk_children WHERE job_id = ?", (job_id,)).fetchall()
+        return [r["parent_id"] for r in rows]
+
+    def bulk_summary(self, parent_id: str) -> Dict[str, int]:
+        """Сводка по детям bulk job: {"total", "done", "error", "cancelled", "finished"}"""
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) AS total, COALESCE(SUM(q.status = 'done'), 0) AS done,"
+                " COALESCE(SUM(q.status = 'error'), 0) AS error,"
+                " COALESCE(SUM(q.status IN ('cancelled', 'timed_out')), 0) AS cancelled,"
+                f" COALESCE(SUM(q.status IN ({','.join('?' * len(FINISHED_STATUSES))})), 0) AS finished"
+                " FROM bulk_children c LEFT JOIN job_queue q ON q.job_id = c.job_id WHERE c.parent_id = ?",
+                (*FINISHED_STATUSES, parent_id)
+            ).fetchone()
+        return dict(row)
+
+    def requeue_expired(self) -> List[str]:
+        """
+        Задачи упавших воркеров: lease истёк — снова в очередь.
+        Returns: job_id задач, исчерпавших max_attempts (переведены в error)
+        """
+        now = time.time()
+        failed = []
+        with self._transaction() as conn:
+            expired = conn.execute(
+                "SELECT job_id, attempts FROM job_queue WHERE status = 'running' AND lease_expires_at < ?", (now,)
+            ).fetchall()
+            for row in expired:
+                if row["attempts"] >= self.max_attempts:
+                    conn.execute(
+                        "UPDATE job_queue SET status = 'error', finished_at = ?, lease_owner = NULL,"
+                        " error = 'worker lease expired too many times' WHERE job_id = ?",
+                        (now, row["job_id"])
+                    )
+                    failed.append(row["job_id"])
+                else:
+                    conn.execute(
+                        "UPDATE job_queue SET status = 'queued', available_at = ?, lease_owner = NULL"
+                        " WHERE job_id = ?",
+                        (now, row["job_id"])
+                    )
+                    print(f"♻️ Lease of job {row['job_id']} expired, re-queued")
+        return failed
+
+    def claim(self, worker_id: str, platforms: Optional[List[str]] = None) -> Optional[Dict]:
+        """
+        Захватывает самую старую готовую задачу (с наибольшим приоритетом), для платформы
+        которой не исчерпан лимит.
+        Returns: {"job_id", "platform", "payload", "attempts"} или None
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            running = dict(conn.execute(
+                "SELECT platform, COUNT(*) FROM job_queue WHERE status = 'running' GROUP BY platform"
+            ).fetchall())
+            full = [p for p, limit in self.limits.items() if running.get(p, 0) >= limit]
+
+            query = "SELECT job_id, platform, payload, attempts FROM job_queue WHERE status = 'queued' AND available_at <= ?"
+            params: list = [now]
+            if platforms:
+                query += f" AND platform IN ({','.join('?' * len(platforms))})"
+                params += platforms
+            if full:
+                query += f" AND platform NOT IN ({','.join('?' * len(full))})"
+                params += full
+            row = conn.execute(query + " ORDER BY priority DESC, available_at, created_at LIMIT 1", params).fetchone()
+            if row is None:
+                return None
+
+            conn.execute(
+                "UPDATE job_queue SET status = 'running', attempts = attempts + 1, lease_owner = ?,"
+                " lease_expires_at = ?, heartbeat_at = ? WHERE job_id = ?",
+                (worker_id, now + self.lease_seconds, now, row["job_id"])
+            )
+        return {
+            "job_id": row["job_id"],
+            "platform": row["platform"],
+            "payload": json.loads(row["payload"]),
+            "attempts": row["attempts"] + 1,
+        }
+
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        """Продлевает lease. False — задача уже не наша (lease истёк и её забрали)"""
+        now = time.time()
+        with self._transaction() as conn:
+            cur = conn.execute(
+                "UPDATE job_queue SET lease_expires_at = ?, heartbeat_at = ?"
+                " WHERE job_id = ? AND lease_owner = ? AND status = 'running'",
+                (now + self.lease_seconds, now, job_id, worker_id)
+            )
+            return cur.rowcount == 1
+
+    def _finish(self, job_id: str, worker_id: str, status: str, error: Optional[str] = None,
+                available_at: Optional[float] = None, refund_attempt: bool = False) -> bool:
+        with self._transaction() as conn:
+            cur = conn.execute(
+                "UPDATE job_queue SET status = ?, error = ?, lease_owner = NULL, lease_expires_at = NULL,"
+                " finished_at = ?, available_at = COALESCE(?, available_at), attempts = attempts - ?"
+                " WHERE job_id = ? AND lease_owner = ?",
+                (status, error, None if status == "queued" else time.time(), available_at,
+                 1 if refund_attempt else 0, job_id, worker_id)
+            )
+            return cur.rowcount == 1
+
+    def request_cancel(self, job_id: str) -> Optional[str]:
+        """
+        Отмена задачи: ждущая -> cancelled сразу, выполняемая -> cancel_requested
+        (воркер прервёт её на ближайшей проверке).
+        Returns: "cancelled" | "cancelling" | статус уже завершённой | None — нет такой задачи
+        """
+        with self._transaction() as conn:
+            row = conn.execute("SELECT status FROM job_queue WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            if row["status"] == "queued":
+                conn.execute(
+                    "UPDATE job_queue SET status = 'cancelled', finished_at = ?, error = 'Cancelled by user'"
+                    " WHERE job_id = ?",
+                    (time.time(), job_id)
+                )
+                return "cancelled"
+            if row["status"] == "running":
+                conn.execute("UPDATE job_queue SET cancel_requested = 1 WHERE job_id = ?", (job_id,))
+                return "cancelling"
+            return row["status"]
+
+    def cancel_requested(self, job_ids: List[str]) -> List[str]:
+        """Какие из выполняемых задач просят отменить"""
+        if not job_ids:
+            return []
+        with self._transaction() as conn:
+            rows = conn.execute(
+                f"SELECT job_id FROM job_queue WHERE cancel_requested = 1 AND job_id IN ({','.join('?' * len(job_ids))})",
+                job_ids
+            ).fetchall()
+        return [r["job_id"] for r in rows]
+
+    def cancelled(self, job_id: str, worker_id: str, status: str, reason: str) -> bool:
+        """Задача прервана (status: cancelled | timed_out) — в очередь не возвращается"""
+        return self._finish(job_id, worker_id, status, error=reason)
+
+    def complete(self, job_id: str, worker_id: str) -> bool:
+        return self._finish(job_id, worker_id, "done")
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        return self._finish(job_id, worker_id, "error", error=error)
+
+    def retry_later(self, job_id: str, worker_id: str, delay: float, reason: str) -> bool:
+        """Вернуть в очередь (кончилась квота/сессии) — попытка не засчитывается"""
+        return self._finish(job_id, worker_id, "queued", error=reason,
+                            available_at=time.time() + delay, refund_attempt=True)
+
+    def stats(self) -> Dict:
+        now = time.time()
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT platform, status, COUNT(*) AS n FROM job_queue GROUP BY platform, status"
+            ).fetchall()
+            (oldest,) = conn.execute(
+                "SELECT MIN(created_at) FROM job_queue WHERE status = 'queued' AND available_at <= ?", (now,)
+            ).fetchone()
+        by_platform: Dict[str, Dict[str, int]] = {}
+        for row in rows:
+            by_platform.setdefault(row["platform"], {})[row["status"]] = row["n"]
+        return {
+            "platforms": by_platform,
+            "limits": self.limits,
+            "oldest_ready_seconds": round(now - oldest, 1) if oldest else 0,
+        }
+
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(
+                db_path=settings.job_queue_db,
+                lease_seconds=settings.job_lease_seconds,
+                limits={"youtube": settings.job_limit_youtube, "instagram": settings.job_limit_instagram},
+                max_attempts=settings.job_max_attempts
+            )
+        return _queue
@@ -0,0 +1,212 @@
+# app/service/watchlist.py
+"""
+Watchlist: каналы, видео, посты и профили, которые перепарсиваются автоматически.
+
+Интервал повторного обхода подстраивается под скорость комментариев цели:
+    velocity = EWMA(новых комментариев за обход / часов между обходами)
+    interval = comments_per_crawl / velocity, в пределах [min_interval, max_interval]
+Свежий вирусный пост обходится раз в несколько минут, затихший — раз в сутки.
+
+Бюджет: ожидаемый суточный расход всех целей платформы (units YouTube / запросы
+Instagram) сравнивается с долей квоты, отданной watchlist; если не помещается —
+интервалы платформы растягиваются пропорционально (budget_stretch).
+
+Таблица лежит в той же SQLite базе, что и очередь задач: «обход ещё идёт»
+проверяется join'ом с job_queue, захват целей — BEGIN IMMEDIATE, поэтому несколько
+воркеров не ставят одну цель дважды.
+"""
+
+import math
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from ..config import settings
+from .job_queue import get_job_queue
+from .youtube_quota import estimate_job_units
+
+# комментариев в одном ответе GraphQL Instagram (с запасом — страницы бывают меньше)
+INSTAGRAM_COMMENTS_PER_REQUEST = 12
+# вес нового наблюдения скорости в EWMA
+VELOCITY_ALPHA = 0.5
+
+
+class Watchlist:
+    def __init__(self, db_path: str = "job_queue.db", min_interval: float = 300, max_interval: float = 86400,
+                 initial_interval: float = 3600, comments_per_crawl: int = 50):
+        """
+        Args:
+            db_path: SQLite файл очереди задач (таблица job_queue уже создана JobQueue)
+            min_interval / max_interval: пределы интервала обхода, сек
+            initial_interval: интервал до первого измерения скорости
+            comments_per_crawl: сколько новых комментариев в среднем ждём на один обход
+        """
+        self.db_path = db_path
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.initial_interval = initial_interval
+        self.comments_per_crawl = comments_per_crawl
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS watchlist ("
+                " target TEXT PRIMARY KEY, platform TEXT NOT NULL, url TEXT NOT NULL,"
+                " max_comments INTEGER NOT NULL, max_videos INTEGER NOT NULL,"
+                " enabled INTEGER NOT NULL DEFAULT 1, created_at REAL NOT NULL,"
+                " interval REAL NOT NULL, velocity REAL,"
+                " last_crawl_at REAL, prev_crawl_at REAL, last_job_id TEXT,"
+                " last_new_comments INTEGER, crawls INTEGER NOT NULL DEFAULT 0)"
+            )
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+    def add(self, target: str, platform: str, url: str, max_comments: int = 500, max_videos: int = 50) -> Dict:
+        """Добавляет цель (или обновляет параметры и включает снова); первый обход — сразу"""
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO watchlist (target, platform, url, max_comments, max_videos, created_at, interval)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(target) DO UPDATE SET url = excluded.url, max_comments = excluded.max_comments,"
+                " max_videos = excluded.max_videos, enabled = 1",
+                (target, platform, url, max_comments, max_videos, time.time(), self.initial_interval)
+            )
+            row = conn.execute("SELECT * FROM watchlist WHERE target = ?", (target,)).fetchone()
+        return dict(row)
+
+    def remove(self, target: str) -> bool:
+        with self._transaction() as conn:
+            return conn.execute("DELETE FROM watchlist WHERE target = ?", (target,)).rowcount == 1
+
+    def items(self) -> List[Dict]:
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT w.*, q.status AS last_job_status FROM watchlist w"
+                " LEFT JOIN job_queue q ON q.job_id = w.last_job_id ORDER BY w.created_at"
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def claim_due(self, stretch: Dict[str, float], platforms: Optional[List[str]] = None,
+                  limit: int = 20) -> List[Dict]:
+        """
+        Цели, которым пора на обход: прошёл interval * stretch[платформа] с прошлого
+        обхода и прошлый обход не в очереди/не выполняется. Отмечает начало обхода
+        (last_crawl_at) в той же транзакции — другой воркер эти цели уже не получит.
+        """
+        now = time.time()
+        platforms = platforms if platforms is not None else list(stretch)
+        if not platforms:
+            return []
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT w.* FROM watchlist w LEFT JOIN job_queue q ON q.job_id = w.last_job_id"
+                f" WHERE w.enabled = 1 AND w.platform IN ({','.join('?' * len(platforms))})"
+                " AND (q.status IS NULL OR q.status NOT IN ('queued', 'running'))"
+                " ORDER BY COALESCE(w.last_crawl_at, 0) + w.interval",
+                platforms
+            ).fetchall()
+            due = [dict(r) for r in rows
+                   if r["last_crawl_at"] is None
+                   or r["last_crawl_at"] + r["interval"] * stretch.get(r["platform"], 1.0) <= now][:limit]
+            conn.executemany(
+                "UPDATE watchlist SET prev_crawl_at = last_crawl_at, last_crawl_at = ? WHERE target = ?",
+                [(now, r["target"]) for r in due]
+            )
+        return due
+
+    def started(self, target: str, job_id: str) -> None:
+        with self._transaction() as conn:
+            conn.execute("UPDATE watchlist SET last_job_id = ? WHERE target = ?", (job_id, target))
+
+    def record_crawl(self, job_id: str, new_comments: Optional[int]) -> Optional[Dict]:
+        """
+        Итог обхода: обновляет скорость и интервал цели, для которой job_id — последний обход.
+        new_comments None — обход не удался или не был инкрементальным, скорость не меняем.
+        Returns: обновлённая цель или None, если job не из watchlist.
+        """
+        with self._transaction() as conn:
+            row = conn.execute("SELECT * FROM watchlist WHERE last_job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            velocity, interval = row["velocity"], row["interval"]
+            if new_comments is not None and row["prev_crawl_at"] is not None:
+                # первый обход забирает всю историю — скорость меряем со второго
+                hours = max((row["last_crawl_at"] - row["prev_crawl_at"]) / 3600, 1 / 60)
+                observed = new_comments / hours
+                velocity = observed if velocity is None else \
+                    VELOCITY_ALPHA * observed + (1 - VELOCITY_ALPHA) * velocity
+                interval = self.interval_for(velocity)
+            conn.execute(
+                "UPDATE watchlist SET velocity = ?, interval = ?, last_new_comments = ?, crawls = crawls + 1"
+                " WHERE target = ?",
+                (velocity, interval, new_comments, row["target"])
+            )
+            updated = conn.execute("SELECT * FROM watchlist WHERE target = ?", (row["target"],)).fetchone()
+        return dict(updated)
+
+    def interval_for(self, velocity: float) -> float:
+        """Интервал, за который набегает ~comments_per_crawl новых комментариев"""
+        if velocity <= 0:
+            return self.max_interval
+        return min(self.max_interval, max(self.min_interval, self.comments_per_crawl / velocity * 3600))
+
+
+def estimate_crawl_cost(item: Dict) -> float:
+    """Стоимость одного обхода: units YouTube или запросы Instagram"""
+    expected = min(item["max_comments"], (item["velocity"] or 0) * item["interval"] / 3600)
+    if item["platform"] == "youtube":
+        if item["target"].startswith("youtube:video:"):
+            return 1 + estimate_job_units(math.ceil(expected), item["max_comments"])
+        # канал/плейлист: список видео, videos.list пачками по 50 и хотя бы страница на видео
+        batches = math.ceil(item["max_videos"] / 50)
+        return 1 + 2 * batches + item["max_videos"] + estimate_job_units(math.ceil(expected), item["max_comments"])
+    pages = math.ceil(expected / INSTAGRAM_COMMENTS_PER_REQUEST)
+    if item["target"].startswith("instagram:post:"):
+        return 1 + max(1, pages)
+    return 2 + max(1, pages)  # профиль: профиль + лента, затем посты с новыми комментариями
+
+
+def budget_stretch(items: List[Dict], platform: str, daily_budget: float) -> float:
+    """
+    Во сколько раз растянуть интервалы платформы, чтобы ожидаемый суточный
+    расход watchlist уложился в daily_budget (1.0 — укладывается)
+    """
+    projected = sum(estimate_crawl_cost(i) * 86400 / i["interval"]
+                    for i in items if i["platform"] == platform and i["enabled"])
+    if daily_budget <= 0:
+        return math.inf if projected else 1.0
+    return max(1.0, projected / daily_budget)
+
+
+_watchlist: Optional[Watchlist] = None
+_watchlist_lock = threading.Lock()
+
+
+def get_watchlist() -> Watchlist:
+    global _watchlist
+    queue = get_job_queue()  # создаёт job_queue, с которой join'ится watchlist
+    with _watchlist_lock:
+        if _watchlist is None:
+            _watchlist = Watchlist(
+                db_path=queue.db_path,
+                min_interval=settings.watchlist_min_interval,
+                max_interval=settings.watchlist_max_interval,
+                initial_interval=settings.watchlist_initial_interval,
+                comments_per_crawl=settings.watchlist_comments_per_crawl
+            )
+        return _watchlist
@@ -0,0 +1,116 @@
+# app/service/watermarks.py
+"""
+Водяные знаки для инкрементального ингеста.
+
+Хранятся в sources.raw_meta["watermark"]:
+    {"published_at": <самый свежий published_at>,
+     "updated_at": <самый свежий updated_at>,
+     "ext_ids": [id последних комментариев, новые первыми],
+     "resume": {"oldest": ..., "newest": ...}}  # только после обрезанного ингеста
+
+Парсер с since=<watermark> обходит комментарии от новых к старым и прекращает
+пагинацию на первом уже виденном (или более старом) комментарии.
+
+Ингест, обрезанный max_comments, нижнюю границу (published_at, ext_ids) не двигает:
+между последним полученным и старым водяным знаком остались непрочитанные комментарии.
+Вместо этого в resume записывается уже полученный отрезок [oldest, newest] топ-комментариев —
+следующий обход его не отдаёт повторно и не тратит на него max_comments, а продолжает
+ниже него до старой границы. Когда обход доходит до границы, водяной знак сдвигается
+на самый свежий полученный комментарий, а resume исчезает.
+"""
+
+import heapq
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# Сколько последних id держим в водяном знаке (на случай одинаковых timestamp)
+MAX_TRACKED_IDS = 200
+
+
+def is_seen(watermark: Optional[Dict], comment_id: str, published_at: Optional[str]) -> bool:
+    """True, если комментарий уже был получен прошлым ингестом"""
+    if not watermark:
+        return False
+    if comment_id in watermark.get("ext_ids", []):
+        return True
+    wm_published = watermark.get("published_at")
+    return bool(wm_published and published_at and published_at < wm_published)
+
+
+def in_fetched_range(watermark: Optional[Dict], published_at: Optional[str]) -> bool:
+    """
+    True, если топ-комментарий внутри отрезка, полученного обрезанным ингестом (watermark["resume"]):
+    его не отдаём, но пагинацию не прекращаем — ниже отрезка есть непрочитанные.
+    Границы отрезка не входят: комментарий с тем же timestamp мог не попасть в прошлый обход.
+    """
+    resume = (watermark or {}).get("resume")
+    if not resume or not published_at:
+        return False
+    return resume["oldest"] < published_at < resume["newest"]
+
+
+class WatermarkTracker:
+    """Пропускает через себя страницы комментариев и считает новый водяной знак"""
+
+    def __init__(self, previous: Optional[Dict] = None):
+        previous = previous or {}
+        self._previous = previous
+        self.published_at: Optional[str] = previous.get("published_at")
+        self.updated_at: Optional[str] = previous.get("updated_at")
+        self._recent: List[tuple] = []
+        self._previous_ids: List[str] = list(previous.get("ext_ids", []))
+        # отрезок топ-комментариев этого обхода и были ли реплаи (YouTube отдаёт их после всех веток)
+        self.newest: Optional[str] = None
+        self.oldest: Optional[str] = None
+        self.saw_replies = False
+
+    def observe(self, pages: Iterable[List[Dict]]) -> Iterator[List[Dict]]:
+        for page in pages:
+            for c in page:
+                published = c.get("published_at")
+                updated = c.get("updated_at") or published
+                if published and (not self.published_at or published > self.published_at):
+                    self.published_at = published
+                if updated and (not self.updated_at or updated > self.updated_at):
+                    self.updated_at = updated
+                if c.get("is_reply"):
+                    self.saw_replies = True
+                elif published:
+                    self.newest = max(self.newest or published, published)
+                    self.oldest = min(self.oldest or published, published)
+                # держим только MAX_TRACKED_IDS самых свежих — память не растёт с числом комментариев
+                item = (published or "", c["id"])
+                if len(self._recent) < MAX_TRACKED_IDS:
+                    heapq.heappush(self._recent, item)
+                else:
+                    heapq.heappushpop(self._recent, item)
+            yield page
+
+    def result(self, truncated: bool = False) -> Dict:
+        """
+        Новый водяной знак. truncated — обход остановлен max_comments, а не водяным знаком
+        или концом комментариев: граница остаётся прежней, полученное уходит в resume.
+        """
+        resume = self._previous.get("resume")
+        if truncated:
+            watermark = {k: self._previous.get(k) for k in ("published_at", "updated_at", "ext_ids")}
+            # Реплаи YouTube идут после всех веток: обрезаны реплаи, а не ветки — отрезок
+            # не запоминаем, следующий обход пройдёт ветки заново (upsert идемпотентен)
+            if self.saw_replies or self.oldest is None:
+                return watermark
+            fetched = {"oldest": self.oldest, "newest": self.newest}
+            if resume and self.oldest < resume["oldest"]:
+                # обход прошёл сквозь прежний отрезок — он внутри нового
+                fetched["newest"] = max(self.newest, resume["newest"])
+            watermark["resume"] = fetched
+            return watermark
+
+        published_at = self.published_at
+        if resume and (not published_at or resume["newest"] > published_at):
+            published_at = resume["newest"]
+        recent = [cid for _, cid in sorted(self._recent, reverse=True)]
+        ext_ids = list(dict.fromkeys(recent + self._previous_ids))[:MAX_TRACKED_IDS]
+        return {
+            "published_at": published_at,
+            "updated_at": self.updated_at,
+            "ext_ids": ext_ids
+        }
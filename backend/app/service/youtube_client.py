@@ -0,0 +1,97 @@
+# app/service/youtube_client.py
+"""
+Общая для процесса фабрика клиентов YouTube Data API и кэш метаданных.
+
+- discovery-документ берётся из пакета (static discovery) и парсится один раз;
+- клиенты (каждый со своим keep-alive httplib2.Http) лежат в пуле по ключу:
+  httplib2 не потокобезопасен, поэтому клиент выдаётся одному потоку за раз
+  и возвращается в пул, а TCP/TLS соединения переживают отдельные job;
+- видео и каналы кэшируются с TTL, чтобы повторные job по тому же видео/каналу
+  не тратили квоту на videos().list / channels().list.
+"""
+
+import json
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+import httplib2
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+from ..config import settings
+from .ttl_cache import TTLCache
+
+_discovery_doc: Optional[dict] = None
+_doc_lock = threading.Lock()
+
+
+def _youtube_discovery_doc() -> dict:
+    global _discovery_doc
+    with _doc_lock:
+        if _discovery_doc is None:
+            _discovery_doc = json.loads(get_static_doc("youtube", "v3"))
+        return _discovery_doc
+
+
+class YouTubeClientPool:
+    def __init__(self, timeout: float = 30, max_idle_per_key: int = 16):
+        self.timeout = timeout
+        self.max_idle_per_key = max_idle_per_key
+        self._idle: Dict[str, List] = defaultdict(list)
+        self._lock = threading.Lock()
+        self.created = 0
+
+    def _build(self, api_key: str):
+        self.created += 1
+        return build_from_document(
+            _youtube_discovery_doc(),
+            developerKey=api_key,
+            http=httplib2.Http(timeout=self.timeout)
+        )
+
+    @contextmanager
+    def client(self, api_key: str) -> Iterator:
+        """Клиент для ключа в монопольное пользование на время блока"""
+        with self._lock:
+            idle = self._idle[api_key]
+            youtube = idle.pop() if idle else None
+        if youtube is None:
+            youtube = self._build(api_key)
+        try:
+            yield youtube
+        finally:
+            with self._lock:
+                idle = self._idle[api_key]
+                if len(idle) < self.max_idle_per_key:
+                    idle.append(youtube)
+
+    def close(self) -> None:
+        with self._lock:
+            for clients in self._idle.values():
+                for youtube in clients:
+                    for conn in getattr(youtube._http, "connections", {}).values():
+                        conn.close()
+            self._idle.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"created": self.created, "idle": {k[-4:]: len(v) for k, v in self._idle.items()}}
+
+
+_pool: Optional[YouTubeClientPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_client_pool() -> YouTubeClientPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = YouTubeClientPool(max_idle_per_key=max(16, settings.youtube_reply_concurrency * 2))
+        return _pool
+
+
+# Метаданные: статистика видео меняется быстро, канал — редко
+video_cache = TTLCache(maxsize=2048, ttl=settings.youtube_video_cache_ttl)
+channel_cache = TTLCache(maxsize=512, ttl=settings.youtube_channel_cache_ttl)
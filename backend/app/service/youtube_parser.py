@@ -1,13 +1,73 @@
-from googleapiclient.discovery import build
-from typing import List, Dict, Optional
+from googleapiclient.errors import HttpError
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import deque
+from typing import Callable, List, Dict, Iterator, Optional
 import re
+import threading
+
+from .cancellation import check_cancelled, propagate_context
+from .watermarks import in_fetched_range, is_seen
+from .youtube_quota import QuotaLedger, QuotaExhausted
+from .youtube_client import get_client_pool, video_cache, channel_cache
+
+
+def _is_quota_error(e: HttpError) -> bool:
+    return getattr(e.resp, "status", None) == 403 and b"quotaExceeded" in (e.content or b"")
+
 
 class YouTubeParser:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, reply_concurrency: int = 8, inline_replies: bool = True,
+                 quota: Optional[QuotaLedger] = None):
         self.api_key = api_key
-        self.youtube = build('youtube', 'v3', developerKey=api_key)
+        # Журнал квоты: списание units по ключу и ротация ключей при quotaExceeded
+        self.quota = quota
+        self._key_lock = threading.Lock()
+        # Сколько веток реплаев тянем параллельно
+        self.reply_concurrency = max(1, reply_concurrency)
+        # Брать реплаи из commentThreads(part="snippet,replies"), если ветка пришла целиком
+        self.inline_replies = inline_replies
+        # Счётчик вызовов API по методам (для отчёта по job)
+        self.call_stats: Dict[str, int] = {}
+        self._stats_lock = threading.Lock()
+
+    def _execute(self, make_request: Callable, method: str) -> Dict:
+        """
+        Выполняет запрос к API: считает вызовы по методам, списывает квоту
+        и при quotaExceeded переключается на следующий ключ.
+
+        make_request(youtube) строит запрос для клиента из общего пула (по текущему ключу).
+        Отменённый или просроченный job дальше квоту не тратит (JobCancelled).
+        """
+        tried: List[str] = []
+        while True:
+            check_cancelled()
+            api_key = self.api_key
+            with self._stats_lock:
+                self.call_stats[method] = self.call_stats.get(method, 0) + 1
+            if self.quota:
+                self.quota.charge(api_key, method)
+            try:
+                with get_client_pool().client(api_key) as youtube:
+                    return make_request(youtube).execute()
+            except HttpError as e:
+                if not self.quota or not _is_quota_error(e):
+                    raise
+                self.quota.mark_exhausted(api_key)
+                tried.append(api_key)
+                self._rotate_key(tried)
+
+    def _rotate_key(self, tried: List[str]) -> None:
+        with self._key_lock:
+            if self.api_key not in tried:
+                return  # другой поток уже переключил ключ
+            next_key = self.quota.pick_key(exclude=tried)
+            if not next_key:
+                raise QuotaExhausted("YouTube API quota exceeded for all configured keys")
+            print(f"🔑 YouTube quota exceeded for key …{tried[-1][-4:]}, switching to …{next_key[-4:]}")
+            self.api_key = next_key
 
-    def extract_video_id(self, url: str) -> Optional[str]:
+    @staticmethod
+    def extract_video_id(url: str) -> Optional[str]:
         patterns = [
             r'(?:youtube\.com\/watch\?v=|youtu\.be\/)([^&\n?#]*)',
             r'youtube\.com\/embed\/([^&\n?#]*)',
@@ -26,20 +86,142 @@ class YouTubeParser:
             return channel_item['snippet'].get('title', 'unknown')
         return 'unknown'
 
-    def get_video_info(self, url: str) -> Dict:
+    @staticmethod
+    def extract_playlist_id(url: str) -> Optional[str]:
+        m = re.search(r'[?&]list=([A-Za-z0-9_-]+)', url)
+        return m.group(1) if m else None
+
+    @staticmethod
+    def extract_channel_ref(url: str) -> Optional[Dict]:
+        """
+        Ссылка на канал -> параметр для channels().list:
+            youtube.com/channel/UC...  -> {"id": ...}
+            youtube.com/@handle        -> {"forHandle": "@handle"}
+            youtube.com/user/name      -> {"forUsername": ...}
+            youtube.com/c/name         -> {"forHandle": "@name"} (custom URL обычно совпадает с handle)
+        """
+        patterns = [
+            (r'youtube\.com/channel/(UC[A-Za-z0-9_-]+)', "id", ""),
+            (r'youtube\.com/(@[A-Za-z0-9_.-]+)', "forHandle", ""),
+            (r'youtube\.com/user/([A-Za-z0-9_.-]+)', "forUsername", ""),
+            (r'youtube\.com/c/([A-Za-z0-9_.-]+)', "forHandle", "@"),
+        ]
+        for pattern, param, prefix in patterns:
+            m = re.search(pattern, url)
+            if m:
+                return {param: prefix + m.group(1)}
+        return None
+
+    @staticmethod
+    def detect_content_type(url: str) -> str:
+        """'video' | 'playlist' | 'channel' | 'unknown'"""
+        if YouTubeParser.extract_video_id(url):
+            return 'video'
+        if YouTubeParser.extract_playlist_id(url):
+            return 'playlist'
+        if YouTubeParser.extract_channel_ref(url):
+            return 'channel'
+        return 'unknown'
+
+    def get_uploads_playlist(self, url: str) -> Dict:
+        """Канал по ссылке -> {"channel_id", "channel_title", "uploads_playlist_id"}"""
+        ref = self.extract_channel_ref(url)
+        if not ref:
+            raise ValueError("Invalid YouTube channel URL")
+        resp = self._execute(lambda yt: yt.channels().list(part="snippet,contentDetails", **ref), "channels.list")
+        if not resp.get('items'):
+            raise ValueError("Channel not found")
+        channel = resp['items'][0]
+        channel_cache.set(channel['id'], channel)
+        return {
+            "channel_id": channel['id'],
+            "channel_title": channel['snippet'].get('title', ''),
+            "uploads_playlist_id": channel['contentDetails']['relatedPlaylists']['uploads']
+        }
+
+    def iter_playlist_video_ids(self, playlist_id: str, max_videos: int = 50) -> Iterator[str]:
+        """videoId из плейлиста, по 50 за вызов playlistItems().list"""
+        emitted = 0
+        page_token = None
+        while emitted < max_videos:
+            resp = self._execute(lambda yt: yt.playlistItems().list(
+                part="contentDetails",
+                playlistId=playlist_id,
+                pageToken=page_token,
+                maxResults=50
+            ), "playlistItems.list")
+            for item in resp.get('items', []):
+                if emitted >= max_videos:
+                    return
+                emitted += 1
+                yield item['contentDetails']['videoId']
+            page_token = resp.get('nextPageToken')
+            if not page_token:
+                return
+
+    def get_videos_info(self, video_ids: List[str], use_cache: bool = True) -> List[Dict]:
+        """
+        Метаданные многих видео: videos().list с id пачками по 50 (1 unit на пачку),
+        каналы — через кэш. Удалённые/приватные видео пропускаются.
+        """
+        videos: Dict[str, Dict] = {}
+        missing = []
+        for vid in video_ids:
+            cached = video_cache.get(vid) if use_cache else None
+            if cached is not None:
+                videos[vid] = cached
+            else:
+                missing.append(vid)
+
+        for i in range(0, len(missing), 50):
+            batch = missing[i:i + 50]
+            resp = self._execute(
+                lambda yt: yt.videos().list(part="snippet,statistics", id=",".join(batch), maxResults=50),
+                "videos.list"
+            )
+            for video in resp.get('items', []):
+                video_cache.set(video['id'], video)
+                videos[video['id']] = video
+
+        result = []
+        for vid in video_ids:
+            video = videos.get(vid)
+            if video:
+                channel = self._get_channel_item(video['snippet']['channelId'], use_cache)
+                result.append(self._video_info_dict(vid, video, channel))
+        return result
+
+    def _get_video_item(self, vid: str, use_cache: bool = True) -> Optional[Dict]:
+        video = video_cache.get(vid) if use_cache else None
+        if video is None:
+            video_resp = self._execute(lambda yt: yt.videos().list(part="snippet,statistics", id=vid), "videos.list")
+            if not video_resp['items']:
+                return None
+            video = video_resp['items'][0]
+            video_cache.set(vid, video)
+        return video
+
+    def _get_channel_item(self, channel_id: str, use_cache: bool = True) -> Dict:
+        channel = channel_cache.get(channel_id) if use_cache else None
+        if channel is None:
+            channel_resp = self._execute(lambda yt: yt.channels().list(part="snippet", id=channel_id), "channels.list")
+            channel = channel_resp['items'][0] if channel_resp.get('items') else {}
+            channel_cache.set(channel_id, channel)
+        return channel
+
+    def get_video_info(self, url: str, use_cache: bool = True) -> Dict:
         vid = self.extract_video_id(url)
         if not vid:
             raise ValueError("Invalid YouTube URL")
-        video_resp = self.youtube.videos().list(part="snippet,statistics", id=vid).execute()
-        if not video_resp['items']:
+        video = self._get_video_item(vid, use_cache)
+        if not video:
             raise ValueError("Video not found")
-        video = video_resp['items'][0]
-        snippet = video['snippet']
+        channel = self._get_channel_item(video['snippet']['channelId'], use_cache)
+        return self._video_info_dict(vid, video, channel)
 
+    def _video_info_dict(self, vid: str, video: Dict, channel: Dict) -> Dict:
+        snippet = video['snippet']
         channel_id = snippet['channelId']
-        channel_resp = self.youtube.channels().list(part="snippet", id=channel_id).execute()
-        channel = channel_resp['items'][0] if channel_resp.get('items') else {}
-
         return {
             "video_id": vid,
             "title": snippet.get("title", ""),
@@ -53,94 +235,172 @@ class YouTubeParser:
             "comment_count": int(video.get("statistics", {}).get("commentCount", 0) or 0)
         }
 
-    def parse_comments(self, video_id: str, max_results: int = 1000) -> List[Dict]:
+    @staticmethod
+    def _comment_dict(comment_id: str, sn: Dict, parent_id: Optional[str]) -> Dict:
+        return {
+            "id": comment_id,
+            "parent_id": parent_id,
+            "is_reply": parent_id is not None,
+            "author": sn.get('authorDisplayName', ''),
+            "author_channel_id": sn.get('authorChannelId', {}).get('value', ''),
+            "text": sn.get('textOriginal') or sn.get('textDisplay', ''),  # textOriginal стабильнее
+            "likes": sn.get('likeCount', 0),
+            "published_at": sn.get('publishedAt'),
+            "updated_at": sn.get('updatedAt', sn.get('publishedAt'))
+        }
+
+    def _fetch_replies(self, parent_id: str, limit: int) -> List[Dict]:
+        """Все реплаи одной ветки через comments().list(parentId=...), не больше limit"""
+        replies: List[Dict] = []
+        page_token = None
+        while len(replies) < limit:
+            resp = self._execute(lambda yt: yt.comments().list(
+                part="snippet",
+                parentId=parent_id,
+                pageToken=page_token,
+                maxResults=100,
+                textFormat="plainText"
+            ), "comments.list")
+            for itm in resp.get('items', []):
+                replies.append(self._comment_dict(itm['id'], itm['snippet'], parent_id))
+            page_token = resp.get('nextPageToken')
+            if not page_token:
+                break
+        return replies[:limit]
+
+    def parse_comments(self, video_id: str, max_results: int = 1000,
+                       reply_concurrency: Optional[int] = None,
+                       since: Optional[Dict] = None, top_level_only: bool = False) -> List[Dict]:
+        """Все комментарии видео одним списком (см. iter_comment_pages)"""
         comments: List[Dict] = []
+        for page in self.iter_comment_pages(video_id, max_results, reply_concurrency, since, top_level_only):
+            comments.extend(page)
+        return comments
 
-        # 1) Собираем ветки топ-комментариев
-        req = self.youtube.commentThreads().list(
-            part="snippet",  # можно поставить "snippet,replies", но мы всё равно добираем все реплаи отдельно
-            videoId=video_id,
-            maxResults=100,
-            textFormat="plainText"
-        )
-        resp = req.execute()
-
-        def push_toplevel_items(r):
+    def iter_comment_pages(self, video_id: str, max_results: int = 1000,
+                           reply_concurrency: Optional[int] = None,
+                           since: Optional[Dict] = None,
+                           top_level_only: bool = False) -> Iterator[List[Dict]]:
+        """
+        Топ-комментарии + все реплаи видео, постранично (генератор).
+
+        Сначала отдаются страницы топ-комментариев, затем реплаи веток в порядке родителей.
+        Реплаи тянутся пулом потоков (reply_concurrency веток одновременно),
+        но отдаются строго в порядке родителей — как при последовательном обходе.
+        В режиме inline_replies ветки, целиком пришедшие в commentThreads
+        (replies покрывают totalReplyCount), отдельным запросом не добираются.
+
+        since — водяной знак прошлого ингеста (см. service/watermarks.py): ветки идут
+        по времени (order=time), пагинация останавливается на первой уже виденной.
+        Новые реплаи в старых ветках в этом режиме не добираются.
+
+        top_level_only — экономия квоты: comments().list не вызывается, реплаи
+        берутся только те, что пришли inline в commentThreads.
+        """
+        emitted = 0
+        reached_seen = False
+        parents: List[str] = []
+        # parent_id -> готовые реплаи (None — ветку надо добрать через comments().list)
+        thread_replies: Dict[str, Optional[List[Dict]]] = {}
+        # parent_id -> totalReplyCount: сколько бюджета резервировать под ветку
+        reply_totals: Dict[str, int] = {}
+        part = "snippet,replies" if self.inline_replies else "snippet"
+
+        def toplevel_items(r) -> List[Dict]:
+            page = []
+            nonlocal reached_seen
             for item in r.get('items', []):
-                sn = item['snippet']['topLevelComment']['snippet']
-                top_level_id = item['snippet']['topLevelComment']['id']  # ВАЖНО: это parentId для реплаев
-                comments.append({
-                    "id": top_level_id,
-                    "parent_id": None,
-                    "is_reply": False,
-                    "author": sn.get('authorDisplayName', ''),
-                    "author_channel_id": sn.get('authorChannelId', {}).get('value', ''),
-                    "text": sn.get('textOriginal') or sn.get('textDisplay', ''),  # textOriginal стабильнее
-                    "likes": sn.get('likeCount', 0),
-                    "published_at": sn.get('publishedAt'),
-                    "updated_at": sn.get('updatedAt', sn.get('publishedAt'))
-                })
-
-        push_toplevel_items(resp)
-
-        # Пагинация по тредам
-        while resp.get('nextPageToken') and len(comments) < max_results:
-            resp = self.youtube.commentThreads().list(
-                part="snippet",
+                top = item['snippet']['topLevelComment']
+                # ВАЖНО: id топ-коммента — это parentId для реплаев
+                parent_id = top['id']
+                if since is not None and is_seen(since, parent_id, top['snippet'].get('publishedAt')):
+                    reached_seen = True
+                    break
+                # ветка уже получена обрезанным ингестом: сам комментарий не отдаём,
+                # но реплаи добираем — до них тот обход не дошёл
+                if since is None or not in_fetched_range(since, top['snippet'].get('publishedAt')):
+                    page.append(self._comment_dict(parent_id, top['snippet'], None))
+
+                total_replies = item['snippet'].get('totalReplyCount', 0)
+                inline = item.get('replies', {}).get('comments', [])
+                if not total_replies or (top_level_only and not inline):
+                    continue
+                parents.append(parent_id)
+                reply_totals[parent_id] = total_replies
+                if len(inline) >= total_replies or top_level_only:
+                    thread_replies[parent_id] = [
+                        self._comment_dict(itm['id'], itm['snippet'], parent_id) for itm in inline
+                    ]
+                else:
+                    thread_replies[parent_id] = None
+            return page
+
+        # 1) Собираем ветки топ-комментариев
+        page_token = None
+        while emitted < max_results:
+            resp = self._execute(lambda yt: yt.commentThreads().list(
+                part=part,
                 videoId=video_id,
-                pageToken=resp['nextPageToken'],
+                pageToken=page_token,
                 maxResults=100,
+                order="time" if since is not None else None,
                 textFormat="plainText"
-            ).execute()
-            push_toplevel_items(resp)
-            if len(comments) >= max_results:
+            ), "commentThreads.list")
+            page = toplevel_items(resp)[:max_results - emitted]
+            if page:
+                emitted += len(page)
+                yield page
+            page_token = resp.get('nextPageToken')
+            if not page_token or reached_seen:
                 break
 
-        # 2) Для каждого топ-коммента вытаскиваем ВСЕ реплаи через comments().list(parentId=...)
+        # 2) Реплаи: inline-ветки берём как есть, остальные — через comments().list(parentId=...)
         # (YouTube Data API возвращает все реплаи только этим способом)
-        i = 0
-        while i < len(comments) and len(comments) < max_results:
-            c = comments[i]
-            i += 1
-            if c["is_reply"]:
-                continue
-            parent_id = c["id"]
-
-            # Пагинируем ответы на данный топ-комментарий
-            rep_resp = self.youtube.comments().list(
-                part="snippet",
-                parentId=parent_id,
-                maxResults=100,
-                textFormat="plainText"
-            ).execute()
-
-            def push_replies(rr):
-                for itm in rr.get('items', []):
-                    sn = itm['snippet']
-                    comments.append({
-                        "id": itm['id'],
-                        "parent_id": parent_id,  # привязка к топ-комменту
-                        "is_reply": True,
-                        "author": sn.get('authorDisplayName', ''),
-                        "author_channel_id": sn.get('authorChannelId', {}).get('value', ''),
-                        "text": sn.get('textOriginal') or sn.get('textDisplay', ''),
-                        "likes": sn.get('likeCount', 0),
-                        "published_at": sn.get('publishedAt'),
-                        "updated_at": sn.get('updatedAt', sn.get('publishedAt'))
-                    })
-
-            push_replies(rep_resp)
-            while rep_resp.get('nextPageToken') and len(comments) < max_results:
-                rep_resp = self.youtube.comments().list(
-                    part="snippet",
-                    parentId=parent_id,
-                    pageToken=rep_resp['nextPageToken'],
-                    maxResults=100,
-                    textFormat="plainText"
-                ).execute()
-                push_replies(rep_resp)
-                if len(comments) >= max_results:
-                    break
+        if emitted >= max_results or not parents:
+            return
+
+        workers = max(1, reply_concurrency or self.reply_concurrency)
+        # (future, зарезервировано реплаев) в порядке родителей; выданные, но ещё не отданные
+        pending: deque = deque()
+        reserved = 0
+        next_parent = iter(parents)
 
-        return comments[:max_results]
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="yt-replies") as pool:
+            def submit_more():
+                # Бюджет резервируется при отправке: ветка забирает min(totalReplyCount, остаток),
+                # и резерв снимается, только когда её реплаи отданы. Так сумма запрошенного
+                # не превышает max_results, даже если futures готовы, но ещё не прочитаны.
+                # Вперёд выдаём не больше workers веток — и готовых, и выполняющихся.
+                nonlocal reserved
+                while len(pending) < workers:
+                    budget = max_results - emitted - reserved
+                    if budget <= 0:
+                        return
+                    parent_id = next(next_parent, None)
+                    if parent_id is None:
+                        return
+                    ready = thread_replies.pop(parent_id)
+                    if ready is not None:
+                        fut = Future()
+                        fut.set_result(ready[:budget])
+                        take = len(fut.result())
+                    else:
+                        take = min(budget, reply_totals[parent_id])
+                        fut = pool.submit(propagate_context(self._fetch_replies), parent_id, take)
+                    reserved += take
+                    pending.append((fut, take))
 
+            try:
+                submit_more()
+                while pending and emitted < max_results:
+                    fut, take = pending.popleft()
+                    reserved -= take
+                    replies = fut.result()[:max_results - emitted]
+                    if replies:
+                        emitted += len(replies)
+                        yield replies
+                    submit_more()
+            finally:
+                # Лимит набран (или потребитель остановился) — незапущенные ветки не нужны
+                for fut, _ in pending:
+                    fut.cancel()
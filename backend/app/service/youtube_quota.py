@@ -0,0 +1,201 @@
+# app/service/youtube_quota.py
+"""
+Учёт дневной квоты YouTube Data API.
+
+Квота считается в единицах (units) на ключ на сутки; сутки YouTube — по Тихоокеанскому
+времени (сброс в полночь PT). Журнал хранится в SQLite, поэтому общий для всех
+процессов uvicorn на одной машине.
+"""
+
+import hashlib
+import math
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional
+
+from ..config import settings
+
+try:
+    from zoneinfo import ZoneInfo
+    _PACIFIC = ZoneInfo("America/Los_Angeles")
+except Exception:  # нет tzdata — приближение без перехода на летнее время
+    _PACIFIC = timezone(timedelta(hours=-8))
+
+# Стоимость вызовов в единицах квоты (https://developers.google.com/youtube/v3/determine_quota_cost)
+METHOD_COSTS = {
+    "videos.list": 1,
+    "channels.list": 1,
+    "playlistItems.list": 1,
+    "commentThreads.list": 1,
+    "comments.list": 1,
+    "search.list": 100,
+}
+
+# Доля комментариев, для которых при оценке ожидаем отдельный comments().list
+REPLY_CALL_SHARE_INLINE = 0.05
+REPLY_CALL_SHARE = 0.3
+
+
+class QuotaExhausted(Exception):
+    """Все ключи исчерпали дневную квоту"""
+
+
+def quota_day(now: Optional[datetime] = None) -> str:
+    now = now or datetime.now(timezone.utc)
+    return now.astimezone(_PACIFIC).date().isoformat()
+
+
+def next_reset(now: Optional[datetime] = None) -> datetime:
+    now = (now or datetime.now(timezone.utc)).astimezone(_PACIFIC)
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight.astimezone(timezone.utc)
+
+
+def key_id(api_key: str) -> str:
+    """Ключ в журнал не пишем — только отпечаток"""
+    return hashlib.sha1(api_key.encode()).hexdigest()[:12]
+
+
+def estimate_job_units(comment_count: int, max_comments: int, inline_replies: bool = True,
+                       top_level_only: bool = False) -> int:
+    """Оценка стоимости ингеста видео по statistics.commentCount"""
+    n = min(comment_count, max_comments)
+    units = math.ceil(n / 100) if n else 1  # страницы commentThreads по 100
+    if not top_level_only:
+        share = REPLY_CALL_SHARE_INLINE if inline_replies else REPLY_CALL_SHARE
+        units += math.ceil(n * share)
+    return units
+
+
+class QuotaLedger:
+    def __init__(self, api_keys: List[str], daily_limit: int = 10000, db_path: str = "youtube_quota.db"):
+        self.api_keys = [k for k in api_keys if k]
+        self.daily_limit = daily_limit
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS quota_usage ("
+                " day TEXT NOT NULL, key_id TEXT NOT NULL,"
+                " units INTEGER NOT NULL DEFAULT 0, exhausted INTEGER NOT NULL DEFAULT 0,"
+                " PRIMARY KEY (day, key_id))"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _used(self, conn: sqlite3.Connection, day: str) -> Dict[str, tuple]:
+        rows = conn.execute("SELECT key_id, units, exhausted FROM quota_usage WHERE day = ?", (day,)).fetchall()
+        return {kid: (units, bool(exhausted)) for kid, units, exhausted in rows}
+
+    def charge(self, api_key: str, method: str, calls: int = 1) -> None:
+        units = METHOD_COSTS.get(method, 1) * calls
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT INTO quota_usage (day, key_id, units) VALUES (?, ?, ?) "
+                "ON CONFLICT(day, key_id) DO UPDATE SET units = units + excluded.units",
+                (quota_day(), key_id(api_key), units)
+            )
+
+    def mark_exhausted(self, api_key: str) -> None:
+        """API ответил quotaExceeded — ключ до сброса не используем"""
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT INTO quota_usage (day, key_id, units, exhausted) VALUES (?, ?, 0, 1) "
+                "ON CONFLICT(day, key_id) DO UPDATE SET exhausted = 1",
+                (quota_day(), key_id(api_key))
+            )
+
+    def remaining(self, api_key: str) -> int:
+        with self._connect() as conn:
+            units, exhausted = self._used(conn, quota_day()).get(key_id(api_key), (0, False))
+        return 0 if exhausted else max(0, self.daily_limit - units)
+
+    def total_remaining(self) -> int:
+        return sum(self.remaining(k) for k in self.api_keys)
+
+    def pick_key(self, exclude: Optional[List[str]] = None) -> Optional[str]:
+        """Ключ с наибольшим остатком квоты (None — все исчерпаны)"""
+        exclude = exclude or []
+        best, best_left = None, 0
+        for k in self.api_keys:
+            if k in exclude:
+                continue
+            left = self.remaining(k)
+            if left > best_left:
+                best, best_left = k, left
+        return best
+
+    def plan_job(self, comment_count: int, max_comments: int, inline_replies: bool = True) -> Dict:
+        """
+        Решает, как запускать ингест при текущем остатке квоты:
+            run    — хватает на полный ингест
+            shrink — только топ-комментарии (и, если надо, меньший max_comments)
+            defer  — квоты нет, отложить до сброса
+        """
+        left = self.total_remaining()
+        full = estimate_job_units(comment_count, max_comments, inline_replies)
+        top_only = estimate_job_units(comment_count, max_comments, inline_replies, top_level_only=True)
+        plan = {
+            "estimated_units": full,
+            "remaining_units": left,
+            "max_comments": max_comments,
+            "top_level_only": False,
+        }
+        if left >= full:
+            plan["action"] = "run"
+        elif left >= top_only:
+            plan.update(action="shrink", top_level_only=True, estimated_units=top_only)
+        elif left >= 2:
+            plan.update(action="shrink", top_level_only=True, estimated_units=left - 1,
+                        max_comments=(left - 1) * 100)
+        else:
+            plan.update(action="defer", retry_after=next_reset().isoformat())
+        return plan
+
+    def usage(self) -> Dict:
+        day = quota_day()
+        with self._connect() as conn:
+            used = self._used(conn, day)
+        keys = []
+        for k in self.api_keys:
+            units, exhausted = used.get(key_id(k), (0, False))
+            keys.append({
+                "key": f"…{k[-4:]}",
+                "used_units": units,
+                "remaining_units": 0 if exhausted else max(0, self.daily_limit - units),
+                "exhausted": exhausted,
+            })
+        return {
+            "day": day,
+            "daily_limit_per_key": self.daily_limit,
+            "resets_at": next_reset().isoformat(),
+            "total_remaining": sum(k["remaining_units"] for k in keys),
+            "keys": keys,
+        }
+
+
+_ledger: Optional[QuotaLedger] = None
+_ledger_lock = threading.Lock()
+
+
+def get_quota_ledger() -> QuotaLedger:
+    """Общий для процесса журнал квоты по ключам из настроек"""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = QuotaLedger(
+                api_keys=settings.youtube_keys,
+                daily_limit=settings.youtube_daily_quota,
+                db_path=settings.youtube_quota_db
+            )
+        return _ledger
@@ -0,0 +1,132 @@
+# app/storage/base.py
+"""
+Интерфейс хранилища: accounts, jobs, sources, comments и отчёты дашборда.
+
+Синхронные методы — для ингеста (воркеры, потоки), асинхронные fetch_* — для чтений
+дашборда из async-эндпоинтов. Строки — dict с колонками таблиц Supabase; отчёты
+повторяют представления v_comments_full и v_dashboard_aggregates.
+
+source_id_cache: (platform, ext_id) -> sources.id. Id source не меняется после
+создания, поэтому кэшируются только найденные; upsert_source и get_sources
+обновляют запись сразу, TTL ограничивает устаревание в других процессах.
+"""
+
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+from ..config import settings
+from ..service.ttl_cache import TTLCache
+
+source_id_cache = TTLCache(maxsize=settings.source_id_cache_size, ttl=settings.source_id_cache_ttl)
+
+
+class Storage(ABC):
+    name = "base"
+    # хранилище на локальном диске: ингест пишет в него сразу, без outbox
+    local = False
+
+    # --- запись (ингест) ---
+
+    @abstractmethod
+    def upsert_account(self, platform: str, handle: str, url: str, title: Optional[str] = None) -> str:
+        """accounts по (platform, handle) -> id"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def create_jobs(self, jobs: List[Dict], status: str = "queued") -> List[str]:
+        """[{source_type, input_url}] -> id в том же порядке"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_jobs(self, job_ids: List[str]) -> Dict[str, Dict]:
+        """id -> {id, status, stats_total, stats_processed, error}"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_job(self, job_id: str, payload: Dict) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_jobs(self, job_ids: List[str]) -> None:
+        """Удаляет jobs, так и не попавшие в очередь (проиграли склейку дублей)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def upsert_source(self, row: Dict) -> str:
+        """sources по (platform, ext_id) -> id"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_sources(self, platform: str, ext_ids: List[str]) -> Dict[str, Dict]:
+        """ext_id -> {id, ext_id, raw_meta}"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_source_meta(self, source_id: str, raw_meta: Dict) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def upsert_comments(self, rows: List[Dict]) -> int:
+        """Один пакет строк comments, идемпотентно по (source_id, ext_comment_id) -> записано строк"""
+        raise NotImplementedError
+
+    def is_transient(self, e: Exception) -> bool:
+        """Сбой, после которого запрос имеет смысл повторить"""
+        return False
+
+    # --- чтение (дашборд) ---
+
+    @abstractmethod
+    async def fetch_job(self, job_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def fetch_jobs(self, job_ids: List[str]) -> Dict[str, Dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def fetch_comments(self, source_ext_id: Optional[str] = None, status: Optional[str] = None,
+                             limit: int = 100, platform: str = "youtube") -> List[Dict]:
+        """Комментарии, новые первыми; source_ext_id — id контента на платформе (videoId, shortcode)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def fetch_comment(self, comment_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def fetch_report(self, platform: Optional[str] = None, account: Optional[str] = None,
+                           source_ext_id: Optional[str] = None, date_from: Optional[str] = None,
+                           date_to: Optional[str] = None, limit: int = 200) -> List[Dict]:
+        """Строки v_comments_full по фильтрам, новые первыми"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def fetch_aggregates(self) -> List[Dict]:
+        """Строки v_dashboard_aggregates"""
+        raise NotImplementedError
+
+    async def aclose(self) -> None:
+        pass
+
+
+_storage: Optional[Storage] = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> Storage:
+    """Хранилище процесса по STORAGE_BACKEND; реализация импортируется только выбранная"""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            if settings.storage_backend == "sqlite":
+                from .sqlite_storage import SQLiteStorage
+                _storage = SQLiteStorage(settings.storage_sqlite_db)
+            elif settings.storage_backend == "supabase":
+                from .supabase_storage import SupabaseStorage
+                _storage = SupabaseStorage(settings.supabase_url, settings.supabase_key)
+            else:
+                raise RuntimeError(f"Unknown STORAGE_BACKEND '{settings.storage_backend}' (supabase|sqlite)")
+            print(f"🗄️ Storage: {_storage.name}")
+        return _storage
@@ -0,0 +1,286 @@
+# app/storage/sqlite_storage.py
+"""
+Встроенное хранилище в одном SQLite файле (WAL): те же таблицы, что в Supabase,
+и те же представления v_comments_full / v_dashboard_aggregates.
+
+Для небольших установок без сетевых запросов к базе и для локальных замеров:
+весь конвейер (ингест, outbox, дашборд) работает и профилируется на одной машине.
+
+Результаты ML (спам, токсичность, ответы) лежат в comment_analysis и comment_replies
+и присоединяются к отчёту LEFT JOIN'ом: пока анализа нет — колонки NULL.
+JSON-колонки (raw_meta, meta, kb_refs, quality_flags) хранятся текстом и
+возвращаются dict/list, как из PostgREST.
+"""
+
+import asyncio
+import json
+import sqlite3
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import partial
+from typing import Dict, Iterator, List, Optional
+
+from .base import Storage
+
+JSON_COLUMNS = ("raw_meta", "meta", "kb_refs", "quality_flags")
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS accounts ("
+    " id TEXT PRIMARY KEY, platform TEXT NOT NULL, handle TEXT NOT NULL, url TEXT, title TEXT,"
+    " created_at TEXT NOT NULL, UNIQUE (platform, handle))",
+
+    "CREATE TABLE IF NOT EXISTS jobs ("
+    " id TEXT PRIMARY KEY, source_type TEXT NOT NULL, input_url TEXT NOT NULL, status TEXT NOT NULL,"
+    " stats_total INTEGER, stats_processed INTEGER, error TEXT,"
+    " created_at TEXT NOT NULL, updated_at TEXT NOT NULL)",
+
+    "CREATE TABLE IF NOT EXISTS sources ("
+    " id TEXT PRIMARY KEY, job_id TEXT, account_id TEXT REFERENCES accounts (id), platform TEXT NOT NULL,"
+    " ext_id TEXT NOT NULL, title TEXT, author TEXT, published_at TEXT, raw_meta TEXT NOT NULL DEFAULT '{}',"
+    " created_at TEXT NOT NULL, UNIQUE (platform, ext_id))",
+    "CREATE INDEX IF NOT EXISTS sources_account ON sources (account_id)",
+
+    "CREATE TABLE IF NOT EXISTS comments ("
+    " id TEXT PRIMARY KEY, source_id TEXT NOT NULL REFERENCES sources (id), ext_comment_id TEXT NOT NULL,"
+    " author_name TEXT, author_channel_id TEXT, text_raw TEXT, text_norm TEXT, created_at TEXT,"
+    " lang TEXT, status TEXT NOT NULL DEFAULT 'queued', meta TEXT NOT NULL DEFAULT '{}',"
+    " inserted_at TEXT NOT NULL, UNIQUE (source_id, ext_comment_id))",
+    # фильтры /comments и отчёта: по source, по статусу, по дате — все с сортировкой по дате
+    "CREATE INDEX IF NOT EXISTS comments_source_created ON comments (source_id, created_at DESC)",
+    "CREATE INDEX IF NOT EXISTS comments_status_created ON comments (status, created_at DESC)",
+    "CREATE INDEX IF NOT EXISTS comments_created ON comments (created_at DESC)",
+
+    "CREATE TABLE IF NOT EXISTS comment_analysis ("
+    " comment_id TEXT PRIMARY KEY REFERENCES comments (id), is_spam INTEGER, spam_score REAL,"
+    " is_toxic INTEGER, tox_score REAL, type_label TEXT, type_conf REAL, sentiment TEXT, sent_conf REAL)",
+
+    "CREATE TABLE IF NOT EXISTS comment_replies ("
+    " comment_id TEXT PRIMARY KEY REFERENCES comments (id), reply_lang TEXT, template_id TEXT,"
+    " text_reply TEXT, kb_refs TEXT, quality_flags TEXT)",
+
+    "CREATE VIEW IF NOT EXISTS v_comments_full AS SELECT"
+    " s.platform AS platform, a.handle AS account_handle, a.url AS account_url,"
+    " s.ext_id AS source_ext_id, s.title AS source_title,"
+    " c.id AS comment_id, c.author_name AS author_name, c.text_raw AS comment_text,"
+    " c.lang AS comment_lang, c.status AS comment_status, c.created_at AS commented_at,"
+    " an.is_spam, an.spam_score, an.is_toxic, an.tox_score, an.type_label, an.type_conf,"
+    " an.sentiment, an.sent_conf,"
+    " r.reply_lang, r.template_id, r.text_reply, r.kb_refs, r.quality_flags"
+    " FROM comments c JOIN sources s ON s.id = c.source_id"
+    " LEFT JOIN accounts a ON a.id = s.account_id"
+    " LEFT JOIN comment_analysis an ON an.comment_id = c.id"
+    " LEFT JOIN comment_replies r ON r.comment_id = c.id",
+
+    "CREATE VIEW IF NOT EXISTS v_dashboard_aggregates AS SELECT"
+    " s.platform AS platform, s.ext_id AS source_ext_id, s.title AS source_title,"
+    " COUNT(c.id) AS total_cnt, COALESCE(SUM(c.status = 'done'), 0) AS done_cnt,"
+    " COALESCE(1.0 * SUM(an.is_spam = 1) / NULLIF(COUNT(c.id), 0), 0) AS spam_rate,"
+    " COALESCE(1.0 * SUM(an.is_toxic = 1) / NULLIF(COUNT(c.id), 0), 0) AS toxic_rate,"
+    " AVG(an.spam_score) AS avg_spam_score, AVG(an.tox_score) AS avg_tox_score"
+    " FROM sources s LEFT JOIN comments c ON c.source_id = s.id"
+    " LEFT JOIN comment_analysis an ON an.comment_id = c.id"
+    " GROUP BY s.id",
+]
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _decode(row: sqlite3.Row) -> Dict:
+    d = dict(row)
+    for k in JSON_COLUMNS:
+        if isinstance(d.get(k), str):
+            d[k] = json.loads(d[k])
+    return d
+
+
+class SQLiteStorage(Storage):
+    name = "sqlite"
+    local = True
+
+    def __init__(self, db_path: str = "altel.db"):
+        self.db_path = db_path
+        with self._transaction() as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        """Чтение без блокировки записи (WAL)"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _select(self, sql: str, params: tuple = ()) -> List[Dict]:
+        with self._reader() as conn:
+            return [_decode(r) for r in conn.execute(sql, params).fetchall()]
+
+    async def _run(self, fn, *args):
+        """Блокирующий SQLite-запрос из async-эндпоинта — в пуле потоков"""
+        return await asyncio.get_running_loop().run_in_executor(None, partial(fn, *args))
+
+    # --- запись ---
+
+    def upsert_account(self, platform: str, handle: str, url: str, title: Optional[str] = None) -> str:
+        with self._transaction() as conn:
+            (account_id,) = conn.execute(
+                "INSERT INTO accounts (id, platform, handle, url, title, created_at) VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(platform, handle) DO UPDATE SET url = excluded.url, title = excluded.title"
+                " RETURNING id",
+                (str(uuid.uuid4()), platform, handle, url, title, _now())
+            ).fetchone()
+        return account_id
+
+    def create_jobs(self, jobs: List[Dict], status: str = "queued") -> List[str]:
+        now = _now()
+        job_ids = [str(uuid.uuid4()) for _ in jobs]
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO jobs (id, source_type, input_url, status, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [(job_id, j["source_type"], j["input_url"], status, now, now) for job_id, j in zip(job_ids, jobs)]
+            )
+        return job_ids
+
+    def get_jobs(self, job_ids: List[str]) -> Dict[str, Dict]:
+        rows = self._select(
+            "SELECT id, status, stats_total, stats_processed, error FROM jobs"
+            f" WHERE id IN ({','.join('?' * len(job_ids))})", tuple(job_ids)
+        )
+        return {row["id"]: row for row in rows}
+
+    def update_job(self, job_id: str, payload: Dict) -> None:
+        columns = [k for k in ("status", "stats_total", "stats_processed", "error") if k in payload]
+        with self._transaction() as conn:
+            conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in columns)}, updated_at = ? WHERE id = ?",
+                (*[payload[k] for k in columns], _now(), job_id)
+            )
+
+    def delete_jobs(self, job_ids: List[str]) -> None:
+        with self._transaction() as conn:
+            conn.execute(f"DELETE FROM jobs WHERE id IN ({','.join('?' * len(job_ids))})", tuple(job_ids))
+
+    def upsert_source(self, row: Dict) -> str:
+        with self._transaction() as conn:
+            (source_id,) = conn.execute(
+                "INSERT INTO sources (id, job_id, account_id, platform, ext_id, title, author, published_at,"
+                " raw_meta, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(platform, ext_id) DO UPDATE SET job_id = excluded.job_id,"
+                " account_id = excluded.account_id, title = excluded.title, author = excluded.author,"
+                " published_at = excluded.published_at, raw_meta = excluded.raw_meta"
+                " RETURNING id",
+                (str(uuid.uuid4()), row["job_id"], row["account_id"], row["platform"], row["ext_id"], row["title"],
+                 row["author"], row["published_at"], json.dumps(row.get("raw_meta") or {}), _now())
+            ).fetchone()
+        return source_id
+
+    def get_sources(self, platform: str, ext_ids: List[str]) -> Dict[str, Dict]:
+        rows = self._select(
+            "SELECT id, ext_id, raw_meta FROM sources"
+            f" WHERE platform = ? AND ext_id IN ({','.join('?' * len(ext_ids))})", (platform, *ext_ids)
+        )
+        return {row["ext_id"]: row for row in rows}
+
+    def update_source_meta(self, source_id: str, raw_meta: Dict) -> None:
+        with self._transaction() as conn:
+            conn.execute("UPDATE sources SET raw_meta = ? WHERE id = ?", (json.dumps(raw_meta), source_id))
+
+    def upsert_comments(self, rows: List[Dict]) -> int:
+        now = _now()
+        with self._transaction() as conn:
+            cur = conn.executemany(
+                "INSERT INTO comments (id, source_id, ext_comment_id, author_name, author_channel_id, text_raw,"
+                " text_norm, created_at, lang, status, meta, inserted_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(source_id, ext_comment_id) DO UPDATE SET author_name = excluded.author_name,"
+                " author_channel_id = excluded.author_channel_id, text_raw = excluded.text_raw,"
+                " text_norm = excluded.text_norm, created_at = excluded.created_at, lang = excluded.lang,"
+                " status = excluded.status, meta = excluded.meta",
+                [(str(uuid.uuid4()), r["source_id"], r["ext_comment_id"], r.get("author_name"),
+                  r.get("author_channel_id"), r.get("text_raw"), r.get("text_norm"), r.get("created_at"),
+                  r.get("lang"), r.get("status") or "queued", json.dumps(r.get("meta") or {}), now)
+                 for r in rows]
+            )
+            return cur.rowcount
+
+    def is_transient(self, e: Exception) -> bool:
+        # другой процесс держит запись дольше timeout
+        return isinstance(e, sqlite3.OperationalError) and "locked" in str(e)
+
+    # --- чтение ---
+
+    def _job(self, job_id: str) -> Optional[Dict]:
+        rows = self._select("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return rows[0] if rows else None
+
+    def _comments(self, source_ext_id: Optional[str], status: Optional[str], limit: int,
+                  platform: str) -> List[Dict]:
+        sql, params = "SELECT c.* FROM comments c", []
+        where = []
+        if source_ext_id:
+            sql += " JOIN sources s ON s.id = c.source_id"
+            where.append("s.platform = ? AND s.ext_id = ?")
+            params += [platform, source_ext_id]
+        if status:
+            where.append("c.status = ?")
+            params.append(status)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return self._select(sql + " ORDER BY c.created_at DESC LIMIT ?", (*params, limit))
+
+    def _comment(self, comment_id: str) -> Optional[Dict]:
+        rows = self._select("SELECT * FROM comments WHERE id = ?", (comment_id,))
+        return rows[0] if rows else None
+
+    def _report(self, platform, account, source_ext_id, date_from, date_to, limit) -> List[Dict]:
+        filters = [("platform = ?", platform), ("account_handle = ?", account),
+                   ("source_ext_id = ?", source_ext_id), ("commented_at >= ?", date_from),
+                   ("commented_at <= ?", date_to)]
+        used = [(clause, value) for clause, value in filters if value]
+        sql = "SELECT * FROM v_comments_full"
+        if used:
+            sql += " WHERE " + " AND ".join(clause for clause, _ in used)
+        return self._select(sql + " ORDER BY commented_at DESC LIMIT ?", (*[v for _, v in used], limit))
+
+    async def fetch_job(self, job_id: str) -> Optional[Dict]:
+        return await self._run(self._job, job_id)
+
+    async def fetch_jobs(self, job_ids: List[str]) -> Dict[str, Dict]:
+        return await self._run(self.get_jobs, job_ids)
+
+    async def fetch_comments(self, source_ext_id: Optional[str] = None, status: Optional[str] = None,
+                             limit: int = 100, platform: str = "youtube") -> List[Dict]:
+        return await self._run(self._comments, source_ext_id, status, limit, platform)
+
+    async def fetch_comment(self, comment_id: str) -> Optional[Dict]:
+        return await self._run(self._comment, comment_id)
+
+    async def fetch_report(self, platform: Optional[str] = None, account: Optional[str] = None,
+                           source_ext_id: Optional[str] = None, date_from: Optional[str] = None,
+                           date_to: Optional[str] = None, limit: int = 200) -> List[Dict]:
+        return await self._run(self._report, platform, account, source_ext_id, date_from, date_to, limit)
+
+    async def fetch_aggregates(self) -> List[Dict]:
+        return await self._run(self._select, "SELECT * FROM v_dashboard_aggregates")
@@ -0,0 +1,149 @@
+# app/storage/supabase_storage.py
+"""
+Хранилище в Supabase: запись — синхронным supabase-py, чтения дашборда — через
+асинхронный пул соединений к PostgREST (app/database_async.py).
+"""
+
+from typing import Dict, List, Optional
+
+import httpx
+from postgrest import APIError
+from postgrest.types import CountMethod, ReturnMethod
+from supabase import Client, create_client
+
+from ..database_async import get_async_db
+from .base import Storage, source_id_cache
+
+# коды ответа/ошибки PostgREST, после которых запрос имеет смысл повторить
+TRANSIENT_CODES = {"500", "502", "503", "504", "520", "522", "524", "57014"}
+
+
+class SupabaseStorage(Storage):
+    name = "supabase"
+
+    def __init__(self, url: str, key: str):
+        if not url or not key:
+            raise RuntimeError("Supabase creds missing. Check SUPABASE_URL and SUPABASE_SERVICE_KEY in .env")
+        self.client: Client = create_client(url, key)
+
+    def upsert_account(self, platform: str, handle: str, url: str, title: Optional[str] = None) -> str:
+        data = {"platform": platform, "handle": handle, "url": url, "title": title}
+        res = self.client.table("accounts").upsert(data, on_conflict="platform,handle").execute()
+        # supabase v2 возвращает список строк; берем id из первой
+        return res.data[0]["id"]
+
+    def create_jobs(self, jobs: List[Dict], status: str = "queued") -> List[str]:
+        rows = [{"source_type": j["source_type"], "input_url": j["input_url"], "status": status} for j in jobs]
+        res = self.client.table("jobs").insert(rows).execute()
+        return [row["id"] for row in res.data]
+
+    def get_jobs(self, job_ids: List[str]) -> Dict[str, Dict]:
+        res = self.client.table("jobs").select("id,status,stats_total,stats_processed,error") \
+            .in_("id", job_ids).execute()
+        return {row["id"]: row for row in res.data or []}
+
+    def update_job(self, job_id: str, payload: Dict) -> None:
+        self.client.table("jobs").update(payload).eq("id", job_id).execute()
+
+    def delete_jobs(self, job_ids: List[str]) -> None:
+        self.client.table("jobs").delete().in_("id", job_ids).execute()
+
+    def upsert_source(self, row: Dict) -> str:
+        res = self.client.table("sources").upsert(row, on_conflict="platform,ext_id").execute()
+        return res.data[0]["id"]
+
+    def get_sources(self, platform: str, ext_ids: List[str]) -> Dict[str, Dict]:
+        res = self.client.table("sources").select("id,ext_id,raw_meta").eq("platform", platform) \
+            .in_("ext_id", ext_ids).execute()
+        return {row["ext_id"]: row for row in res.data or []}
+
+    def update_source_meta(self, source_id: str, raw_meta: Dict) -> None:
+        self.client.table("sources").update({"raw_meta": raw_meta}).eq("id", source_id).execute()
+
+    def upsert_comments(self, rows: List[Dict]) -> int:
+        """
+        upsert без возврата строк (return=minimal), число строк — из Content-Range (count=exact).
+        Сам запрос отправляем через сессию построителя: postgrest-py на пустом теле ответа
+        возвращает count=0, не читая заголовок.
+        """
+        q = self.client.table("comments").upsert(rows, on_conflict="source_id,ext_comment_id",
+                                                 count=CountMethod.exact, returning=ReturnMethod.minimal)
+        r = q.session.request(q.http_method, q.path, json=q.json, params=q.params, headers=q.headers)
+        if not 200 <= r.status_code <= 299:
+            try:
+                error = r.json()
+            except ValueError:
+                error = {"message": r.text, "code": str(r.status_code)}
+            raise APIError(error)
+        content_range = r.headers.get("content-range", "")
+        total = content_range.split("/")[-1]
+        return int(total) if total.isdigit() else len(rows)
+
+    def is_transient(self, e: Exception) -> bool:
+        if isinstance(e, httpx.TransportError):
+            return True
+        code = str(getattr(e, "code", "") or "")
+        # PGRST000-003: PostgREST не может подключиться к базе
+        return isinstance(e, APIError) and (code in TRANSIENT_CODES or code.startswith("PGRST00"))
+
+    async def fetch_job(self, job_id: str) -> Optional[Dict]:
+        rows = await get_async_db().table("jobs").select("*").eq("id", job_id).limit(1).execute()
+        return rows[0] if rows else None
+
+    async def fetch_jobs(self, job_ids: List[str]) -> Dict[str, Dict]:
+        return await get_async_db().get_jobs(job_ids)
+
+    async def fetch_comments(self, source_ext_id: Optional[str] = None, status: Optional[str] = None,
+                             limit: int = 100, platform: str = "youtube") -> List[Dict]:
+        """
+        Один запрос к PostgREST: source_id из кэша, а при промахе — inner join на
+        sources по (platform, ext_id) прямо в запросе комментариев
+        """
+        db = get_async_db()
+        joined = False
+        if not source_ext_id:
+            q = db.table("comments").select("*")
+        else:
+            source_id = source_id_cache.get((platform, source_ext_id))
+            if source_id is not None:
+                q = db.table("comments").select("*").eq("source_id", source_id)
+            else:
+                joined = True
+                q = db.table("comments").select("*,sources!inner(platform,ext_id)") \
+                    .eq("sources.platform", platform).eq("sources.ext_id", source_ext_id)
+        if status:
+            q = q.eq("status", status)
+        rows = await q.order("created_at", desc=True).limit(limit).execute()
+        if joined:
+            for row in rows:
+                row.pop("sources", None)
+            if rows:
+                source_id_cache.set((platform, source_ext_id), rows[0]["source_id"])
+        return rows
+
+    async def fetch_comment(self, comment_id: str) -> Optional[Dict]:
+        rows = await get_async_db().table("comments").select("*").eq("id", comment_id).limit(1).execute()
+        return rows[0] if rows else None
+
+    async def fetch_report(self, platform: Optional[str] = None, account: Optional[str] = None,
+                           source_ext_id: Optional[str] = None, date_from: Optional[str] = None,
+                           date_to: Optional[str] = None, limit: int = 200) -> List[Dict]:
+        q = get_async_db().table("v_comments_full").select("*")
+        if platform:
+            q = q.eq("platform", platform)
+        if account:
+            q = q.eq("account_handle", account)
+        if source_ext_id:
+            q = q.eq("source_ext_id", source_ext_id)
+        # date range по commented_at (ISO8601)
+        if date_from:
+            q = q.gte("commented_at", date_from)
+        if date_to:
+            q = q.lte("commented_at", date_to)
+        return await q.order("commented_at", desc=True).limit(limit).execute() or []
+
+    async def fetch_aggregates(self) -> List[Dict]:
+        return await get_async_db().table("v_dashboard_aggregates").select("*").execute()
+
+    async def aclose(self) -> None:
+        await get_async_db().aclose()
@@ -0,0 +1,217 @@
+# app/worker.py
+"""
+Воркер очереди ингеста.
+
+    python -m app.worker --concurrency 4 --platforms youtube,instagram
+
+Захватывает задачи из очереди (app/service/job_queue.py), выполняет их в пуле потоков
+и продлевает lease, пока задача выполняется. Воркеров можно запускать сколько угодно
+и где угодно с доступом к файлу очереди; лимиты по платформам общие для всех.
+SIGTERM/SIGINT: новые задачи не захватываются, начатые доводятся до конца.
+Отмена (POST /parser/jobs/{id}/cancel) и дедлайн job прерывают ингест на ближайшей
+проверке — воркер и квота освобождаются сразу, записанные комментарии остаются.
+
+Комментарии ингест пишет в локальный outbox (app/service/comment_outbox.py); его
+flusher работает в воркере и при сбое хранилища дописывает их позже. Если хранилище
+не отвечает и на метаданные (source, job), задача возвращается в очередь.
+
+Воркер же раз в WATCHLIST_POLL_INTERVAL ставит в очередь обходы watchlist, которым
+пора (app/routers/watchlist.py); после обхода пересчитывает интервал цели.
+"""
+
+import argparse
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from .config import settings
+from .database import StorageUnavailable, mark_job
+from .routers.parser import refresh_bulk_parents, run_parse_job
+from .routers.service.instagram_session_pool import close_session_pool
+from .routers.watchlist import record_watch_result, schedule_due
+from .service.cancellation import CancelToken, JobCancelled, job_scope
+from .service.comment_outbox import get_comment_outbox
+from .service.job_queue import JobQueue, RetryLater, get_job_queue
+from .service.youtube_client import get_client_pool
+
+
+class Worker:
+    def __init__(self, queue: JobQueue, concurrency: int = 4, platforms: Optional[List[str]] = None,
+                 poll_interval: float = 2.0, watchlist: bool = True):
+        self.queue = queue
+        self.concurrency = concurrency
+        self.platforms = platforms
+        self.poll_interval = poll_interval
+        self.watchlist = watchlist
+        self._next_watch_check = 0.0
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._done = threading.Event()  # все задачи завершены, пул закрыт
+        self._active: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def stop(self, *_) -> None:
+        if not self._stop.is_set():
+            print(f"🛑 Worker {self.worker_id} stopping, waiting for {len(self._active)} running job(s)")
+        self._stop.set()
+
+    @staticmethod
+    def _token_for(job: Dict) -> CancelToken:
+        """Дедлайн: timeout_seconds запроса или JOB_TIMEOUT, отсчёт от начала попытки"""
+        timeout = job["payload"].get("timeout_seconds") or settings.job_timeout
+        return CancelToken(deadline=time.time() + timeout if timeout else None)
+
+    def _execute(self, job: Dict) -> None:
+        job_id = job["job_id"]
+        finished, succeeded = True, False
+        try:
+            with job_scope(job["token"]):
+                mark_job(job_id, status="running")
+                run_parse_job(job["platform"], job_id, job["payload"])
+            self.queue.complete(job_id, self.worker_id)
+            succeeded = True
+            print(f"✅ Job {job_id} done")
+        except JobCancelled as e:
+            # статус (cancelled / timed_out) в Supabase уже выставлен ингестом
+            self.queue.cancelled(job_id, self.worker_id, e.status, str(e))
+            print(f"🛑 Job {job_id} {e.status}: {e}")
+        except RetryLater as e:
+            finished = False
+            self.queue.retry_later(job_id, self.worker_id, e.retry_after, str(e))
+            print(f"⏳ Job {job_id} re-queued in {e.retry_after / 60:.0f} min: {e}")
+        except StorageUnavailable as e:
+            # уже полученные комментарии в outbox; попытка не засчитывается
+            finished = False
+            self.queue.retry_later(job_id, self.worker_id, settings.storage_retry_after, str(e))
+            print(f"⏳ Job {job_id} re-queued: storage unavailable: {e}")
+        except Exception as e:
+            # статус job в Supabase уже выставлен ингестом (mark_job error)
+            self.queue.fail(job_id, self.worker_id, str(e))
+            print(f"❌ Job {job_id} failed: {e}")
+        finally:
+            with self._lock:
+                self._active.pop(job_id, None)
+        if finished:
+            self._after_finish(job_id, succeeded, bool(job["payload"].get("incremental")))
+
+    @staticmethod
+    def _after_finish(job_id: str, succeeded: bool, incremental: bool = False) -> None:
+        """Прогресс bulk job и интервал watchlist; ошибка здесь не влияет на саму задачу"""
+        try:
+            refresh_bulk_parents(job_id)
+            record_watch_result(job_id, succeeded, incremental)
+        except Exception as e:
+            print(f"⚠️ Cannot update bulk jobs / watchlist of {job_id}: {e}")
+
+    def _schedule_watchlist(self) -> None:
+        if not self.watchlist or time.time() < self._next_watch_check:
+            return
+        self._next_watch_check = time.time() + settings.watchlist_poll_interval
+        try:
+            schedule_due()
+        except Exception as e:
+            print(f"⚠️ Watchlist scheduling failed: {e}")
+
+    def _heartbeat_loop(self) -> None:
+        """
+        Каждые JOB_CANCEL_POLL_INTERVAL сек — запросы отмены выполняемых задач,
+        каждые lease_seconds / 3 — продление lease.
+        Сбой очереди (database is locked, диск) поток не останавливает: без продления
+        lease истечёт и задачу возьмёт второй воркер, пока эта ещё выполняется.
+        """
+        lease_interval = max(self.queue.lease_seconds / 3, 1)
+        next_lease = 0.0
+        while not self._done.wait(settings.job_cancel_poll_interval):
+            with self._lock:
+                active = dict(self._active)
+            try:
+                for job_id in self.queue.cancel_requested(list(active)):
+                    if not active[job_id]["token"].cancelled:
+                        print(f"🛑 Cancelling job {job_id}")
+                        active[job_id]["token"].cancel()
+            except Exception as e:
+                print(f"⚠️ Cannot check cancel requests: {e}")
+            if time.time() < next_lease:
+                continue
+            next_lease = time.time() + lease_interval
+            for job_id in active:
+                try:
+                    if not self.queue.heartbeat(job_id, self.worker_id):
+                        print(f"⚠️ Lost lease of job {job_id} — it may be run again by another worker")
+                except Exception as e:
+                    next_lease = 0.0  # повторяем на следующем тике, а не через lease_interval
+                    print(f"⚠️ Heartbeat of job {job_id} failed, will retry: {e}")
+
+    def _poll(self, pool: ThreadPoolExecutor) -> bool:
+        """Одна итерация цикла воркера. Returns: захвачена ли задача"""
+        for job_id in self.queue.requeue_expired():
+            mark_job(job_id, status="error", error="Worker lease expired too many times")
+            self._after_finish(job_id, succeeded=False)
+        self._schedule_watchlist()
+
+        claimed = False
+        while len(self._active) < self.concurrency and not self._stop.is_set():
+            job = self.queue.claim(self.worker_id, self.platforms)
+            if job is None:
+                break
+            claimed = True
+            job["token"] = self._token_for(job)
+            with self._lock:
+                self._active[job["job_id"]] = job
+            print(f"📥 Job {job['job_id']} ({job['platform']}), attempt {job['attempts']}")
+            pool.submit(self._execute, job)
+        return claimed
+
+    def run(self) -> None:
+        print(f"🚀 Worker {self.worker_id}: concurrency={self.concurrency}, "
+              f"platforms={self.platforms or 'all'}")
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True)
+        heartbeat.start()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="job") as pool:
+            while not self._stop.is_set():
+                try:
+                    claimed = self._poll(pool)
+                except Exception as e:
+                    # очередь или хранилище недоступны — выполняемые задачи не трогаем, повторяем позже
+                    print(f"⚠️ Worker {self.worker_id} poll failed, will retry: {e}")
+                    claimed = False
+                if not claimed:
+                    self._stop.wait(self.poll_interval)
+
+        self._done.set()
+        heartbeat.join(timeout=1)
+        print(f"👋 Worker {self.worker_id} stopped")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Altel AI Moderator ingest worker")
+    parser.add_argument("--concurrency", type=int, default=4, help="Задач одновременно в этом процессе")
+    parser.add_argument("--platforms", default="", help="Только эти платформы, через запятую")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="Сек между опросами пустой очереди")
+    parser.add_argument("--no-watchlist", action="store_true", help="Не планировать обходы watchlist")
+    args = parser.parse_args()
+
+    platforms = [p.strip() for p in args.platforms.split(",") if p.strip()] or None
+    worker = Worker(get_job_queue(), args.concurrency, platforms, args.poll_interval,
+                    watchlist=not args.no_watchlist)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    outbox = get_comment_outbox()
+    outbox.start()  # в том числе строки, оставшиеся от прошлого запуска
+    try:
+        worker.run()
+    finally:
+        get_client_pool().close()
+        close_session_pool()
+        left = outbox.close(settings.outbox_drain_timeout)
+        if left:
+            print(f"📦 {left} comments stay in outbox, will be flushed on next start")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Dead letter в outbox комментариев: строки, которые хранилище не принимает, не
+повторяются вечно и не держат outbox_pending job выше нуля.
+
+upsert_comment_rows подменён фейковым хранилищем, события job собираются в список.
+
+    cd backend && python -m pytest tests/test_comment_outbox.py
+"""
+
+import pytest
+
+from app.service import comment_outbox as co
+from app.service.bulk_writer import BulkWriter
+
+POISON = {"13", "77"}
+
+
+class FakeStorage:
+    """Отвергает строки POISON (ValueError — не сбой), пока down — отвечает ConnectionError (сбой)"""
+
+    def __init__(self):
+        self.rows = {}
+        self.down = False
+
+    def is_transient(self, e: Exception) -> bool:
+        return isinstance(e, ConnectionError)
+
+    def upsert(self, rows):
+        if self.down:
+            raise ConnectionError("storage unavailable")
+        if any(r["ext_comment_id"] in POISON for r in rows):
+            raise ValueError("violates check constraint")
+        self.rows.update({r["ext_comment_id"]: r for r in rows})
+        return len(rows)
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    storage = FakeStorage()
+    monkeypatch.setattr(co, "upsert_comment_rows", storage.upsert)
+    monkeypatch.setattr(co, "get_storage", lambda: storage)
+    monkeypatch.setattr(co, "get_bulk_writer", lambda: BulkWriter(max_rows=50, max_attempts=1))
+    return storage
+
+
+@pytest.fixture
+def events(monkeypatch):
+    events = []
+    monkeypatch.setattr(co, "publish_event", lambda job_id, type_, **data: events.append((job_id, type_, data)))
+    return events
+
+
+def _outbox(tmp_path, **kwargs) -> co.CommentOutbox:
+    outbox = co.CommentOutbox(str(tmp_path / "outbox.db"), batch_size=500, max_backoff=0, **kwargs)
+    outbox.start = lambda: None  # проходы flusher'а — только из теста
+    return outbox
+
+
+def _rows(count: int):
+    return [{"source_id": "s1", "ext_comment_id": str(i), "text": f"comment {i}"} for i in range(count)]
+
+
+def test_rejected_rows_move_to_dead_letter(tmp_path, storage, events):
+    outbox = _outbox(tmp_path)
+    outbox.append("job", _rows(200))
+
+    assert outbox.flush_once() == {"flushed": 198, "failed": 0, "dead": 2}
+    assert set(storage.rows) == {str(i) for i in range(200)} - POISON
+    assert outbox.pending("job") == 0
+    assert outbox.failed("job") == 2
+    assert outbox.metrics()["dead"] == 2
+    assert events == [("job", "write", {"rows": 198, "failed": 2, "pending": 0, "seconds": None, "chunks": None})]
+    # больше нечего повторять
+    assert outbox.flush_once() == {"flushed": 0, "failed": 0}
+
+
+def test_transient_errors_retry_until_max_attempts(tmp_path, storage, events):
+    storage.down = True
+    outbox = _outbox(tmp_path, max_attempts=3)
+    outbox.append("job", _rows(10))
+
+    for _ in range(2):
+        assert outbox.flush_once() == {"flushed": 0, "failed": 10, "dead": 0}
+        assert outbox.pending("job") == 10
+    assert outbox.flush_once() == {"flushed": 0, "failed": 0, "dead": 10}
+    assert outbox.pending("job") == 0
+    assert outbox.failed("job") == 10
+
+
+def test_written_row_clears_its_dead_letter(tmp_path, storage, events):
+    outbox = _outbox(tmp_path)
+    outbox.append("job", _rows(20))
+    outbox.flush_once()
+    assert outbox.failed("job") == 1
+
+    POISON.discard("13")
+    try:
+        outbox.append("job", [r for r in _rows(20) if r["ext_comment_id"] == "13"])
+        outbox.flush_once()
+    finally:
+        POISON.add("13")
+    assert outbox.failed("job") == 0
+    assert "13" in storage.rows
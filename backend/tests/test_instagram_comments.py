@@ -0,0 +1,111 @@
+"""
+Комментарии большого поста Instagram (больше страницы GraphQL): iPhone endpoint,
+лимитер на каждый запрос и продолжение обхода с чекпоинта.
+
+context.get_iphone_json / get_json подменены фейковым сервером: как в instaloader,
+get_iphone_json ходит через get_json с host i.instagram.com; GraphQL запрос — ошибка теста.
+
+    cd backend && python -m pytest tests/test_instagram_comments.py
+"""
+
+import sqlite3
+from types import SimpleNamespace
+
+import instaloader
+import pytest
+
+from app.routers.service.instagram_comment_cursors import CommentCursorStore
+from app.routers.service.instagram_parser import InstagramParser
+from app.routers.service.instagram_rate_limit_manager import RateLimitManager
+
+COMMENTS = 120
+API_PAGE = 20
+
+
+class FakeIPhoneServer:
+    """api/v1/media/{id}/comments/: от новых к старым, страницами по API_PAGE, курсор — min_id"""
+
+    def __init__(self, count: int = COMMENTS):
+        self.ids = [str(1000 + i) for i in reversed(range(count))]
+        self.requests = []
+
+    def get_iphone_json(self, context, path, params):
+        return context.get_json(path, params, "i.instagram.com")
+
+    def get_json(self, context, path, params=None, host="www.instagram.com", *args, **kwargs):
+        assert host == "i.instagram.com", "large posts must not page through GraphQL"
+        assert path == "api/v1/media/42/comments/"
+        self.requests.append(params.get("min_id"))
+        start = int(params.get("min_id") or 0)
+        page = self.ids[start:start + API_PAGE]
+        data = {"comments": [{"pk": c, "text": f"comment {c}", "created_at": 1_700_000_000 + int(c),
+                              "user": {"pk": 7, "username": "fan"}, "comment_like_count": 1} for c in page]}
+        if start + API_PAGE < len(self.ids):
+            data["next_min_id"] = str(start + API_PAGE)
+        return data
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeIPhoneServer()
+    # функции, а не bound-методы: первым аргументом приходит сам context
+    monkeypatch.setattr(instaloader.InstaloaderContext, "get_iphone_json",
+                        lambda context, *args, **kwargs: server.get_iphone_json(context, *args, **kwargs))
+    monkeypatch.setattr(instaloader.InstaloaderContext, "get_json",
+                        lambda context, *args, **kwargs: server.get_json(context, *args, **kwargs))
+    return server
+
+
+@pytest.fixture
+def parser(server, tmp_path):
+    limiter = RateLimitManager("big", str(tmp_path / "rate_limit.db"), min_interval=0.001,
+                               start_interval=0.001, burst=100, max_requests_per_hour=10 ** 6)
+    parser = InstagramParser(rate_limiter=limiter)
+    parser.logged_in = True
+    return parser
+
+
+def _post(parser: InstagramParser) -> SimpleNamespace:
+    return SimpleNamespace(shortcode="BIG", mediaid=42, comments=COMMENTS, _context=parser.L.context)
+
+
+def _ids(pages) -> list:
+    return [c["id"] for page in pages for c in page]
+
+
+def test_large_post_pages_through_iphone_endpoint(parser, server, tmp_path):
+    pages = list(parser.iter_comment_pages("BIG", max_results=1000, page_size=50, post=_post(parser)))
+
+    assert [len(p) for p in pages] == [50, 50, 20]
+    assert _ids(pages) == server.ids
+    assert server.requests == [None, "20", "40", "60", "80", "100"]
+    # каждый запрос — ровно один токен лимитера, вложенный get_json второй не берёт
+    with sqlite3.connect(str(tmp_path / "rate_limit.db")) as conn:
+        (tokens,) = conn.execute("SELECT COUNT(*) FROM rate_requests WHERE name = 'big'").fetchone()
+    assert tokens == len(server.requests)
+
+
+def test_large_post_resumes_from_checkpoint(parser, server, tmp_path):
+    store = CommentCursorStore(str(tmp_path / "cursors"))
+    checkpoint = store.checkpoint("BIG")
+    pages = parser.iter_comment_pages("BIG", max_results=1000, page_size=50, post=_post(parser),
+                                      checkpoint=checkpoint)
+    first = next(pages)
+    checkpoint.persisted(first)  # первая страница записана, затем процесс оборвался
+    pages.close()
+
+    resumed = store.checkpoint("BIG")
+    assert resumed.resume_state["endpoint"] == "iphone"
+    assert resumed.resume_state["total_index"] == 50
+    assert resumed.persisted_count == 50
+    rest = []
+    for page in parser.iter_comment_pages("BIG", max_results=1000, page_size=50, post=_post(parser),
+                                          checkpoint=resumed):
+        rest.append(page)
+        resumed.persisted(page)
+
+    assert _ids([first]) + _ids(rest) == server.ids
+    # остаток третьей страницы — из чекпоинта: ни одна страница не запрошена дважды
+    assert server.requests == [None, "20", "40", "60", "80", "100"]
+    # обход завершён и всё записано — чекпоинт удалён
+    assert store.load("BIG") is None
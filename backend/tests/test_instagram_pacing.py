@@ -0,0 +1,155 @@
+"""
+AIMD темп Instagram (InstagramParser + RateLimitManager) против симулированного сервера.
+
+context.get_json подменён сценарием ответов (OK / 429), время — виртуальное:
+паузы лимитера и блокировки после 429 сдвигают часы, а не ждут на самом деле.
+
+    cd backend && python -m pytest tests/test_instagram_pacing.py
+"""
+
+from collections import deque
+
+import instaloader
+import pytest
+
+from app.routers.service import instagram_parser as ip
+from app.routers.service import instagram_rate_limit_manager as rl
+from app.routers.service.instagram_parser import InstagramParser
+from app.routers.service.instagram_rate_limit_manager import RateLimitManager
+
+START_INTERVAL = 5.0
+RATE_INCREASE = 0.01
+RATE_DECREASE = 0.5
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0  # мелкие паузы лимитера не теряются в округлении float
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += max(0.0, seconds)
+
+
+class FakeServer:
+    """Отвечает на get_json по сценарию ('ok' / '429'), а после него — по лимиту запросов в минуту"""
+
+    def __init__(self, clock: FakeClock, script=(), per_minute=None):
+        self.clock = clock
+        self.script = deque(script)
+        self.per_minute = per_minute
+        self.recent = deque()
+        self.requests = 0
+        self.rejected = 0
+
+    def get_json(self, context, path, params=None, **kwargs):
+        self.requests += 1
+        self.clock.now += 0.3  # время ответа
+        if self.script:
+            reply = self.script.popleft()
+        else:
+            while self.recent and self.recent[0] < self.clock.now - 60:
+                self.recent.popleft()
+            self.recent.append(self.clock.now)
+            reply = "429" if len(self.recent) > self.per_minute else "ok"
+        if reply == "429":
+            self.rejected += 1
+            self.recent.clear()
+            raise instaloader.exceptions.ConnectionException("429 Too Many Requests")
+        return {"data": {}}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rl, "time", clock)
+    monkeypatch.setattr(ip, "interruptible_sleep", clock.sleep)
+    return clock
+
+
+def _parser(monkeypatch, tmp_path, server: FakeServer, name: str = "acc", **limiter_kwargs) -> InstagramParser:
+    monkeypatch.setattr(instaloader.InstaloaderContext, "get_json", server.get_json)
+    limiter_kwargs = {"min_interval": 1.0, "start_interval": START_INTERVAL, "max_interval": 300.0,
+                      "rate_increase": RATE_INCREASE, "rate_decrease": RATE_DECREASE, **limiter_kwargs}
+    limiter = RateLimitManager(name, str(tmp_path / "rate_limit.db"), max_requests_per_hour=10 ** 6,
+                               **limiter_kwargs)
+    return InstagramParser(rate_limiter=limiter)
+
+
+def _rate(parser: InstagramParser) -> float:
+    """Выученный темп, запросов/сек"""
+    return parser.rate_limiter.status()["pace_requests_per_minute"] / 60
+
+
+def _call(parser: InstagramParser) -> bool:
+    try:
+        parser.L.context.get_json("graphql/query", {})
+        return True
+    except instaloader.exceptions.ConnectionException:
+        return False
+
+
+def test_rate_grows_additively_and_drops_multiplicatively(monkeypatch, tmp_path, clock):
+    server = FakeServer(clock, script=["ok"] * 10 + ["429", "429"] + ["ok"] * 5)
+    parser = _parser(monkeypatch, tmp_path, server)
+    rate = 1 / START_INTERVAL
+
+    for _ in range(10):
+        assert _call(parser)
+        rate += RATE_INCREASE
+        assert _rate(parser) == pytest.approx(rate, abs=1e-3)
+
+    assert not _call(parser)
+    rate *= RATE_DECREASE
+    assert _rate(parser) == pytest.approx(rate, abs=1e-3)
+    blocked_for = parser.rate_limiter.status()["blocked_for_seconds"]
+    assert blocked_for > 0
+
+    # следующий запрос ждёт конец блокировки; второй 429 подряд снова делит темп
+    blocked_until = clock.now + blocked_for
+    assert not _call(parser)
+    assert clock.now >= blocked_until
+    rate *= RATE_DECREASE
+    assert _rate(parser) == pytest.approx(rate, abs=1e-3)
+
+    # после блокировки темп снова растёт на RATE_INCREASE за ответ
+    for _ in range(5):
+        assert _call(parser)
+        rate += RATE_INCREASE
+        assert _rate(parser) == pytest.approx(rate, abs=1e-3)
+    assert parser.rate_limit_hits == 2
+    assert server.requests == 17
+
+
+def _simulate(parser: InstagramParser, server: FakeServer, clock: FakeClock, capacity: list) -> dict:
+    """Прогон по фазам (запросов в минуту, часов); Returns: успешных запросов и отказов сервера"""
+    ok = 0
+    for per_minute, hours in capacity:
+        server.per_minute = per_minute
+        phase_end = clock.now + hours * 3600
+        while clock.now < phase_end:
+            ok += _call(parser)
+    return {"ok": ok, "rejected": server.rejected}
+
+
+def test_adaptive_pace_beats_fixed_pace(monkeypatch, tmp_path, clock):
+    # сервер пропускает 20 запросов в минуту, через 2 часа — 6
+    capacity = [(20, 2), (6, 2)]
+
+    # прежний фиксированный темп: ~8.75 с на запрос (паузы 3 с, 2-5 с на 10 комментариев, разброс)
+    fixed_server = FakeServer(clock)
+    fixed = _parser(monkeypatch, tmp_path, fixed_server, name="fixed", min_interval=8.75,
+                    start_interval=8.75, rate_increase=0.0, rate_decrease=1.0)
+    fixed_result = _simulate(fixed, fixed_server, clock, capacity)
+
+    # AIMD с настройками по умолчанию
+    aimd_server = FakeServer(clock)
+    aimd = _parser(monkeypatch, tmp_path, aimd_server, name="aimd", rate_increase=0.0005, rate_decrease=0.5)
+    aimd_result = _simulate(aimd, aimd_server, clock, capacity)
+
+    assert aimd_result["ok"] > fixed_result["ok"]
+    assert aimd_result["rejected"] <= fixed_result["rejected"]
+    # выученный темп держится под ёмкостью сервера
+    assert _rate(aimd) * 60 <= 6
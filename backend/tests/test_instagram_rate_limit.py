@@ -0,0 +1,89 @@
+"""
+RateLimitManager под нагрузкой из нескольких процессов: один SQLite файл,
+общие для всех процессов token bucket и скользящее окно.
+
+    cd backend && python -m pytest tests/test_instagram_rate_limit.py
+"""
+
+import multiprocessing as mp
+import sqlite3
+import time
+
+from app.routers.service.instagram_rate_limit_manager import RateLimitManager
+
+PROCESSES = 6
+
+
+def _hammer(db_path: str, limiter_kwargs: dict, start, deadline: float, out) -> None:
+    """Процесс: забирает токены, пока не истечёт deadline; отдаёт моменты выдачи"""
+    limiter = RateLimitManager("shared", db_path, **limiter_kwargs)
+    start.wait()
+    granted = []
+    while time.time() < deadline:
+        ok, wait_time = limiter.try_acquire()
+        if ok:
+            granted.append(time.time())
+        else:
+            time.sleep(min(wait_time, 0.01))
+    out.put(granted)
+
+
+def _run(db_path: str, limiter_kwargs: dict, duration: float) -> list:
+    RateLimitManager("shared", db_path, **limiter_kwargs)  # схема до старта процессов
+    start = mp.Event()
+    out = mp.Queue()
+    deadline = time.time() + 2 + duration  # запас на запуск процессов
+    procs = [mp.Process(target=_hammer, args=(db_path, limiter_kwargs, start, deadline, out))
+             for _ in range(PROCESSES)]
+    for p in procs:
+        p.start()
+    time.sleep(deadline - duration - time.time())
+    start.set()
+    results = [out.get(timeout=duration + 30) for _ in procs]
+    for p in procs:
+        p.join(timeout=10)
+    return sorted(ts for granted in results for ts in granted)
+
+
+def test_hourly_window_is_global_across_processes(tmp_path):
+    db_path = str(tmp_path / "rate_limit.db")
+    limiter_kwargs = {"min_interval": 0.001, "start_interval": 0.001, "burst": 5, "max_requests_per_hour": 40}
+
+    granted = _run(db_path, limiter_kwargs, duration=1.5)
+
+    # каждый процесс упирается в окно, но вместе — ровно лимит, не 6 x 40
+    assert len(granted) == 40
+    status = RateLimitManager("shared", db_path, **limiter_kwargs).status()
+    assert status["requests_made"] == 40
+    assert status["requests_remaining"] == 0
+    assert not status["can_request"]
+
+
+def test_token_bucket_rate_is_global_across_processes(tmp_path):
+    db_path = str(tmp_path / "rate_limit.db")
+    interval = 0.05
+    duration = 2.0
+    limiter_kwargs = {"min_interval": interval, "start_interval": interval, "burst": 1,
+                      "max_requests_per_hour": 100000}
+
+    granted = _run(db_path, limiter_kwargs, duration=duration)
+
+    # общий темп — один токен на interval на все процессы, а не на каждый
+    assert len(granted) <= duration / interval + 2
+    assert len(granted) >= duration / interval * 0.5
+    # моменты выдачи, записанные внутри транзакции, — без задержки возврата в процесс
+    with sqlite3.connect(db_path) as conn:
+        issued = [ts for (ts,) in conn.execute("SELECT ts FROM rate_requests WHERE name = 'shared' ORDER BY ts")]
+    assert len(issued) == len(granted)
+    gaps = [b - a for a, b in zip(issued, issued[1:])]
+    assert min(gaps) >= interval * 0.99
+
+
+def test_rate_limit_blocks_every_process(tmp_path):
+    db_path = str(tmp_path / "rate_limit.db")
+    limiter_kwargs = {"min_interval": 0.001, "start_interval": 0.001, "burst": 5, "max_requests_per_hour": 1000}
+    RateLimitManager("shared", db_path, **limiter_kwargs).record_rate_limit()
+
+    granted = _run(db_path, limiter_kwargs, duration=0.5)
+
+    assert granted == []